@@ -0,0 +1,129 @@
+import itertools
+import math
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import METRICS
+
+
+class SuccessiveHalving:
+    """Adaptive docking budget: every compound gets a small search, the best 1/eta get eta times more, and so on
+
+    Rung r docks its survivors with attempts searches of min_evaluations * eta**r / attempts
+    pose evaluations each. Every rung costs about the same as the first, so the number of
+    rungs follows from budget (total pose evaluations) when given. A compound whose best
+    score improves by less than tolerance over a rung has converged and keeps its score
+    without further promotion.
+    """
+
+    def __init__(self, screener, min_evaluations=500, eta=3, budget=None, max_rungs=None, attempts=1,
+                 tolerance=0.1, min_survivors=1):
+        if eta < 2:
+            raise ValueError("eta must be at least 2")
+        self.screener = screener
+        self.min_evaluations = min_evaluations
+        self.eta = eta
+        self.budget = budget
+        self.max_rungs = max_rungs
+        self.attempts = attempts
+        self.tolerance = tolerance
+        self.min_survivors = min_survivors
+
+    def schedule(self, n_compounds):
+        """Planned (compounds docked, pose evaluations per compound) of every rung
+
+        An upper bound on what run() spends: searches stop within their budget, and
+        convergence and failures drop compounds early.
+        """
+        rungs = []
+        survivors = n_compounds
+        while survivors >= 1 and (self.max_rungs is None or len(rungs) < self.max_rungs):
+            evaluations = self.min_evaluations * self.eta ** len(rungs)
+            spent = sum(count * each for count, each in rungs)
+            if rungs and self.budget is not None and spent + survivors * evaluations > self.budget:
+                break
+            rungs.append((survivors, evaluations))
+            if survivors <= self.min_survivors:
+                break
+            survivors = max(math.ceil(survivors / self.eta), self.min_survivors)
+        return rungs
+
+    def run(self, records, seed=None, **options):
+        """Screen (name, smiles) records adaptively; returns rows ranked by best score
+
+        Rows carry the screening columns plus Rung (the last rung a compound was docked in),
+        Evaluations (pose evaluations actually spent on it) and Converged. Rung 0 streams
+        the records and later rungs re-dock survivors from their rows, so only one merged
+        row per compound is held, never the input records. A rung starts only if its planned
+        cost fits in what is left of budget after the evaluations already spent. options
+        are passed on to CompoundScreening.screen_records.
+        """
+        if seed is None:
+            seed = int(np.random.default_rng().integers(1 << 31))
+        rows = {}   # record index -> merged screening row
+        stats = {}  # record index -> (searches, sum of search bests, sum of their squares)
+        survivors = None  # record indices docked in the current rung; None streams every record
+        spent = 0         # pose evaluations spent so far, as reported by the searches
+        rung = 0
+        while survivors is None or (survivors and (self.max_rungs is None or rung < self.max_rungs)):
+            per_search = max(1, self.min_evaluations * self.eta ** rung // self.attempts)
+            if survivors is None:
+                print(f"Rung 0: docking every compound with {self.attempts} x {per_search} evaluations")
+                batch, indices, start = records, itertools.count(), 0
+            else:
+                if self.budget is not None and spent + len(survivors) * self.attempts * per_search > self.budget:
+                    print(f"Stopping before rung {rung}: {spent} of {self.budget} evaluations spent")
+                    break
+                print(f"Rung {rung}: docking {len(survivors)} compounds with "
+                      f"{self.attempts} x {per_search} evaluations")
+                batch = [(rows[i]['Compound'], rows[i]['SMILES']) for i in survivors]
+                # Each rung uses fresh seeds: survivor j of rung r docks like record r * n + j of one long run
+                indices, start = survivors, rung * len(rows)
+            docked = self.screener.screen_records(batch, attempts=self.attempts, max_evaluations=per_search,
+                                                  seed=seed, start=start, prefilter=rung == 0, **options)
+            finished = set()  # converged, or failed after an earlier successful rung
+            survivors = []
+            for row, i in zip(docked, indices):
+                survivors.append(i)
+                previous = rows.get(i)
+                spent += row['Evaluations']
+                METRICS.count('adaptive_evaluations', row['Evaluations'])
+                row.update(Rung=rung, Converged=False,
+                           Evaluations=(previous['Evaluations'] if previous else 0) + row['Evaluations'])
+                if row['Status'] != 'ok':
+                    if previous is None or previous['Status'] != 'ok':
+                        rows[i] = row
+                    else:
+                        # Keep the scores (and status) of the rung that succeeded; stop promoting it
+                        rows[i] = dict(previous, Rung=rung, Evaluations=row['Evaluations'])
+                        finished.add(i)
+                    continue
+                # Only the mean and (population) std of the search bests come back; fold them into sums
+                count, total, squares = stats.get(i, (0, 0.0, 0.0))
+                mean, std = row['Average_Score'], row['StdDev']
+                count += self.attempts
+                total += self.attempts * mean
+                squares += self.attempts * (std ** 2 + mean ** 2)
+                stats[i] = (count, total, squares)
+                row['Average_Score'] = total / count
+                row['StdDev'] = math.sqrt(max(squares / count - (total / count) ** 2, 0.0))
+                if previous is not None and previous['Status'] == 'ok':
+                    if previous['Best_Score'] - row['Best_Score'] < self.tolerance:
+                        finished.add(i)
+                        row['Converged'] = True
+                    row['Best_Score'] = min(row['Best_Score'], previous['Best_Score'])
+                rows[i] = row
+            METRICS.count('adaptive_rungs')
+            if len(survivors) <= self.min_survivors:
+                break
+
+            ranked = sorted((i for i in survivors if rows[i]['Status'] == 'ok'), key=lambda i: rows[i]['Best_Score'])
+            keep = max(math.ceil(len(survivors) / self.eta), self.min_survivors)
+            survivors = sorted(i for i in ranked[:keep] if i not in finished)
+            rung += 1
+
+        ranked = pd.DataFrame([rows[i] for i in sorted(rows)])
+        if ranked.empty:
+            return ranked
+        return ranked.sort_values('Best_Score', kind='stable', na_position='last').reset_index(drop=True)
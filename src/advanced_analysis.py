@@ -1,35 +1,74 @@
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-from sklearn.cluster import KMeans
 from scipy.stats import pearsonr
 
+from interaction_fingerprint import rank_by_similarity
+from pose_clustering import cluster_poses
+from results_store import ResultsStore
+from streaming_stats import summarize_store
+
+# Reference ligands, docked on demand when a run holds no poses of them
+REFERENCE_SMILES = {
+    'Risperidone': 'Cc1nc2n(c(=O)c1CCN1CCC(CC1)c1noc3cc(F)ccc13)CCCC2',
+    'Clozapine': 'CN1CCN(CC1)C1=Nc2cc(Cl)ccc2Nc2ccccc12',
+    'Ketanserin': 'O=C(c1ccc(F)cc1)C1CCN(CCn2c(=O)[nH]c3ccccc3c2=O)CC1',
+}
+
 class DockingAnalyzer:
-    def __init__(self, results_file):
-        self.df = pd.read_csv(results_file)
+    def __init__(self, results_dir, receptor_file="data/5ht2a.pdb"):
+        self.store = ResultsStore(results_dir)
+        self.receptor_file = receptor_file
+        # Streaming statistics of the best pose of every simulation
+        self.summary = summarize_store(results_dir, filters=[('Pose', '==', 1)])
         self.reference_compounds = {
             'Risperidone': -9.2,
             'Clozapine': -8.7,
             'Ketanserin': -8.9
         }
 
-    def perform_clustering_analysis(self, n_clusters=3):
-        """Cluster binding poses"""
-        kmeans = KMeans(n_clusters=n_clusters)
-        clusters = kmeans.fit_predict(np.array(self.df['Binding Score']).reshape(-1, 1))
-        self.df['Cluster'] = clusters
-        
+    def perform_clustering_analysis(self, threshold=2.0, method='leader'):
+        """Cluster every stored pose into binding modes by symmetry-aware RMSD"""
+        ligands = dict.fromkeys(smiles for batch in self.store.iter_batches(columns=['SMILES'])
+                                for smiles in batch['SMILES'].unique())
+        clusters = []
+        n_poses = 0
+        # One ligand at a time, so only its poses' coordinates are ever in memory
+        for smiles in ligands:
+            group = self.store.read(columns=['Run', 'Pose', 'Binding_Score'], filters=[('SMILES', '==', smiles)])
+            coords = self.store.read_array('Coordinates', filters=[('SMILES', '==', smiles)])
+            scores = group['Binding_Score'].to_numpy()
+            n_poses += len(group)
+            labels, representatives, populations = cluster_poses(coords, smiles, threshold, method, scores)
+            for cluster, (representative, population) in enumerate(zip(representatives, populations)):
+                clusters.append({
+                    'SMILES': smiles,
+                    'Cluster': cluster + 1,
+                    'Population': population,
+                    'Representative Run': group['Run'].iloc[representative],
+                    'Representative Pose': group['Pose'].iloc[representative],
+                    'Representative Score': scores[representative],
+                    'Best Score': scores[labels == cluster].min(),
+                })
+        self.clusters = pd.DataFrame(clusters)
+        if self.clusters.empty:
+            return self.clusters
+        self.clusters = self.clusters.sort_values(['SMILES', 'Population'], ascending=[True, False])
+
+        print(f"{n_poses} poses in {len(self.clusters)} binding modes (RMSD < {threshold} A, {method})")
+        print(self.clusters.head(10).drop(columns=['SMILES']).to_string(index=False))
+
         plt.figure(figsize=(10, 6))
-        for i in range(n_clusters):
-            cluster_data = self.df[self.df['Cluster'] == i]
-            plt.scatter(cluster_data.index, cluster_data['Binding Score'], label=f'Cluster {i+1}')
-        plt.title('Binding Pose Clusters')
-        plt.xlabel('Simulation Number')
-        plt.ylabel('Binding Score (kcal/mol)')
-        plt.legend()
+        plt.scatter(self.clusters['Best Score'], self.clusters['Population'])
+        plt.title('Binding Mode Clusters')
+        plt.xlabel('Best Binding Score in Cluster (kcal/mol)')
+        plt.ylabel('Poses in Cluster')
+        plt.yscale('log')
         plt.savefig('data/clustering_analysis.png')
         plt.close()
+        return self.clusters
 
     def analyze_energy_components(self):
         """Analyze energy component contributions"""
@@ -50,7 +89,8 @@ class DockingAnalyzer:
         plt.figure(figsize=(10, 6))
         
         # Plot current results
-        plt.hist(self.df['Binding Score'], bins=20, alpha=0.5, label='Serotonin')
+        counts, edges = self.summary.digest.histogram(bins=20)
+        plt.stairs(counts, edges, fill=True, alpha=0.5, label='Serotonin')
         
         # Plot reference lines
         for compound, score in self.reference_compounds.items():
@@ -63,6 +103,37 @@ class DockingAnalyzer:
         plt.savefig('data/reference_comparison.png')
         plt.close()
 
+    def reference_fingerprint(self, reference='Ketanserin'):
+        """Interaction fingerprint of the reference's binding mode: its best stored pose, else a fresh docking"""
+        filters = [('Compound', '==', reference)]
+        # Poses written before fingerprints were stored have empty ones
+        width = self.store.array_width('Interaction_FP', filters)
+        if width:
+            scores = self.store.read(columns=['Binding_Score'], filters=filters)['Binding_Score'].to_numpy()
+            fingerprints, kept = self.store.read_array('Interaction_FP', filters, width)
+            return fingerprints[scores[kept].argmin()]
+
+        from molecular_dock import MolecularDocking
+
+        docking = MolecularDocking()
+        docking.load_receptor(self.receptor_file)
+        docking.prepare_ligand(REFERENCE_SMILES[reference])
+        return docking.run_docking_simulation(n_poses=1).fingerprints[0]
+
+    def find_similar_poses(self, reference='Ketanserin', top_k=10):
+        """Stored poses ranked by interaction-fingerprint Tanimoto similarity to the reference binding mode"""
+        reference_fp = self.reference_fingerprint(reference)
+        # Poses written before fingerprints were stored have empty ones and are skipped
+        fingerprints, kept = self.store.read_array('Interaction_FP', width=len(reference_fp))
+        poses = self.store.read(columns=['Compound', 'Run', 'Pose', 'Binding_Score'])[kept].reset_index(drop=True)
+        if poses.empty:
+            return poses
+        top, similarity = rank_by_similarity(fingerprints, reference_fp, top_k)
+        similar = poses.iloc[top].assign(Tanimoto=similarity)
+        print(f"Poses most similar to the {reference} binding mode:")
+        print(similar.to_string(index=False))
+        return similar
+
     def run_complete_analysis(self):
         """Run all analyses"""
         print("Running comprehensive docking analysis...")
@@ -82,13 +153,22 @@ class DockingAnalyzer:
         # Statistical summary
         print("\n4. Statistical Summary:")
         print("-" * 50)
-        print(f"Mean Binding Score: {self.df['Binding Score'].mean():.2f} kcal/mol")
-        print(f"Best Binding Score: {self.df['Binding Score'].min():.2f} kcal/mol")
-        print(f"Number of favorable poses: {len(self.df[self.df['Binding Score'] < -8])}")
+        stats = self.summary.summary()
+        print(f"Mean Binding Score: {stats['Mean']:.2f} kcal/mol")
+        print(f"Best Binding Score: {stats['Best Score']:.2f} kcal/mol")
+        print(f"Number of favorable poses: {self.summary.below[-8.0]}")
+
+        # Binding-mode similarity to a reference antagonist
+        print("\n5. Interaction fingerprint similarity to Ketanserin...")
+        self.find_similar_poses('Ketanserin')
         
         print("\nAnalysis complete! Check the data folder for visualization plots.")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster poses and compare a simulation run with reference compounds")
+    parser.add_argument('results_dir', help="run results store, e.g. data/results/docking_results_<timestamp>")
+    args = parser.parse_args(argv)
+    DockingAnalyzer(args.results_dir).run_complete_analysis()
+
 if __name__ == "__main__":
-    # Update the file path to use the existing results file
-    analyzer = DockingAnalyzer("data/docking_results_20250404_185034.csv")
-    analyzer.run_complete_analysis()
\ No newline at end of file
+    main()
@@ -1,57 +1,82 @@
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-# Read the docking results
-df = pd.read_csv('data/docking_poses_results.csv')
-
-# Create a figure with multiple subplots
-plt.figure(figsize=(15, 10))
-
-# 1. Binding Score Distribution
-plt.subplot(2, 2, 1)
-sns.histplot(data=df, x='Binding_Score', bins=10)
-plt.title('Distribution of Binding Scores')
-plt.xlabel('Binding Score (kcal/mol)')
-
-# 2. Energy Components Analysis
-energy_columns = [col for col in df.columns if col.startswith('Energy_')]
-energy_data = df[energy_columns].mean()
-
-plt.subplot(2, 2, 2)
-energy_data.plot(kind='bar')
-plt.title('Average Energy Components')
-plt.xticks(rotation=45, ha='right')
-plt.tight_layout()
-
-# 3. Top Poses Analysis
-plt.subplot(2, 2, 3)
-top_poses = df.sort_values('Binding_Score').head()
-sns.barplot(data=top_poses, x='Pose', y='Binding_Score')
-plt.title('Top 5 Binding Poses')
-plt.ylabel('Binding Score (kcal/mol)')
-
-# 4. Summary Statistics
-plt.subplot(2, 2, 4)
-plt.axis('off')
-summary_stats = {
-    'Best Score': df['Binding_Score'].min(),
-    'Average Score': df['Binding_Score'].mean(),
-    'Standard Deviation': df['Binding_Score'].std(),
-    'Success Rate (<-8)': (df['Binding_Score'] < -8).mean() * 100
-}
-summary_text = '\n'.join([f'{k}: {v:.2f}' for k, v in summary_stats.items()])
-plt.text(0.1, 0.5, f'Summary Statistics:\n\n{summary_text}', fontsize=10)
-
-plt.tight_layout()
-plt.savefig('data/docking_analysis.png')
-
-# Print detailed analysis
-print("\nDocking Analysis Results")
-print("-" * 50)
-print(f"Number of poses analyzed: {len(df)}")
-print(f"\nBest binding pose: {df.loc[df['Binding_Score'].idxmin(), 'Pose']}")
-print(f"Best binding score: {df['Binding_Score'].min():.2f} kcal/mol")
-print("\nEnergy Component Contributions:")
-for component in energy_columns:
-    print(f"{component.replace('Energy_', '')}: {df[component].mean():.2f} kcal/mol")
\ No newline at end of file
+from results_store import ResultsStore
+from streaming_stats import RunningStats, ScoreSummary
+
+def analyze_poses(results_dir='data/results/docking_poses', output='data/docking_analysis.png'):
+    """Plot and print score and energy-component statistics of every stored pose"""
+    # Stream the docking results chunk by chunk, skipping pose coordinates
+    store = ResultsStore(results_dir)
+    energy_columns = [col for col in store.schema if col.startswith('Energy_')]
+    summary = ScoreSummary(top_k=5)
+    energy_stats = {col: RunningStats() for col in energy_columns}
+    for batch in store.iter_batches(columns=['Pose', 'Binding_Score'] + energy_columns):
+        summary.update(batch)
+        for col in energy_columns:
+            energy_stats[col].update(batch[col])
+
+    # Create a figure with multiple subplots
+    plt.figure(figsize=(15, 10))
+
+    # 1. Binding Score Distribution
+    plt.subplot(2, 2, 1)
+    counts, edges = summary.digest.histogram(bins=10)
+    plt.stairs(counts, edges, fill=True)
+    plt.title('Distribution of Binding Scores')
+    plt.xlabel('Binding Score (kcal/mol)')
+
+    # 2. Energy Components Analysis
+    energy_data = pd.Series({col: energy_stats[col].mean for col in energy_columns})
+
+    plt.subplot(2, 2, 2)
+    energy_data.plot(kind='bar')
+    plt.title('Average Energy Components')
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+
+    # 3. Top Poses Analysis
+    plt.subplot(2, 2, 3)
+    top_poses = summary.top.rows
+    sns.barplot(data=top_poses, x='Pose', y='Binding_Score')
+    plt.title('Top 5 Binding Poses')
+    plt.ylabel('Binding Score (kcal/mol)')
+
+    # 4. Summary Statistics
+    plt.subplot(2, 2, 4)
+    plt.axis('off')
+    stats = summary.summary()
+    summary_stats = {
+        'Best Score': stats['Best Score'],
+        'Average Score': stats['Mean'],
+        'Standard Deviation': stats['Std Dev'],
+        'Success Rate (<-8)': summary.success_rate(-8)
+    }
+    summary_text = '\n'.join([f'{k}: {v:.2f}' for k, v in summary_stats.items()])
+    plt.text(0.1, 0.5, f'Summary Statistics:\n\n{summary_text}', fontsize=10)
+
+    plt.tight_layout()
+    plt.savefig(output)
+
+    # Print detailed analysis
+    print("\nDocking Analysis Results")
+    print("-" * 50)
+    print(f"Number of poses analyzed: {summary.count}")
+    print(f"\nBest binding pose: {summary.top.rows['Pose'].iloc[0]}")
+    print(f"Best binding score: {stats['Best Score']:.2f} kcal/mol")
+    print("\nEnergy Component Contributions:")
+    for component in energy_columns:
+        print(f"{component.replace('Energy_', '')}: {energy_stats[component].mean:.2f} kcal/mol")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score and energy-component statistics of stored docking poses")
+    parser.add_argument('results_dir', nargs='?', default='data/results/docking_poses', help="pose results store")
+    parser.add_argument('--output', default='data/docking_analysis.png', help="figure to write")
+    args = parser.parse_args(argv)
+    analyze_poses(args.results_dir, args.output)
+
+if __name__ == "__main__":
+    main()
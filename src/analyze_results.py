@@ -1,43 +1,44 @@
-import pandas as pd
+import argparse
 import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
 
-def analyze_docking_results(csv_file):
-    # Read the CSV file
-    df = pd.read_csv(csv_file)
+from results_store import ResultsStore
+from streaming_stats import SampledTrace, ScoreSummary
+
+def analyze_docking_results(results_dir):
+    # Stream the best pose of every simulation from the results store in constant memory
+    summary = ScoreSummary()
+    trace = SampledTrace()
+    for batch in ResultsStore(results_dir).iter_batches(columns=['Run', 'Binding_Score'], filters=[('Pose', '==', 1)]):
+        summary.update(batch)
+        trace.update(batch['Run'], batch['Binding_Score'])
     
     # Create figure with multiple subplots
     plt.figure(figsize=(15, 10))
     
     # 1. Distribution Plot
     plt.subplot(2, 2, 1)
-    sns.histplot(data=df, x='Binding Score', kde=True)
+    counts, edges = summary.digest.histogram(bins=20)
+    plt.stairs(counts, edges, fill=True)
     plt.title('Distribution of Binding Scores')
     plt.xlabel('Binding Score (kcal/mol)')
     
     # 2. Box Plot
     plt.subplot(2, 2, 2)
-    sns.boxplot(y=df['Binding Score'])
-    plt.title('Binding Score Box Plot')
+    q1, median, q3 = summary.digest.quantile([0.25, 0.5, 0.75])
+    whislo, whishi = summary.digest.quantile([0.01, 0.99])
+    plt.gca().bxp([{'q1': q1, 'med': median, 'q3': q3, 'whislo': whislo, 'whishi': whishi, 'fliers': []}])
+    plt.title('Binding Score Box Plot (1st-99th percentile whiskers)')
     plt.ylabel('Binding Score (kcal/mol)')
     
     # 3. Time Series Plot
     plt.subplot(2, 2, 3)
-    plt.plot(df['Simulation'], df['Binding Score'], marker='o')
+    plt.plot(trace.x, trace.y, marker='o')
     plt.title('Binding Score vs Simulation Number')
     plt.xlabel('Simulation Number')
     plt.ylabel('Binding Score (kcal/mol)')
     
     # Calculate statistics
-    stats = {
-        'Mean': df['Binding Score'].mean(),
-        'Median': df['Binding Score'].median(),
-        'Std Dev': df['Binding Score'].std(),
-        'Best Score': df['Binding Score'].min(),
-        'Worst Score': df['Binding Score'].max(),
-        'Range': df['Binding Score'].max() - df['Binding Score'].min()
-    }
+    stats = summary.summary()
     
     # 4. Text box with statistics
     plt.subplot(2, 2, 4)
@@ -59,8 +60,20 @@ def analyze_docking_results(csv_file):
         print(f"{key}: {value:.2f}")
     
     # Calculate success rate (scores below -8 kcal/mol considered successful)
-    success_rate = (df['Binding Score'] < -8).mean() * 100
+    success_rate = summary.success_rate(-8)
     print(f"\nSuccess Rate (scores < -8 kcal/mol): {success_rate:.1f}%")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plot and summarise the best scores of a simulation run")
+    parser.add_argument('results_dir', help="run results store, e.g. data/results/docking_results_<timestamp>")
+    parser.add_argument('--complete', action='store_true',
+                        help="also run pose clustering and reference comparison (DockingAnalyzer)")
+    args = parser.parse_args(argv)
+    if args.complete:
+        from advanced_analysis import DockingAnalyzer
+        DockingAnalyzer(args.results_dir).run_complete_analysis()
+    else:
+        analyze_docking_results(args.results_dir)
+
 if __name__ == "__main__":
-    analyze_docking_results("c:\\Users\\PC\\Documents\\New Bioinformatics\\data\\docking_results_20250404_185034.csv")
\ No newline at end of file
+    main()
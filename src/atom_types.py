@@ -0,0 +1,134 @@
+import numpy as np
+from rdkit.Chem import AllChem
+
+# Atom types shared by the receptor and the ligand. Unknown elements fall back to carbon.
+ATOM_TYPES = ('C', 'N', 'O', 'S', 'H', 'X')
+HALOGENS = ('F', 'Cl', 'Br', 'I')
+
+# AutoDock4-style van der Waals radius (Å) and well depth (kcal/mol) per atom type
+VDW_RADIUS = np.array([4.00, 3.50, 3.20, 4.00, 2.00, 4.09], dtype=np.float32)
+VDW_EPSILON = np.array([0.150, 0.160, 0.200, 0.200, 0.020, 0.276], dtype=np.float32)
+
+# Vina-style atomic radii used for the hydrophobic surface distance
+XS_RADIUS = np.array([1.9, 1.8, 1.7, 2.0, 1.1, 1.8], dtype=np.float32)
+
+# AutoDock4 desolvation parameters: atomic solvation and atomic volume
+SOLVATION = np.array([-0.00143, -0.00162, -0.00251, -0.00214, 0.00051, -0.00110], dtype=np.float32)
+VOLUME = np.array([33.51, 22.45, 17.16, 33.51, 0.0, 35.82], dtype=np.float32)
+CHARGE_SOLVATION = 0.01097
+
+# Side-chain polar groups: hydrogen bond donors and acceptors by (residue, atom name)
+DONORS = {
+    ('ARG', 'NE'), ('ARG', 'NH1'), ('ARG', 'NH2'), ('ASN', 'ND2'), ('GLN', 'NE2'),
+    ('HIS', 'ND1'), ('HIS', 'NE2'), ('LYS', 'NZ'), ('SER', 'OG'), ('THR', 'OG1'),
+    ('TYR', 'OH'), ('TRP', 'NE1'), ('CYS', 'SG'),
+}
+ACCEPTORS = {
+    ('ASP', 'OD1'), ('ASP', 'OD2'), ('GLU', 'OE1'), ('GLU', 'OE2'), ('ASN', 'OD1'),
+    ('GLN', 'OE1'), ('HIS', 'ND1'), ('HIS', 'NE2'), ('SER', 'OG'), ('THR', 'OG1'),
+    ('TYR', 'OH'), ('MET', 'SD'),
+}
+
+# Carbons bonded to N or O are not hydrophobic
+POLAR_CARBONS = {
+    ('SER', 'CB'), ('THR', 'CB'), ('TYR', 'CZ'), ('ASP', 'CG'), ('GLU', 'CD'),
+    ('ASN', 'CG'), ('GLN', 'CD'), ('LYS', 'CE'), ('ARG', 'CD'), ('ARG', 'CZ'),
+    ('HIS', 'CG'), ('HIS', 'CD2'), ('HIS', 'CE1'), ('TRP', 'CD1'), ('TRP', 'CE2'),
+    ('PRO', 'CD'),
+}
+
+AROMATIC_RINGS = {
+    'PHE': ('CG', 'CD1', 'CD2', 'CE1', 'CE2', 'CZ'),
+    'TYR': ('CG', 'CD1', 'CD2', 'CE1', 'CE2', 'CZ'),
+    'TRP': ('CG', 'CD1', 'NE1', 'CD2', 'CE2', 'CE3', 'CZ2', 'CZ3', 'CH2'),
+    'HIS': ('CG', 'ND1', 'CD2', 'CE1', 'NE2'),
+}
+
+# United-atom partial charges: backbone dipole plus ionizable side chains at pH 7
+BACKBONE_CHARGES = {'N': -0.15, 'CA': 0.10, 'C': 0.55, 'O': -0.55, 'OXT': -0.55}
+SIDE_CHAIN_CHARGES = {
+    ('ASP', 'OD1'): -0.5, ('ASP', 'OD2'): -0.5,
+    ('GLU', 'OE1'): -0.5, ('GLU', 'OE2'): -0.5,
+    ('LYS', 'NZ'): 1.0,
+    ('ARG', 'NE'): 1 / 3, ('ARG', 'NH1'): 1 / 3, ('ARG', 'NH2'): 1 / 3,
+    ('SER', 'OG'): -0.25, ('THR', 'OG1'): -0.25, ('TYR', 'OH'): -0.25,
+    ('ASN', 'OD1'): -0.45, ('ASN', 'ND2'): 0.10, ('GLN', 'OE1'): -0.45, ('GLN', 'NE2'): 0.10,
+}
+
+
+def type_index(element):
+    """Map an element symbol to its index in ATOM_TYPES"""
+    element = element.strip().capitalize()
+    if element in ATOM_TYPES[:5]:
+        return ATOM_TYPES.index(element)
+    if element in HALOGENS or element == 'P':
+        return ATOM_TYPES.index('X')
+    return 0
+
+
+def type_receptor_atoms(atoms):
+    """Assign grid types and charges to receptor atoms given as (resname, name, element, coord)"""
+    n_atoms = len(atoms)
+    coords = np.zeros((n_atoms, 3), dtype=np.float32)
+    types = np.zeros(n_atoms, dtype=np.int8)
+    charges = np.zeros(n_atoms, dtype=np.float32)
+    donor = np.zeros(n_atoms, dtype=bool)
+    acceptor = np.zeros(n_atoms, dtype=bool)
+    hydrophobic = np.zeros(n_atoms, dtype=bool)
+    aromatic = np.zeros(n_atoms, dtype=bool)
+
+    for i, (resname, name, element, coord) in enumerate(atoms):
+        key = (resname, name)
+        coords[i] = coord
+        types[i] = type_index(element)
+        charges[i] = SIDE_CHAIN_CHARGES.get(key, BACKBONE_CHARGES.get(name, 0.0))
+        donor[i] = key in DONORS or (name == 'N' and resname != 'PRO')
+        acceptor[i] = key in ACCEPTORS or name in ('O', 'OXT')
+        hydrophobic[i] = types[i] == 0 and name not in ('C', 'CA') and key not in POLAR_CARBONS
+        aromatic[i] = name in AROMATIC_RINGS.get(resname, ())
+
+    return {
+        'coords': coords,
+        'types': types,
+        'charges': charges,
+        'donor': donor,
+        'acceptor': acceptor,
+        'hydrophobic': hydrophobic,
+        'aromatic': aromatic,
+    }
+
+
+def type_ligand_atoms(mol):
+    """Assign grid types, Gasteiger charges and interaction flags to ligand atoms"""
+    AllChem.ComputeGasteigerCharges(mol)
+    n_atoms = mol.GetNumAtoms()
+    types = np.zeros(n_atoms, dtype=np.int8)
+    charges = np.zeros(n_atoms, dtype=np.float32)
+    donor = np.zeros(n_atoms, dtype=bool)
+    acceptor = np.zeros(n_atoms, dtype=bool)
+    hydrophobic = np.zeros(n_atoms, dtype=bool)
+    aromatic = np.zeros(n_atoms, dtype=bool)
+
+    for atom in mol.GetAtoms():
+        i = atom.GetIdx()
+        symbol = atom.GetSymbol()
+        neighbors = [n.GetSymbol() for n in atom.GetNeighbors()]
+        types[i] = type_index(symbol)
+        charge = atom.GetDoubleProp('_GasteigerCharge')
+        charges[i] = charge if np.isfinite(charge) else 0.0
+        n_hydrogens = atom.GetTotalNumHs(includeNeighbors=True)
+        donor[i] = symbol in ('N', 'O') and n_hydrogens > 0
+        acceptor[i] = symbol == 'O' or (symbol == 'N' and n_hydrogens == 0 and atom.GetFormalCharge() <= 0
+                                        and not (atom.GetIsAromatic() and atom.GetDegree() == 3))
+        hydrophobic[i] = ((symbol == 'C' and not any(n in ('N', 'O') for n in neighbors))
+                          or symbol in ('Cl', 'Br', 'I'))
+        aromatic[i] = atom.GetIsAromatic()
+
+    return {
+        'types': types,
+        'charges': charges,
+        'donor': donor,
+        'acceptor': acceptor,
+        'hydrophobic': hydrophobic,
+        'aromatic': aromatic,
+    }
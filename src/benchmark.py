@@ -0,0 +1,260 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import rdkit
+
+from compound_screening import CompoundScreening
+from interaction_fingerprint import rank_by_similarity
+from ligand_prep import LigandCache, embed_ligand
+from molecular_dock import MolecularDocking, random_rotation
+
+DEFAULT_PDB = os.path.join('data', '5ht2a.pdb')
+DEFAULT_OUTPUT_DIR = os.path.join('data', 'benchmarks')
+SEROTONIN = "NCCC1=CC2=C(C=C1)C(=CN2)C"
+
+# Tryptamine-like scaffold decorated combinatorially to build synthetic libraries
+SCAFFOLD = "{amine}CCc1c[nH]c2cc{ring}ccc12"
+AMINES = ['N', 'CN', 'CN(C)', 'CCN(CC)', 'C1CCN(C1)', 'CC(C)N', 'OCCN']
+RING = ['', '(O)', '(OC)', '(F)', '(Cl)', '(C)', '(C(=O)N)', '(OCC)']
+
+
+def synthetic_library(n_compounds, seed=0):
+    """Deterministic (name, smiles) records of distinct decorations of the scaffold
+
+    SMILES never repeat, so a screen of the library gets no ligand cache hits.
+    """
+    combinations = list(itertools.product(AMINES, RING))
+    if n_compounds > len(combinations):
+        raise ValueError(f"The synthetic library has at most {len(combinations)} distinct compounds")
+    rng = np.random.default_rng(seed)
+    picks = rng.permutation(len(combinations))[:n_compounds]
+    return [(f'synthetic_{i}', SCAFFOLD.format(amine=combinations[k][0], ring=combinations[k][1]))
+            for i, k in enumerate(picks)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children, in MB"""
+    scale = 1024 if sys.platform != 'darwin' else 1024 * 1024  # ru_maxrss is KB on Linux, bytes on macOS
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+def metric(value, unit, better):
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+
+def bench_receptor(metrics, pdb_file):
+    docking = MolecularDocking(ligand_cache=LigandCache(path=None))
+    start = time.perf_counter()
+    docking.load_receptor(pdb_file)
+    metrics['receptor_load_cold_s'] = metric(time.perf_counter() - start, 's', 'lower')
+    start = time.perf_counter()
+    docking.load_receptor(pdb_file)
+    metrics['receptor_load_cached_s'] = metric(time.perf_counter() - start, 's', 'lower')
+
+    start = time.perf_counter()
+    docking.build_scoring_grid()
+    metrics['grid_build_cold_s'] = metric(time.perf_counter() - start, 's', 'lower')
+    start = time.perf_counter()
+    docking.build_scoring_grid()
+    metrics['grid_load_cached_s'] = metric(time.perf_counter() - start, 's', 'lower')
+    return docking
+
+
+def bench_conformers(metrics, library, n_conformers):
+    start = time.perf_counter()
+    total = sum(embed_ligand(smiles, n_conformers=n_conformers).GetNumConformers() for _, smiles in library)
+    metrics['conformers_per_s'] = metric(total / (time.perf_counter() - start), 'conformers/s', 'higher')
+
+
+def bench_scoring(metrics, docking, n_poses, seed):
+    docking.prepare_ligand(SEROTONIN)
+    rng = np.random.default_rng(seed)
+    center = docking.scoring_matrix.center
+    coords = docking.ligand_coords()
+    poses = np.stack([coords @ random_rotation(rng).T + center + rng.uniform(-3, 3, 3)
+                      for _ in range(n_poses)])
+    docking.score_poses(poses[:16])  # warm up
+    start = time.perf_counter()
+    docking.score_poses(poses)
+    metrics['poses_scored_per_s'] = metric(n_poses / (time.perf_counter() - start), 'poses/s', 'higher')
+
+    start = time.perf_counter()
+    docking.calculate_binding_score()
+    metrics['binding_score_call_ms'] = metric(1000 * (time.perf_counter() - start), 'ms', 'lower')
+
+    docked = docking.run_docking_simulation(n_poses=10, max_evaluations=5000, seed=seed)
+    metrics['search_evaluations_per_s'] = metric(docking.search_stats['evaluations_per_s'],
+                                                 'evaluations/s', 'higher')
+    docked = docked.coords
+    bench_exact_scoring(metrics, docking, poses, docked)
+    bench_fingerprint_search(metrics, docking, docked)
+
+
+def bench_exact_scoring(metrics, docking, poses, docked):
+    """Throughput of the pairwise force field and its agreement with the grid on docked poses"""
+    docking.score_poses_exact(poses[:16])  # warm up (builds the force field)
+    start = time.perf_counter()
+    docking.score_poses_exact(poses)
+    metrics['exact_poses_scored_per_s'] = metric(len(poses) / (time.perf_counter() - start), 'poses/s', 'higher')
+
+    grid, exact = docking.score_poses(docked), docking.score_poses_exact(docked)
+    metrics['grid_vs_exact_mae'] = metric(np.abs(grid.sum(1) - exact.sum(1)).mean(), 'kcal/mol', 'lower')
+    metrics['grid_vs_exact_rank_corr'] = metric(
+        np.corrcoef(grid.sum(1).argsort().argsort(), exact.sum(1).argsort().argsort())[0, 1], 'spearman', 'higher')
+
+
+def bench_fingerprint_search(metrics, docking, docked, n_fingerprints=1_000_000, seed=0):
+    """Fingerprinting throughput and bulk Tanimoto ranking of n_fingerprints poses against one reference"""
+    start = time.perf_counter()
+    fingerprints = docking.interaction_fingerprints(docked)
+    metrics['fingerprints_per_s'] = metric(len(docked) / (time.perf_counter() - start), 'poses/s', 'higher')
+
+    # Resample the docked fingerprints' words into a library of realistic bit density
+    rng = np.random.default_rng(seed)
+    library = fingerprints[rng.integers(len(fingerprints), size=(n_fingerprints, fingerprints.shape[1])),
+                           np.arange(fingerprints.shape[1])]
+    start = time.perf_counter()
+    rank_by_similarity(library, fingerprints[0], top_k=100)
+    metrics['fingerprint_search_s'] = metric(time.perf_counter() - start, 's', 'lower')
+
+
+def bench_screening(metrics, pdb_file, library_file, n_compounds, max_workers, max_evaluations, seed):
+    for workers in range(1, max_workers + 1):
+        # Every worker count starts from cold receptor, grid and ligand caches, as the first one does
+        cache = tempfile.mkdtemp(prefix='cache-', dir='.')
+        screener = CompoundScreening(pdb_file, cache_dir=os.path.join(cache, 'receptors'),
+                                     grid_cache_dir=os.path.join(cache, 'grids'), ligand_cache=LigandCache(path=None))
+        output = tempfile.mkdtemp(prefix='screen-', dir='.')
+        start = time.perf_counter()
+        screener.screen_library(library_file, output, batch_size=64, seed=seed, n_workers=workers, attempts=1,
+                                max_evaluations=max_evaluations)
+        rate = n_compounds / (time.perf_counter() - start)
+        metrics[f'compounds_per_s_{workers}_workers'] = metric(rate, 'compounds/s', 'higher')
+
+
+def bench_startup(metrics, repeats=3):
+    """Cold-start wall time of the bare interpreter and of every dock.py command (via --help)"""
+    from dock import COMMANDS
+
+    dock = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dock.py')
+    commands = {'interpreter': [sys.executable, '-c', 'pass'], 'dock': [sys.executable, dock, '--help']}
+    commands.update({name: [sys.executable, dock, name, '--help'] for name in COMMANDS})
+    for name, command in commands.items():
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        if completed.returncode:
+            print(f"Skipping startup of '{name}': exited with status {completed.returncode}")
+            continue
+        metrics[f"startup_{name.replace('-', '_')}_s"] = metric(min(times), 's', 'lower')
+
+
+def run_benchmarks(pdb_file, n_compounds=16, max_workers=2, n_conformers=10, n_poses=4096,
+                   max_evaluations=1000, seed=0):
+    """Run every benchmark inside a scratch workspace so all caches start cold"""
+    pdb_file = os.path.abspath(pdb_file)
+    if not os.path.exists(pdb_file):
+        raise FileNotFoundError(f"{pdb_file} not found; benchmarks never download structures")
+
+    metrics = {}
+    library = synthetic_library(n_compounds, seed)
+    workspace = tempfile.mkdtemp(prefix='docking-bench-')
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        with open('library.smi', 'w') as handle:
+            handle.writelines(f'{smiles} {name}\n' for name, smiles in library)
+
+        docking = bench_receptor(metrics, pdb_file)
+        bench_conformers(metrics, library, n_conformers)
+        bench_scoring(metrics, docking, n_poses, seed)
+        bench_screening(metrics, pdb_file, 'library.smi', n_compounds, max_workers, max_evaluations, seed)
+        bench_startup(metrics)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    own, children = peak_rss_mb()
+    metrics['peak_rss_mb'] = metric(own, 'MB', 'lower')
+    metrics['peak_rss_workers_mb'] = metric(children, 'MB', 'lower')
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'rdkit': rdkit.__version__, 'cpus': os.cpu_count(), 'machine': platform.machine()},
+        'config': {'pdb_file': os.path.basename(pdb_file), 'n_compounds': n_compounds, 'max_workers': max_workers,
+                   'n_conformers': n_conformers, 'n_poses': n_poses, 'max_evaluations': max_evaluations,
+                   'seed': seed},
+        'metrics': metrics,
+    }
+
+
+def compare(current, baseline, tolerance=0.1):
+    """Relative change per shared metric and whether it regressed beyond tolerance"""
+    rows = []
+    for name, entry in current['metrics'].items():
+        if name not in baseline['metrics']:
+            continue
+        old, new = baseline['metrics'][name]['value'], entry['value']
+        change = (new - old) / old if old else 0.0
+        worse = -change if entry['better'] == 'higher' else change
+        rows.append((name, old, new, change, worse > tolerance))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the docking hot paths offline on the bundled 4oaj structure")
+    parser.add_argument('--pdb', default=DEFAULT_PDB, help="receptor structure (never downloaded)")
+    parser.add_argument('--compounds', type=int, default=16, help="size of the synthetic SMILES library (at most 56 distinct)")
+    parser.add_argument('--max-workers', type=int, default=2, help="screen with 1..N pool workers")
+    parser.add_argument('--conformers', type=int, default=10, help="conformers embedded per compound")
+    parser.add_argument('--poses', type=int, default=4096, help="poses in the batched scoring benchmark")
+    parser.add_argument('--evaluations', type=int, default=1000, help="search budget per compound when screening")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file to write (default: data/benchmarks/benchmark_<timestamp>.json)")
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="flag regressions against an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    result = run_benchmarks(args.pdb, args.compounds, args.max_workers, args.conformers, args.poses,
+                            args.evaluations, args.seed)
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as handle:
+        json.dump(result, handle, indent=2)
+
+    print("\nBenchmark Results:")
+    print("-" * 50)
+    for name, entry in result['metrics'].items():
+        print(f"{name:32s} {entry['value']:12.3f} {entry['unit']}")
+    print(f"\nResults saved to: {output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions = 0
+        print(f"\nComparison with {args.compare}:")
+        for name, old, new, change, regressed in compare(result, baseline, args.tolerance):
+            regressions += regressed
+            print(f"{name:32s} {old:12.3f} -> {new:12.3f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
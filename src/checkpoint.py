@@ -0,0 +1,54 @@
+import json
+import os
+
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def fsync_path(path):
+    """Flush a file, or a directory's entries (e.g. a rename into it), to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Checkpoint:
+    """JSON record of finished work, replaced atomically so a killed job can resume from it"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path) as handle:
+            return json.load(handle)
+
+    def save(self, state):
+        """Write the state durably, swap it in by rename and flush the rename"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        staging = f'{self.path}.tmp'
+        with open(staging, 'w') as handle:
+            json.dump(state, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(staging, self.path)
+        fsync_path(directory)
+
+
+def resume_state(checkpoint, store, fresh_state, resume=False):
+    """Checkpointed state to continue from, or fresh_state for a new job
+
+    Store chunks written after the last checkpoint are discarded on resume, so every
+    result is kept exactly once.
+    """
+    if resume and checkpoint.exists():
+        state = checkpoint.load()
+        store.rollback(state['chunks'])
+        return state
+    if checkpoint.exists() or store.chunks():
+        raise ValueError(f"{store.path} already holds results; resume the job or choose another output")
+    return fresh_state
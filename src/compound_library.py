@@ -0,0 +1,70 @@
+import gzip
+import itertools
+import logging
+import os
+
+from rdkit import Chem
+
+logger = logging.getLogger(__name__)
+
+
+def _open(path, mode='rt'):
+    """Open plain or gzipped text files transparently"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _library_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension in ('.smi', '.smiles', '.txt', '.csv'):
+        return 'smi'
+    if extension in ('.sdf', '.sd', '.mol'):
+        return 'sdf'
+    raise ValueError(f"Unsupported compound library format: {path}")
+
+
+def read_smiles(path):
+    """Yield (name, smiles, line number) from a SMILES file of 'SMILES [name]' lines"""
+    with _open(path) as handle:
+        for line_number, line in enumerate(handle, 1):
+            fields = line.replace(',', ' ').split()
+            if not fields or fields[0].startswith('#') or fields[0].lower() == 'smiles':
+                continue
+            name = ' '.join(fields[1:]) or f'line_{line_number}'
+            yield name, fields[0], line_number
+
+
+def read_sdf(path):
+    """Yield (name, smiles, record number) from an SD file, one record at a time"""
+    with _open(path, 'rb') as handle:
+        for index, mol in enumerate(Chem.ForwardSDMolSupplier(handle), 1):
+            if mol is None:
+                yield f'record_{index}', None, index
+                continue
+            name = mol.GetProp('_Name').strip() if mol.HasProp('_Name') else ''
+            yield name or f'record_{index}', Chem.MolToSmiles(mol), index
+
+
+def read_library(path):
+    """Stream valid (name, smiles) records from a .smi/.sdf library, optionally gzipped
+
+    Records RDKit cannot parse are logged and skipped.
+    """
+    reader = read_sdf if _library_format(path) == 'sdf' else read_smiles
+    for name, smiles, position in reader(path):
+        if smiles is None or Chem.MolFromSmiles(smiles) is None:
+            logger.warning("Skipping malformed record %s (%s:%d)", name, path, position)
+            continue
+        yield name, smiles
+
+
+def chunked(records, size):
+    """Group an iterable into lists of at most size items without materializing it"""
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
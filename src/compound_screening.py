@@ -1,10 +1,149 @@
+from adaptive_screening import SuccessiveHalving
+from checkpoint import CHECKPOINT_FILE, Checkpoint, resume_state
+from compound_library import chunked, read_library
 from molecular_dock import MolecularDocking
+from instrumentation import METRICS
+from pipeline import Pipeline, Stage
+from prefilter import RULE_SETS, Prefilter
+from receptor_prep import DEFAULT_CACHE_DIR
+from scoring_grid import DEFAULT_GRID_CACHE_DIR
+from results_store import ADAPTIVE_SCHEMA, DEFAULT_RESULTS_DIR, SCREENING_SCHEMA, ResultsStore
+from flexible_receptor import load_grid
+from streaming_stats import summarize_store
 import pandas as pd
 import numpy as np
+import functools
+import signal
+import argparse
+import itertools
+import logging
+import os
+import threading
+
+# Docking instance attached by each pool worker at start-up
+_worker_docking = None
+# Per-thread docking instances of a threaded docking stage
+_thread_state = threading.local()
+
+
+class _Deadline:
+    """Raise TimeoutError in the current process once the timeout elapses (POSIX main thread only)"""
+
+    def __init__(self, timeout):
+        main_thread = threading.current_thread() is threading.main_thread()
+        self.timeout = timeout if hasattr(signal, 'SIGALRM') and main_thread else None
+
+    def _expire(self, signum, frame):
+        raise TimeoutError
+
+    def __enter__(self):
+        if self.timeout:
+            self.previous = signal.signal(signal.SIGALRM, self._expire)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+
+    def __exit__(self, *exc):
+        if self.timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous)
+
+
+def result_row(compound_name, smiles, status='ok'):
+    """Screening row with no scores yet; Evaluations counts the pose evaluations spent on it"""
+    return {'Compound': compound_name, 'SMILES': smiles, 'Best_Score': np.nan,
+            'Average_Score': np.nan, 'StdDev': np.nan, 'Status': status, 'Evaluations': 0}
+
+
+def prepare_compound(docking, task, n_conformers=1):
+    """Pipeline stage 1: embed a screening task's ligand, returning (task, row, prepared ligand)
+
+    row is already final (rejected or failed) when the compound will not be docked.
+    """
+    index, name, smiles, seed, reason = task
+    if reason:
+        return task, result_row(name, smiles, f'rejected: {reason}'), None
+    try:
+        ligand = docking.load_ligand(smiles, n_conformers=n_conformers, optimize=n_conformers > 1)
+    except Exception as exc:
+        return task, result_row(name, smiles, f'error: {exc}'), None
+    return task, None, ligand
+
+
+def dock_compound(docking, prepared, attempts=5, max_evaluations=5000, timeout=None, flexible=True):
+    """Pipeline stage 2: dock a prepared compound with several independent searches and summarise the best scores"""
+    (index, compound_name, smiles, seed, _), row, ligand = prepared
+    if row is not None:
+        return row
+    row = result_row(compound_name, smiles)
+    try:
+        with _Deadline(timeout), METRICS.timer('compound_docking'):
+            docking.set_ligand(*ligand)
+            binding_scores = []
+            for attempt in range(attempts):
+                attempt_seed = None if seed is None else seed + attempt
+                poses = docking.run_docking_simulation(n_poses=1, max_evaluations=max_evaluations,
+                                                       seed=attempt_seed, flexible=flexible)
+                binding_scores.append(float(poses.scores[0]))
+                row['Evaluations'] += docking.search_stats['evaluations']
+    except TimeoutError:
+        row['Status'] = 'timeout'
+        return row
+    except Exception as exc:
+        row['Status'] = f'error: {exc}'
+        return row
+
+    row.update({
+        'Best_Score': min(binding_scores),
+        'Average_Score': np.mean(binding_scores),
+        'StdDev': np.std(binding_scores)
+    })
+    return row
+
+
+def _record_row(row):
+    """Count a finished compound by outcome and flush metrics when due"""
+    status = row['Status'].split(':')[0]
+    METRICS.count({'ok': 'compounds_done', 'error': 'compounds_failed'}.get(status, f'compounds_{status}'))
+    METRICS.flush()
+
+
+def _init_worker(receptor_file, cache_dir, grid_path, pocket, instrumented=False):
+    """Attach the prepared receptor and scoring grid read-only via memory maps"""
+    global _worker_docking
+    # Forked workers inherit the parent's counts; start from zero so merging does not double them
+    METRICS.reset()
+    METRICS.enabled = instrumented
+    docking = MolecularDocking()
+    docking.load_receptor(receptor_file, cache_dir)
+    docking.scoring_matrix = load_grid(grid_path)
+    docking.pocket = pocket
+    _worker_docking = docking
+
+
+def _dock_in_worker(options, prepared):
+    # Worker metrics travel back with the row and are merged in the parent
+    return dock_compound(_worker_docking, prepared, *options), METRICS.drain()
+
+
+def _dock_in_thread(template, options, prepared):
+    docking = getattr(_thread_state, 'docking', None)
+    if docking is None:
+        # Each thread docks its own ligand against the template's shared, read-only receptor and grid
+        docking = _thread_state.docking = MolecularDocking(template.ligand_cache)
+        for name in ('receptor', 'spatial_index', 'scoring_matrix', 'pocket', 'flexible_residues'):
+            setattr(docking, name, getattr(template, name))
+    return dock_compound(docking, prepared, *options), None
+
 
 class CompoundScreening:
-    def __init__(self):
-        self.docking = MolecularDocking()
+    def __init__(self, receptor_file="data/5ht2a.pdb", cache_dir=DEFAULT_CACHE_DIR, prefilter=None,
+                 flexible_residues=(), grid_cache_dir=DEFAULT_GRID_CACHE_DIR, ligand_cache=None):
+        self.receptor_file = receptor_file
+        self.cache_dir = cache_dir
+        self.grid_cache_dir = grid_cache_dir
+        self.prefilter = prefilter  # Drug-likeness rules checked before any ligand preparation
+        self.pipeline = None        # Stage pipeline of the last screen, for its utilization report
+        self.docking = MolecularDocking(ligand_cache)
+        self.docking.load_receptor(receptor_file, cache_dir, flexible_residues)
         self.compounds = {
             'Serotonin': "NCCC1=CC2=C(C=C1)C(=CN2)C",
             'Psilocin': "CN(C)CCc1c[nH]c2cccc(O)c12",
@@ -14,49 +153,161 @@ class CompoundScreening:
             'Bufotenin': "CN(C)CCc1c[nH]c2cc(O)ccc12"
         }
 
-    def screen_compounds(self):
-        results = []
-        
-        for compound_name, smiles in self.compounds.items():
-            print(f"\nScreening {compound_name}...")
-            
-            # Prepare ligand
-            self.docking.prepare_ligand(smiles)
-            
-            # Run multiple docking attempts
-            binding_scores = []
-            for _ in range(5):  # 5 attempts per compound
-                score, energy_components = self.docking.calculate_binding_score()
-                binding_scores.append(score)
-            
-            # Store results
-            results.append({
-                'Compound': compound_name,
-                'SMILES': smiles,
-                'Best_Score': min(binding_scores),
-                'Average_Score': np.mean(binding_scores),
-                'StdDev': np.std(binding_scores)
-            })
-        
-        return pd.DataFrame(results)
+    def screen_records(self, records, n_workers=1, batch_size=256, timeout=None, attempts=5,
+                       max_evaluations=5000, seed=None, n_conformers=1, flexible=True, start=0,
+                       prep_workers=1, dock_threads=False, queue_size=8, prefilter=True):
+        """Yield one result row per (name, smiles) record, in input order
+
+        Records flow through a pipeline: reading and prefiltering, ligand preparation in
+        prep_workers threads, and docking in a pool of n_workers processes (threads with
+        dock_threads=True, which cannot enforce timeout), with queues of queue_size between
+        them so embedding, scoring and the caller's writing overlap in bounded memory.
+        Record i is docked with seed + 1000 * i, counting from start, so a resumed run
+        reproduces the seeds of an uninterrupted one. Compounds failing the prefilter get
+        a 'rejected: <rule set>' row without being prepared or docked; prefilter=False skips
+        the rules for records that already passed them.
+        """
+        options = (attempts, max_evaluations, timeout, flexible)
+        if self.prefilter is not None and prefilter:
+            records = self.prefilter.annotate(records, batch_size)
+        else:
+            records = ((name, smiles, None) for name, smiles in records)
+        tasks = ((i, name, smiles, None if seed is None else seed + 1000 * i, reason)
+                 for i, (name, smiles, reason) in enumerate(records, start))
+
+        # Build (or map) the grid and pocket once so workers only attach to them
+        self.docking.build_scoring_grid(cache_dir=self.grid_cache_dir)
+        pocket = self.docking.detect_binding_pocket()
+        prepare = Stage('prepare', functools.partial(prepare_compound, self.docking, n_conformers=n_conformers),
+                        prep_workers)
+        if dock_threads:
+            dock = Stage('dock', functools.partial(_dock_in_thread, self.docking, options), n_workers)
+        else:
+            if self.docking.scoring_matrix.path is None:
+                raise ValueError("Process-pool docking needs a cached receptor and scoring grid")
+            initargs = (self.receptor_file, self.cache_dir, self.docking.scoring_matrix.path, pocket,
+                        METRICS.enabled)
+            dock = Stage('dock', functools.partial(_dock_in_worker, options), n_workers, processes=True,
+                         initializer=_init_worker, initargs=initargs)
+
+        self.pipeline = Pipeline([prepare, dock], queue_size)
+        for row, worker_metrics in self.pipeline.run(tasks):
+            METRICS.merge(worker_metrics)
+            print(f"Screened {row['Compound']}: {row['Status']}")
+            _record_row(row)
+            yield row
+
+    def screen_compounds(self, n_workers=1, timeout=None, attempts=5, max_evaluations=5000,
+                         seed=None, n_conformers=1, flexible=True, **pipeline_options):
+        """Dock every compound through the screening pipeline; rows keep compound order"""
+        return pd.DataFrame(list(self.screen_records(
+            self.compounds.items(), n_workers, timeout=timeout, attempts=attempts,
+            max_evaluations=max_evaluations, seed=seed, n_conformers=n_conformers, flexible=flexible,
+            **pipeline_options)))
+
+    def screen_library(self, library_file, output_dir, batch_size=256, resume=False, seed=None, **options):
+        """Stream a .smi/.sdf(.gz) library through docking, appending one store chunk per batch
+
+        A checkpoint in output_dir is updated after every chunk; resume=True skips the
+        compounds it records and continues with the same seeds.
+        """
+        store = ResultsStore(output_dir, SCREENING_SCHEMA)
+        checkpoint = Checkpoint(os.path.join(output_dir, CHECKPOINT_FILE))
+        if seed is None:
+            seed = int(np.random.default_rng().integers(1 << 31))
+        state = resume_state(checkpoint, store, resume=resume, fresh_state={
+            'library': os.path.abspath(library_file), 'completed': 0, 'seed': seed, 'chunks': []})
+        if state['library'] != os.path.abspath(library_file):
+            raise ValueError(f"Checkpoint in {output_dir} belongs to {state['library']}")
+
+        records = itertools.islice(read_library(library_file), state['completed'], None)
+        rows = self.screen_records(records, batch_size=batch_size, seed=state['seed'], start=state['completed'],
+                                   **options)
+        summary = summarize_store(output_dir, 'Best_Score', columns=['Compound'], schema=SCREENING_SCHEMA)
+        for batch in chunked(rows, batch_size):
+            batch = pd.DataFrame(batch)
+            with METRICS.timer('results_write'):
+                state['chunks'].append(store.append(batch))
+            state['completed'] += len(batch)
+            checkpoint.save(state)
+            summary.update(batch)
+            stats = summary.summary()
+            print(f"{state['completed']} compounds written to {output_dir} "
+                  f"(best {stats['Best Score']:.2f}, median {stats['Median']:.2f} kcal/mol)")
+        return state['completed']
 
     def analyze_results(self, results_df):
         # Sort compounds by binding affinity
         results_df = results_df.sort_values('Best_Score')
-        
+
         # Save results
-        results_df.to_csv('data/compound_screening_results.csv', index=False)
+        ResultsStore(os.path.join(DEFAULT_RESULTS_DIR, 'compound_screening'), SCREENING_SCHEMA).append(results_df)
         print("\nScreening Results:")
         print("-" * 50)
         print(results_df)
-        
+
         return results_df
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen the compound set against the 5-HT2A receptor")
+    parser.add_argument('--workers', type=int, default=1, help="docking stage pool size")
+    parser.add_argument('--dock-threads', action='store_true',
+                        help="dock in threads instead of processes (no per-compound timeout)")
+    parser.add_argument('--prep-workers', type=int, default=1, help="ligand preparation threads")
+    parser.add_argument('--queue-size', type=int, default=8, help="compounds queued between pipeline stages")
+    parser.add_argument('--timeout', type=float, default=None, help="seconds allowed per compound")
+    parser.add_argument('--conformers', type=int, default=1, help="size of the pre-generated conformer ensemble")
+    parser.add_argument('--rigid', action='store_true', help="dock ensemble members without torsional search")
+    parser.add_argument('--library', help=".smi/.sdf library to stream instead of the built-in compounds")
+    parser.add_argument('--output', default=os.path.join(DEFAULT_RESULTS_DIR, 'library_screening'),
+                        help="results store directory, appended to per batch")
+    parser.add_argument('--batch-size', type=int, default=256, help="compounds held in memory at once")
+    parser.add_argument('--resume', action='store_true', help="continue the checkpointed library screen in --output")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="successive halving: small searches for all, larger ones for the best-ranked")
+    parser.add_argument('--min-evaluations', type=int, default=500, help="adaptive: evaluations per compound in rung 0")
+    parser.add_argument('--eta', type=int, default=3, help="adaptive: keep 1/eta per rung, with eta times the budget")
+    parser.add_argument('--budget', type=int, help="adaptive: total pose evaluations (default: halve down to one)")
+    parser.add_argument('--rules', nargs='*', default=['lipinski', 'veber'], choices=sorted(RULE_SETS),
+                        help="prefilter rule sets applied before docking (none to disable)")
+    parser.add_argument('--flexible-residues', nargs='*', default=[], metavar='CHAIN:NUMBER',
+                        help="pocket residues whose side-chain rotamers are sampled (rotamer grid ensemble)")
+    parser.add_argument('--metrics-json', help="append metric snapshots to this JSON-lines log")
+    parser.add_argument('--metrics-prom', help="Prometheus textfile snapshot, e.g. for the node exporter")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="seconds between snapshots")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    if args.metrics_json or args.metrics_prom:
+        METRICS.configure(args.metrics_json, args.metrics_prom, args.metrics_interval)
+
     # Initialize receptor and run screening
-    screener = CompoundScreening()
-    results = screener.screen_compounds()
-    screener.analyze_results(results)
+    screener = CompoundScreening(prefilter=Prefilter(args.rules) if args.rules else None,
+                                 flexible_residues=args.flexible_residues)
+    options = {'n_workers': args.workers, 'timeout': args.timeout, 'n_conformers': args.conformers,
+               'flexible': not args.rigid, 'prep_workers': args.prep_workers, 'dock_threads': args.dock_threads,
+               'queue_size': args.queue_size}
+    if args.adaptive:
+        if args.resume:
+            parser.error("--adaptive screens cannot be resumed")
+        halving = SuccessiveHalving(screener, args.min_evaluations, args.eta, args.budget)
+        records = read_library(args.library) if args.library else screener.compounds.items()
+        results = halving.run(records, batch_size=args.batch_size, **options)
+        if args.library:
+            ResultsStore(args.output, ADAPTIVE_SCHEMA).append(results)
+            print(f"{len(results)} ranked compounds written to {args.output}")
+            print(results.head(10).to_string())
+        else:
+            screener.analyze_results(results)
+    elif args.library:
+        screener.screen_library(args.library, args.output, args.batch_size, args.resume, **options)
+    else:
+        results = screener.screen_compounds(**options)
+        screener.analyze_results(results)
+    if screener.prefilter is not None:
+        print(screener.prefilter.report())
+    if screener.pipeline is not None:
+        print(screener.pipeline.report())
+    METRICS.flush(force=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,29 +1,41 @@
-import pandas as pd
-import numpy as np
-
-# Read the CSV file
-df = pd.read_csv('c:\\Users\\PC\\Documents\\New Bioinformatics\\data\\docking_poses_results_formatted.csv')
-
-# Group the columns by type
-energy_cols = [col for col in df.columns if col.startswith('Energy_')]
-property_cols = [col for col in df.columns if col.startswith('Property_')]
-
-# Create separate DataFrames for better visualization
-energy_df = df[['Pose', 'Binding_Score'] + energy_cols].set_index('Pose')
-property_df = df[['Pose'] + property_cols].set_index('Pose')
-
-# Display results
-print("\nBinding Energies (kcal/mol):")
-print("=" * 80)
-print(energy_df)
-
-print("\nMolecular Properties:")
-print("=" * 80)
-print(property_df)
-
-# Display statistics for binding scores
-print("\nBinding Score Statistics:")
-print("=" * 80)
-print(f"Best Pose: {df.loc[df['Binding_Score'].idxmin(), 'Pose']} (Score: {df['Binding_Score'].min():.4f})")
-print(f"Average Score: {df['Binding_Score'].mean():.4f}")
-print(f"Standard Deviation: {df['Binding_Score'].std():.4f}")
\ No newline at end of file
+import argparse
+
+from results_store import ResultsStore
+
+def display_results(results_dir='data/results/docking_poses'):
+    """Print per-pose energies, properties and score statistics"""
+    # Read the score columns from the results store, skipping pose coordinates
+    store = ResultsStore(results_dir)
+    energy_cols = [col for col in store.schema if col.startswith('Energy_')]
+    property_cols = [col for col in store.schema if col.startswith('Property_')]
+    df = store.read(columns=['Pose', 'Binding_Score'] + energy_cols + property_cols).round(4)
+
+    # Create separate DataFrames for better visualization
+    energy_df = df[['Pose', 'Binding_Score'] + energy_cols].set_index('Pose')
+    property_df = df[['Pose'] + property_cols].set_index('Pose')
+
+    # Display results
+    print("\nBinding Energies (kcal/mol):")
+    print("=" * 80)
+    print(energy_df)
+
+    print("\nMolecular Properties:")
+    print("=" * 80)
+    print(property_df)
+
+    # Display statistics for binding scores
+    print("\nBinding Score Statistics:")
+    print("=" * 80)
+    print(f"Best Pose: {df.loc[df['Binding_Score'].idxmin(), 'Pose']} (Score: {df['Binding_Score'].min():.4f})")
+    print(f"Average Score: {df['Binding_Score'].mean():.4f}")
+    print(f"Standard Deviation: {df['Binding_Score'].std():.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the stored docking poses")
+    parser.add_argument('results_dir', nargs='?', default='data/results/docking_poses', help="pose results store")
+    args = parser.parse_args(argv)
+    display_results(args.results_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import importlib
+import os
+import sys
+
+# Command -> (module, function taking argv, help). Only the chosen command's module is
+# imported, so short jobs never pay for RDKit, pandas or matplotlib they do not use.
+COMMANDS = {
+    'prepare-receptor': ('receptor_prep', 'main', "prepare a receptor and warm the receptor and grid caches"),
+    'simulate': ('run_simulation', 'main', "repeat serotonin docking with checkpointing"),
+    'screen': ('compound_screening', 'main', "screen the built-in compounds or a SMILES/SDF library"),
+    'queue': ('work_queue', 'main', "shard a library screen across nodes through a shared directory"),
+    'analyze': ('analyze_results', 'main', "plot and summarise the best scores of a simulation run"),
+    'analyze-poses': ('analyze_docking', 'main', "score and energy-component statistics of stored poses"),
+    'display': ('display_results', 'main', "print the stored docking poses"),
+    'format': ('format_results', 'main', "export stored docking poses as a rounded CSV"),
+    'report': ('generate_report', 'main', "write the docking parameter explanation PDF"),
+    'benchmark': ('benchmark', 'main', "benchmark the docking hot paths offline"),
+}
+
+
+def usage():
+    lines = ["usage: dock.py <command> [options]", "", "commands:"]
+    lines += [f"  {name:18s} {help_text}" for name, (_, _, help_text) in COMMANDS.items()]
+    lines += ["", "Run 'dock.py <command> --help' for the options of a command."]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"dock.py: unknown command '{argv[0]}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    # The command modules import each other by bare name from src/
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.argv[0] = f"dock.py {argv[0]}"  # argparse usage lines then name the command
+    module, function, _ = COMMANDS[argv[0]]
+    return getattr(importlib.import_module(module), function)(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import numpy as np
+
+from result_columns import ENERGY_TERMS, PROPERTY_NAMES, energy_components
+
+ARRAY_FIELDS = ('energies', 'coords', 'fingerprints', 'properties', 'rotamers')
+
+
+class DockingResults:
+    """Poses of a docking run as parallel arrays instead of one dict per pose
+
+    energies is (n, n_terms) float32, coords (n, n_atoms, 3) float32, fingerprints
+    (n, n_words) uint64, properties (n, len(PROPERTY_NAMES)) float32 and rotamers
+    (n, n_flexible_residues) int16 or None. Slices and boolean or index masks give new
+    containers (slices share the coordinate and fingerprint arrays); an integer index
+    gives that pose as a dict.
+    """
+
+    def __init__(self, energies, coords, fingerprints=None, properties=None, rotamers=None,
+                 binding_site=None, rotamer_residues=()):
+        # Column-major, so each energy term is a contiguous column for pandas and Arrow
+        self.energies = np.asfortranarray(np.asarray(energies, dtype=np.float32).reshape(len(coords), -1))
+        self.coords = np.asarray(coords, dtype=np.float32)
+        self.scores = self.energies.sum(axis=1)  # Total binding score of every pose
+        n = len(self.coords)
+        self.fingerprints = (np.zeros((n, 0), dtype=np.uint64) if fingerprints is None
+                             else np.asarray(fingerprints, dtype=np.uint64))
+        self.properties = (np.full((n, len(PROPERTY_NAMES)), np.nan, dtype=np.float32) if properties is None
+                           else np.asarray(properties, dtype=np.float32))
+        self.rotamers = None if rotamers is None else np.asarray(rotamers, dtype=np.int16)
+        self.binding_site = binding_site          # Pocket summary shared by every pose
+        self.rotamer_residues = rotamer_residues  # Flexible residue records indexed by rotamers
+
+    @classmethod
+    def from_poses(cls, energies, coords, properties, fingerprints=None, **options):
+        """Container for one ligand, sharing its descriptor dict across poses without copying it"""
+        row = np.array([properties.get(name, np.nan) for name in PROPERTY_NAMES], dtype=np.float32)
+        return cls(energies, coords, fingerprints, np.broadcast_to(row, (len(coords), len(row))), **options)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def _take(self, index):
+        arrays = {name: None if getattr(self, name) is None else getattr(self, name)[index]
+                  for name in ARRAY_FIELDS}
+        return DockingResults(**arrays, binding_site=self.binding_site, rotamer_residues=self.rotamer_residues)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.pose(index)
+        return self._take(index)
+
+    def pose(self, i):
+        """One pose in the per-pose dict layout, for display"""
+        pose = {
+            'score': float(self.scores[i]),
+            'components': energy_components(self.energies[i]),
+            'properties': dict(zip(PROPERTY_NAMES, self.properties[i].tolist())),
+            'pose': self.coords[i].mean(axis=0),
+            'coordinates': self.coords[i],
+            'fingerprint': self.fingerprints[i],
+            'binding_site': self.binding_site,
+        }
+        if self.rotamers is not None:
+            pose['rotamers'] = {residue['residue']: residue['chis'][k]
+                                for residue, k in zip(self.rotamer_residues, self.rotamers[i])}
+        return pose
+
+    def sorted(self):
+        """Poses in order of increasing score"""
+        return self._take(np.argsort(self.scores, kind='stable'))
+
+    def top_k(self, k):
+        """The k best-scoring poses, best first, without sorting the rest"""
+        scores = self.scores
+        k = min(k, len(scores))
+        if k < len(scores):
+            best = np.argpartition(scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        return self._take(best[np.argsort(scores[best], kind='stable')])
+
+    @classmethod
+    def concatenate(cls, results):
+        """Stack containers of the same receptor (and fingerprint layout) into one"""
+        results = list(results)
+        if not results:
+            raise ValueError("Nothing to concatenate")
+        arrays = {name: np.concatenate([getattr(r, name) for r in results]) for name in ARRAY_FIELDS
+                  if name != 'rotamers'}
+        if all(r.rotamers is not None for r in results):
+            arrays['rotamers'] = np.concatenate([r.rotamers for r in results])
+        return cls(**arrays, binding_site=results[0].binding_site, rotamer_residues=results[0].rotamer_residues)
+
+    def to_columns(self, compound, smiles, run=0):
+        """Columns for a POSE_SCHEMA results store, as array views where the store accepts them"""
+        n = len(self)
+        columns = {
+            'Compound': [compound] * n,
+            'SMILES': [smiles] * n,
+            'Run': np.full(n, run, dtype=np.int32),
+            'Pose': np.arange(1, n + 1, dtype=np.int32),
+            'Binding_Score': self.scores,
+            'Coordinates': self.coords,
+            'Interaction_FP': self.fingerprints,
+        }
+        for k, term in enumerate(ENERGY_TERMS):
+            columns[f'Energy_{term}'] = self.energies[:, k]
+        for k, name in enumerate(PROPERTY_NAMES):
+            columns[f'Property_{name}'] = self.properties[:, k]
+        return columns
+
+    def to_pandas(self, coords=False):
+        """DataFrame of scores, energy terms and properties, built from column views (copy=False)
+
+        coords=True adds a Coordinates column holding one (n_atoms, 3) view per pose.
+        """
+        columns = {'Pose': np.arange(1, len(self) + 1, dtype=np.int32), 'Binding_Score': self.scores}
+        columns.update((f'Energy_{term}', self.energies[:, k]) for k, term in enumerate(ENERGY_TERMS))
+        columns.update((f'Property_{name}', self.properties[:, k]) for k, name in enumerate(PROPERTY_NAMES))
+        if coords:
+            columns['Coordinates'] = list(self.coords)
+        # Imported here so docking without DataFrame output never loads pandas
+        import pandas as pd
+
+        return pd.DataFrame(columns, copy=False)
+
+    def to_arrow(self):
+        """pyarrow Table over the arrays, copying only non-contiguous slices
+
+        Coordinates and fingerprints become fixed-size list columns.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("pyarrow is required for to_arrow()") from None
+        n = len(self)
+        columns = {'Pose': pa.array(np.arange(1, n + 1, dtype=np.int32)), 'Binding_Score': pa.array(self.scores)}
+        for k, term in enumerate(ENERGY_TERMS):
+            columns[f'Energy_{term}'] = pa.array(np.ascontiguousarray(self.energies[:, k]))
+        for k, name in enumerate(PROPERTY_NAMES):
+            columns[f'Property_{name}'] = pa.array(np.ascontiguousarray(self.properties[:, k]))
+        for name, values in (('Coordinates', self.coords.reshape(n, -1)), ('Interaction_FP', self.fingerprints)):
+            if values.shape[1]:
+                columns[name] = pa.FixedSizeListArray.from_arrays(
+                    pa.array(np.ascontiguousarray(values).ravel()), values.shape[1])
+        return pa.table(columns)
@@ -0,0 +1,122 @@
+import numpy as np
+
+from atom_types import VDW_RADIUS, VDW_EPSILON, XS_RADIUS, SOLVATION, VOLUME, CHARGE_SOLVATION
+from scoring_grid import (ENERGY_TERMS, CUTOFF, ENERGY_CAP, VDW_WEIGHT, HBOND_WEIGHT, ELEC_WEIGHT,
+                          DESOLV_WEIGHT, HYDROPHOBIC_WEIGHT, PI_STACKING_WEIGHT, HBOND_DISTANCE, HBOND_DEPTH,
+                          PI_STACKING_DISTANCE, DESOLV_SIGMA, COULOMB, distance_dependent_dielectric)
+
+BOND_LENGTH = 1.9  # Å, receptor heavy atoms closer than this count as bonded
+HBOND_C12 = 5 * HBOND_DEPTH * HBOND_DISTANCE ** 12
+HBOND_C10 = 6 * HBOND_DEPTH * HBOND_DISTANCE ** 10
+
+
+def _unit(vectors):
+    """Normalise rows, leaving zero vectors at zero"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+def _alignment(direction, vector):
+    """Angular weight in [0, 1]: 1 along direction, falling to 0 at 90 degrees; 1 where direction is unknown"""
+    cosine = np.clip((direction * vector).sum(-1), 0.0, 1.0)
+    return np.where(np.any(direction != 0, axis=-1), cosine, 1.0).astype(np.float32)
+
+
+class PairwiseForceField:
+    """Exact ligand-receptor pair energies over neighbor lists, term for term like the affinity grid maps
+
+    The functional forms, weights and per-atom caps are those used to build the grid, so
+    the two paths differ only by interpolation error, the box edge and the directional
+    hydrogen-bond weight applied here.
+    """
+
+    def __init__(self, receptor, index, cutoff=CUTOFF):
+        self.receptor = {name: np.asarray(value) for name, value in receptor.items()}
+        self.coords = self.receptor['coords'].astype(np.float32)
+        self.types = self.receptor['types'].astype(int)
+        self.index = index
+        self.cutoff = cutoff
+        self.solvation = (SOLVATION[self.types] + CHARGE_SOLVATION * np.abs(self.receptor['charges'])).astype(np.float32)
+        self.directions = self._polar_directions()
+
+    def _polar_directions(self):
+        """Unit vectors pointing away from the bonded heavy atoms of every donor and acceptor"""
+        directions = np.zeros_like(self.coords)
+        polar = np.nonzero(self.receptor['donor'] | self.receptor['acceptor'])[0]
+        point, atom, r = self.index.query_pairs(self.coords[polar], BOND_LENGTH)
+        bonded = r > 0.1
+        point, atom = point[bonded], atom[bonded]
+        counts = np.bincount(point, minlength=len(polar))
+        sums = np.stack([np.bincount(point, self.coords[atom, k], minlength=len(polar)) for k in range(3)], axis=1)
+        has_neighbors = counts > 0
+        centers = sums[has_neighbors] / counts[has_neighbors, None]
+        directions[polar[has_neighbors]] = _unit(self.coords[polar[has_neighbors]] - centers)
+        return directions
+
+    @staticmethod
+    def ligand_directions(coords, terms):
+        """Per-pose unit vectors pointing away from each ligand atom's bonded heavy atoms"""
+        return _unit(coords - np.einsum('ij,njk->nik', terms.heavy_neighbors, coords))
+
+    def score_batch(self, coords, terms, max_points=1 << 14):
+        """Score a (n_poses, n_atoms, 3) batch, returning (n_poses, n_terms) float32 like AffinityGrid.score_batch
+
+        Poses are processed max_points ligand atoms at a time so the pair temporaries stay bounded.
+        """
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, terms.n_atoms, 3)
+        energies = np.empty((len(coords), len(ENERGY_TERMS)), dtype=np.float32)
+        chunk = max(1, max_points // terms.n_atoms)
+        for start in range(0, len(coords), chunk):
+            energies[start:start + chunk] = self._score_chunk(coords[start:start + chunk], terms)
+        return energies
+
+    def _score_chunk(self, coords, terms):
+        ligand = terms.atoms
+        n_poses, n_atoms = coords.shape[:2]
+        points = coords.reshape(-1, 3)
+        point, atom, r = self.index.query_pairs(points, self.cutoff)
+        r = np.maximum(r, 0.5).astype(np.float32)
+        lig = point % n_atoms
+        ti, tj = ligand['types'][lig].astype(int), self.types[atom]
+
+        def per_atom(energy, mask=None):
+            if mask is not None:
+                return np.bincount(point[mask], weights=energy[mask], minlength=len(points))
+            return np.bincount(point, weights=energy, minlength=len(points))
+
+        rij = (VDW_RADIUS[ti] + VDW_RADIUS[tj]) / 2
+        eps = np.sqrt(VDW_EPSILON[ti] * VDW_EPSILON[tj])
+        ratio6 = (rij / r) ** 6
+        vdw = np.minimum(per_atom(VDW_WEIGHT * eps * (ratio6 ** 2 - 2 * ratio6)), ENERGY_CAP)
+
+        potential = per_atom(ELEC_WEIGHT * COULOMB * self.receptor['charges'][atom]
+                             / (distance_dependent_dielectric(r) * r))
+        elec = np.clip(potential, -ENERGY_CAP, ENERGY_CAP) * np.tile(ligand['charges'], n_poses)
+
+        # Directional 12-10 hydrogen bonds, weighted by the alignment at both partners
+        hbond = HBOND_WEIGHT * (HBOND_C12 / r ** 12 - HBOND_C10 / r ** 10)
+        separation = _unit(points[point] - self.coords[atom])
+        ligand_directions = self.ligand_directions(coords, terms).reshape(-1, 3)[point]
+        hbond *= _alignment(self.directions[atom], separation) * _alignment(ligand_directions, -separation)
+        hbonds = (np.minimum(per_atom(hbond, ligand['acceptor'][lig] & self.receptor['donor'][atom]), ENERGY_CAP)
+                  + np.minimum(per_atom(hbond, ligand['donor'][lig] & self.receptor['acceptor'][atom]), ENERGY_CAP))
+
+        gauss = DESOLV_WEIGHT * np.exp(-r ** 2 / (2 * DESOLV_SIGMA ** 2))
+        ligand_solvation = SOLVATION[ti] + CHARGE_SOLVATION * np.abs(ligand['charges'][lig])
+        desolvation = per_atom(gauss * (VOLUME[tj] * ligand_solvation + self.solvation[atom] * VOLUME[ti]))
+
+        stacking = PI_STACKING_WEIGHT * np.exp(-((r - PI_STACKING_DISTANCE) / 0.6) ** 2)
+        pi_stacking = per_atom(stacking, ligand['aromatic'][lig] & self.receptor['aromatic'][atom])
+
+        # Ligand carbon radius for every hydrophobic ligand atom, as the single grid map assumes
+        surface = r - XS_RADIUS[0] - XS_RADIUS[tj]
+        hydrophobic = per_atom(HYDROPHOBIC_WEIGHT * np.clip(1.5 - surface, 0.0, 1.0),
+                               ligand['hydrophobic'][lig] & self.receptor['hydrophobic'][atom])
+
+        terms_per_atom = {'van_der_waals': vdw, 'electrostatic': elec, 'hydrogen_bonds': hbonds,
+                          'desolvation': desolvation, 'pi_stacking': pi_stacking, 'hydrophobic': hydrophobic}
+        energies = np.zeros((n_poses, len(ENERGY_TERMS)), dtype=np.float32)
+        for term, values in terms_per_atom.items():
+            energies[:, ENERGY_TERMS.index(term)] = values.reshape(n_poses, n_atoms).sum(1)
+        energies[:, ENERGY_TERMS.index('entropy')] = terms.entropy
+        return energies
@@ -1,7 +1,6 @@
-import pandas as pd
+import argparse
 
-# Read the CSV file
-df = pd.read_csv('c:\\Users\\PC\\Documents\\New Bioinformatics\\data\\docking_poses_results.csv')
+from results_store import ResultsStore
 
 # Format numeric columns to 4 decimal places
 numeric_columns = [
@@ -18,8 +17,24 @@ numeric_columns = [
     'Property_TPSA'
 ]
 
-for col in numeric_columns:
-    df[col] = df[col].round(4)
+def format_results(results_dir='data/results/docking_poses', output='data/docking_poses_results_formatted.csv'):
+    """Export the stored poses as a CSV rounded to 4 decimal places"""
+    # Read only the columns being formatted from the results store
+    df = ResultsStore(results_dir).read(columns=['Pose'] + numeric_columns)
 
-# Save the formatted results
-df.to_csv('c:\\Users\\PC\\Documents\\New Bioinformatics\\data\\docking_poses_results_formatted.csv', index=False)
\ No newline at end of file
+    for col in numeric_columns:
+        df[col] = df[col].round(4)
+
+    # Export the formatted results for sharing
+    df.to_csv(output, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export stored docking poses as a rounded CSV")
+    parser.add_argument('results_dir', nargs='?', default='data/results/docking_poses', help="pose results store")
+    parser.add_argument('--output', default='data/docking_poses_results_formatted.csv', help="CSV file to write")
+    args = parser.parse_args(argv)
+    format_results(args.results_dir, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import argparse
+
 from fpdf import FPDF
 
 class DockingReport(FPDF):
@@ -80,5 +82,9 @@ def create_docking_report():
     
     pdf.output("data/docking_parameters_explanation.pdf")
 
+def main(argv=None):
+    argparse.ArgumentParser(description="Write the docking parameter explanation PDF").parse_args(argv)
+    create_docking_report()
+
 if __name__ == "__main__":
-    create_docking_report()
\ No newline at end of file
+    main()
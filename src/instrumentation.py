@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Upper bounds (seconds) of the duration histogram buckets, 1 ms to ~5 min
+TIME_BUCKETS = tuple(float(b) for b in np.round(np.logspace(-3, 2.5, 12), 4))
+PREFIX = 'docking'
+
+
+class _NullTimer:
+    """Shared no-op context manager handed out while instrumentation is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    """Count, sum, min, max and per-bucket counts of observed values (cumulated only for Prometheus)"""
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def merge(self, summary):
+        self.count += summary['count']
+        self.sum += summary['sum']
+        self.min = min(self.min, summary['min'])
+        self.max = max(self.max, summary['max'])
+        self.counts = [a + b for a, b in zip(self.counts, summary['buckets'])]
+
+    def summary(self):
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+                'mean': self.sum / self.count if self.count else 0.0, 'buckets': list(self.counts)}
+
+
+class Metrics:
+    """Stage timers, counters, gauges and histograms with JSON-lines and Prometheus textfile output
+
+    While disabled every hook returns immediately, so instrumented code pays only an
+    attribute check. Updates are locked, so pipeline threads can share the registry.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.RLock()
+        self.json_path = None
+        self.prometheus_path = None
+        self.interval = 10.0
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+        self._last_flush = 0.0
+
+    def configure(self, json_path=None, prometheus_path=None, interval=10.0):
+        """Enable collection and set where flush() writes snapshots"""
+        self.enabled = True
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+
+    def timer(self, name):
+        """Context manager recording the duration of a stage into histogram name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Record one stage duration"""
+        if self.enabled:
+            with self._lock:
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram()
+                self.histograms[name].observe(seconds)
+
+    def snapshot(self):
+        """Plain-dict view of every metric"""
+        with self._lock:
+            return {
+                'timestamp': time.time(),
+                'uptime_s': time.time() - self.started,
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {name: h.summary() for name, h in self.histograms.items()},
+            }
+
+    def drain(self):
+        """Snapshot and clear, e.g. to ship a pool worker's metrics back to the parent"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            snapshot = self.snapshot()
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Fold a drained snapshot (from another process) into this registry"""
+        if not self.enabled or not snapshot:
+            return
+        with self._lock:
+            self._merge(snapshot)
+
+    def _merge(self, snapshot):
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+        self.gauges.update(snapshot['gauges'])
+        for name, summary in snapshot['histograms'].items():
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].merge(summary)
+
+    def flush(self, force=False):
+        """Write the configured outputs at most once per interval (always when force is set)"""
+        if not self.enabled or not (self.json_path or self.prometheus_path):
+            return
+        now = time.time()
+        if not force and now - self._last_flush < self.interval:
+            return
+
+        # Average rate of every counter over the run; scrapers can derive instantaneous rates
+        for name, value in list(self.counters.items()):
+            self.gauges[f'{name}_per_second'] = value / max(now - self.started, 1e-9)
+        self._last_flush = now
+
+        snapshot = self.snapshot()
+        if self.json_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.json_path)), exist_ok=True)
+            with open(self.json_path, 'a') as handle:
+                handle.write(json.dumps(snapshot) + '\n')
+        if self.prometheus_path:
+            # The node exporter textfile collector must never see a partial file
+            os.makedirs(os.path.dirname(os.path.abspath(self.prometheus_path)), exist_ok=True)
+            staging = f'{self.prometheus_path}.{os.getpid()}.tmp'
+            with open(staging, 'w') as handle:
+                handle.write(self.prometheus_text(snapshot))
+            os.replace(staging, self.prometheus_path)
+
+    def prometheus_text(self, snapshot=None):
+        """Prometheus text exposition format of a snapshot"""
+        snapshot = snapshot or self.snapshot()
+        lines = [f'# TYPE {PREFIX}_uptime_seconds gauge', f"{PREFIX}_uptime_seconds {snapshot['uptime_s']:.3f}"]
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += [f'# TYPE {PREFIX}_{name}_total counter', f'{PREFIX}_{name}_total {value}']
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines += [f'# TYPE {PREFIX}_{name} gauge', f'{PREFIX}_{name} {value:.6g}']
+        for name, summary in sorted(snapshot['histograms'].items()):
+            metric = f'{PREFIX}_{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(self.histograms[name].buckets, summary['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+            lines += [f'{metric}_bucket{{le="+Inf"}} {summary["count"]}',
+                      f'{metric}_sum {summary["sum"]:.6f}', f'{metric}_count {summary["count"]}']
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry used by the instrumented stages
+METRICS = Metrics()
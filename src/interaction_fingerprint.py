@@ -0,0 +1,130 @@
+import numpy as np
+from rdkit import Chem
+
+from atom_types import SIDE_CHAIN_CHARGES
+from prefilter import BASIC_AMINE
+
+INTERACTION_TYPES = ('hydrophobic', 'hbond_donor', 'hbond_acceptor', 'pi_stacking', 'ionic')
+# Å, heavy-atom contact distances per interaction type
+CUTOFFS = {'hydrophobic': 4.0, 'hbond_donor': 3.5, 'hbond_acceptor': 3.5, 'pi_stacking': 4.5, 'ionic': 4.5}
+POCKET_RADIUS = 12.0  # Å around the site centre; residues with an atom inside get bits
+ACIDIC_GROUP = Chem.MolFromSmarts('[$([OX2H1,OX1-][CX3,SX4,PX4]=O)]')
+
+# Bit counts of every byte value, for NumPy releases without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """Set bits per row of a (n, n_words) uint64 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+def tanimoto(fingerprints, reference, block_size=1 << 17):
+    """Tanimoto similarity of every packed fingerprint row to one reference, in blocks of rows"""
+    fingerprints = np.asarray(fingerprints, dtype=np.uint64).reshape(-1, len(reference))
+    reference = np.asarray(reference, dtype=np.uint64)
+    reference_bits = popcount(reference[None, :])[0]
+    similarity = np.empty(len(fingerprints), dtype=np.float32)
+    for start in range(0, len(fingerprints), block_size):
+        block = fingerprints[start:start + block_size]
+        common = popcount(block & reference)
+        union = popcount(block) + reference_bits - common
+        similarity[start:start + block_size] = np.where(union > 0, common / np.maximum(union, 1), 1.0)
+    return similarity
+
+
+def rank_by_similarity(fingerprints, reference, top_k=100):
+    """Indices and similarities of the top_k fingerprints most similar to the reference, best first"""
+    similarity = tanimoto(fingerprints, reference)
+    top_k = min(top_k, len(similarity))
+    if not top_k:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    top = np.argpartition(-similarity, top_k - 1)[:top_k]
+    top = top[np.argsort(-similarity[top], kind='stable')]
+    return top, similarity[top]
+
+
+def ligand_features(mol, atoms):
+    """Per-atom interaction flags of a ligand from its typed atoms (LigandTerms.atoms)"""
+    cationic = np.zeros(mol.GetNumAtoms(), dtype=bool)
+    anionic = np.zeros(mol.GetNumAtoms(), dtype=bool)
+    # Ligands are embedded neutral, so ionizable groups are recognised rather than read from charges
+    for match in mol.GetSubstructMatches(BASIC_AMINE):
+        cationic[match[0]] = True
+    for match in mol.GetSubstructMatches(ACIDIC_GROUP):
+        anionic[match[0]] = True
+    for atom in mol.GetAtoms():
+        cationic[atom.GetIdx()] |= atom.GetFormalCharge() > 0
+        anionic[atom.GetIdx()] |= atom.GetFormalCharge() < 0
+    return {'hydrophobic': atoms['hydrophobic'], 'donor': atoms['donor'], 'acceptor': atoms['acceptor'],
+            'aromatic': atoms['aromatic'], 'cationic': cationic, 'anionic': anionic}
+
+
+class InteractionFingerprinter:
+    """Residue x interaction-type contact bits of ligand poses, packed into uint64 words
+
+    Bit slot * len(INTERACTION_TYPES) + type is set when any ligand atom makes that
+    contact with pocket residue slot. Pocket residues are fixed by the receptor and the
+    site centre, so fingerprints from the same receptor and box are comparable.
+    """
+
+    def __init__(self, receptor, index, center, radius=POCKET_RADIUS):
+        self.receptor = receptor
+        self.index = index
+        near = self.index.query_pairs(np.asarray(center, dtype=np.float32)[None, :], radius)[1]
+        residues = np.unique(receptor.residue_index[near])
+        self.residues = residues
+        # Receptor atom -> pocket residue slot, -1 outside the pocket
+        self.slot = np.full(len(receptor.coords), -1, dtype=np.int64)
+        in_pocket = np.isin(receptor.residue_index, residues)
+        self.slot[in_pocket] = np.searchsorted(residues, receptor.residue_index[in_pocket])
+        self.n_bits = len(residues) * len(INTERACTION_TYPES)
+        self.n_words = max(1, -(-self.n_bits // 64))
+        # Salt bridges only involve ionized side chains, not the backbone dipole
+        side_chain_charges = np.array([SIDE_CHAIN_CHARGES.get((resname, name), 0.0) for resname, name in
+                                       zip(receptor.residue_names[receptor.residue_index], receptor.atom_names)])
+        self.atom_flags = {
+            'hydrophobic': np.asarray(receptor.hydrophobic), 'donor': np.asarray(receptor.donor),
+            'acceptor': np.asarray(receptor.acceptor), 'aromatic': np.asarray(receptor.aromatic),
+            'cationic': side_chain_charges >= 1 / 3, 'anionic': side_chain_charges <= -0.5,
+        }
+
+    def bit_names(self):
+        """'A:155 ASP ionic'-style label of every bit"""
+        return [f"{self.receptor.chain_ids[r]}:{self.receptor.residue_numbers[r]} "
+                f"{self.receptor.residue_names[r]} {kind}"
+                for r in self.residues for kind in INTERACTION_TYPES]
+
+    def fingerprints(self, coords, mol, atoms):
+        """Packed (n_poses, n_words) uint64 fingerprints of a (n_poses, n_atoms, 3) batch of poses of mol"""
+        coords = np.asarray(coords, dtype=np.float32)
+        n_poses, n_atoms = coords.shape[:2]
+        ligand = ligand_features(mol, atoms)
+        receptor = self.atom_flags
+        point, atom, distance = self.index.query_pairs(coords.reshape(-1, 3), max(CUTOFFS.values()))
+        inside = self.slot[atom] >= 0
+        point, atom, distance = point[inside], atom[inside], distance[inside]
+        lig = point % n_atoms
+
+        contacts = {
+            'hydrophobic': ligand['hydrophobic'][lig] & receptor['hydrophobic'][atom],
+            'hbond_donor': ligand['donor'][lig] & receptor['acceptor'][atom],
+            'hbond_acceptor': ligand['acceptor'][lig] & receptor['donor'][atom],
+            'pi_stacking': ligand['aromatic'][lig] & receptor['aromatic'][atom],
+            'ionic': ((ligand['cationic'][lig] & receptor['anionic'][atom])
+                      | (ligand['anionic'][lig] & receptor['cationic'][atom])),
+        }
+        bits = np.zeros((n_poses, self.n_words * 64), dtype=bool)
+        for kind, (name, hit) in enumerate(contacts.items()):
+            hit &= distance <= CUTOFFS[name]
+            bits[point[hit] // n_atoms, self.slot[atom[hit]] * len(INTERACTION_TYPES) + kind] = True
+        # Little-endian bit order keeps bit b in word b // 64 at position b % 64
+        return np.packbits(bits, axis=1, bitorder='little').view('<u8')
+
+    def explain(self, fingerprint):
+        """Labels of the bits set in one packed fingerprint"""
+        bits = np.unpackbits(np.asarray(fingerprint, dtype='<u8').view(np.uint8), bitorder='little')
+        names = self.bit_names()
+        return [names[b] for b in np.nonzero(bits[:self.n_bits])[0]]
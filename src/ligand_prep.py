@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import AllChem, Descriptors
+
+# Bump whenever embedding or descriptors change so stale entries are not reused
+LIGAND_PREP_VERSION = 1
+DEFAULT_LIGAND_CACHE = os.path.join('data', 'cache', 'ligands.sqlite')
+# Triggers keep the total entry size in cache_stats, so eviction checks need no table scan
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ligands (key TEXT PRIMARY KEY, smiles TEXT, mol BLOB, descriptors TEXT,
+                                    size INTEGER, last_used REAL);
+CREATE INDEX IF NOT EXISTS ligands_last_used ON ligands (last_used);
+CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER);
+CREATE TRIGGER IF NOT EXISTS ligands_insert AFTER INSERT ON ligands BEGIN
+    UPDATE cache_stats SET value = value + NEW.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS ligands_delete AFTER DELETE ON ligands BEGIN
+    UPDATE cache_stats SET value = value - OLD.size WHERE name = 'bytes';
+END;
+"""
+
+
+def ligand_descriptors(mol):
+    """Drug-likeness descriptors of a prepared ligand"""
+    return {
+        'MW': float(Descriptors.ExactMolWt(mol)),
+        'LogP': float(Descriptors.MolLogP(mol)),
+        'TPSA': float(Descriptors.TPSA(mol)),
+        'HBD': int(Descriptors.NumHDonors(mol)),
+        'HBA': int(Descriptors.NumHAcceptors(mol)),
+        'RotBonds': int(Descriptors.NumRotatableBonds(mol))
+    }
+
+
+def canonical_smiles(smiles):
+    """Canonical RDKit SMILES, raising ValueError for unparsable input"""
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        raise ValueError(f"Invalid SMILES: {smiles}")
+    return Chem.MolToSmiles(mol)
+
+
+def embed_ligand(smiles, random_seed=42, n_conformers=1, optimize=False, prune_rms=0.5):
+    """Protonate and embed one conformer, or a pruned ensemble of up to n_conformers"""
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        raise ValueError(f"Invalid SMILES: {smiles}")
+    mol = Chem.AddHs(mol)
+    if n_conformers <= 1:
+        if AllChem.EmbedMolecule(mol, randomSeed=random_seed) < 0:
+            raise ValueError(f"Could not embed a conformer for {smiles}")
+        if optimize:
+            AllChem.MMFFOptimizeMolecule(mol)
+        return mol
+
+    # Oversample, since RMSD pruning during and after relaxation discards near-duplicates
+    params = AllChem.ETKDGv3()
+    params.randomSeed = random_seed
+    params.numThreads = 0
+    params.pruneRmsThresh = prune_rms
+    if not AllChem.EmbedMultipleConfs(mol, 2 * n_conformers, params):
+        raise ValueError(f"Could not embed a conformer for {smiles}")
+
+    energies = np.zeros(mol.GetNumConformers())
+    if optimize:
+        if AllChem.MMFFHasAllMoleculeParams(mol):
+            results = AllChem.MMFFOptimizeMoleculeConfs(mol, numThreads=0)
+        else:
+            results = AllChem.UFFOptimizeMoleculeConfs(mol, numThreads=0)
+        energies = np.array([energy for _, energy in results])
+    return prune_conformers(mol, n_conformers, prune_rms, energies)
+
+
+def prune_conformers(mol, n_conformers, prune_rms, energies):
+    """Keep the lowest-energy conformers whose aligned heavy-atom RMSD exceeds prune_rms"""
+    conformer_ids = [conf.GetId() for conf in mol.GetConformers()]
+    heavy = Chem.RemoveHs(mol)
+    # Lower triangle of the pairwise RMSD matrix, row-major
+    packed = AllChem.GetConformerRMSMatrix(heavy, prealigned=False)
+    rmsd = np.zeros((len(conformer_ids), len(conformer_ids)))
+    rmsd[np.tril_indices(len(conformer_ids), -1)] = packed
+    rmsd += rmsd.T
+
+    kept = []
+    for i in np.argsort(energies, kind='stable'):
+        if len(kept) == n_conformers:
+            break
+        if not kept or rmsd[i, kept].min() > prune_rms:
+            kept.append(i)
+
+    pruned = Chem.Mol(mol)
+    pruned.RemoveAllConformers()
+    for i in kept:
+        pruned.AddConformer(mol.GetConformer(conformer_ids[i]), assignId=True)
+    return pruned
+
+
+class LigandCache:
+    """Embedded conformers and descriptors per canonical SMILES, in an LRU and a capped SQLite store"""
+
+    def __init__(self, path=DEFAULT_LIGAND_CACHE, max_entries=256, max_bytes=256 << 20):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.hits = {'memory': 0, 'disk': 0, 'miss': 0}
+        self._local = threading.local()  # SQLite connections cannot be shared between threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(smiles, **params):
+        """Hash of the canonical SMILES and the embedding parameters"""
+        options = dict(params, smiles=smiles, version=LIGAND_PREP_VERSION)
+        return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()[:24]
+
+    def _db(self):
+        # Connections are not shared across forked pool workers or threads
+        if self.path is None:
+            return None
+        local = self._local
+        if getattr(local, 'connection', None) is None or local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            local.connection = sqlite3.connect(self.path, timeout=30)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            # REPLACE then fires the delete trigger for the row it overwrites
+            local.connection.execute('PRAGMA recursive_triggers=ON')
+            local.connection.executescript(CACHE_SCHEMA)
+            with local.connection:
+                # Stores created before the running total existed are summed once
+                local.connection.execute("INSERT OR IGNORE INTO cache_stats VALUES "
+                                         "('bytes', (SELECT COALESCE(SUM(size), 0) FROM ligands))")
+            local.pid = os.getpid()
+        return local.connection
+
+    def get(self, smiles, **params):
+        """Return (mol, descriptors) for a SMILES, embedding it on a miss"""
+        smiles = canonical_smiles(smiles)
+        key = self.cache_key(smiles, **params)
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return self._copy(entry)
+
+        # Embedding runs outside the lock so several preparation threads can work at once
+        entry = self._load(key)
+        tier = 'disk' if entry is not None else 'miss'
+        if entry is None:
+            mol = embed_ligand(smiles, **params)
+            entry = (mol.ToBinary(), ligand_descriptors(mol))
+            self._store(key, smiles, entry)
+
+        with self._lock:
+            self.hits[tier] += 1
+            self.memory[key] = entry
+            if len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        return self._copy(entry)
+
+    @staticmethod
+    def _copy(entry):
+        # Callers get their own molecule and dict so cached entries stay untouched
+        binary, descriptors = entry
+        return Chem.Mol(binary), dict(descriptors)
+
+    def _load(self, key):
+        db = self._db()
+        if db is None:
+            return None
+        try:
+            row = db.execute('SELECT mol, descriptors FROM ligands WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            with db:
+                db.execute('UPDATE ligands SET last_used = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.OperationalError:
+            return None
+        return bytes(row[0]), json.loads(row[1])
+
+    def _store(self, key, smiles, entry):
+        db = self._db()
+        if db is None:
+            return
+        binary, descriptors = entry
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO ligands VALUES (?, ?, ?, ?, ?, ?)',
+                           (key, smiles, binary, json.dumps(descriptors), len(binary), time.time()))
+                self._evict(db)
+        except sqlite3.OperationalError:
+            # A busy store only costs a re-embed later
+            pass
+
+    def _evict(self, db):
+        """Drop least recently used rows until the store fits in max_bytes"""
+        total = db.execute("SELECT value FROM cache_stats WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        stale = []
+        for key, size in db.execute('SELECT key, size FROM ligands ORDER BY last_used'):
+            if excess <= 0:
+                break
+            stale.append((key,))
+            excess -= size
+        db.executemany('DELETE FROM ligands WHERE key = ?', stale)
+
+    def clear(self):
+        """Empty both tiers"""
+        with self._lock:
+            self.memory.clear()
+            db = self._db()
+            if db is not None:
+                with db:
+                    db.execute('DELETE FROM ligands')
@@ -1,94 +1,261 @@
 import numpy as np
-from rdkit import Chem
-from rdkit.Chem import AllChem, Descriptors, Draw
-from Bio.PDB import *
-import pandas as pd
+
+from instrumentation import METRICS
+from flexible_receptor import RotamerGridEnsemble
+from docking_results import DockingResults
+from force_field import PairwiseForceField
+from interaction_fingerprint import InteractionFingerprinter
+from ligand_prep import LigandCache
+from pocket_detection import detect_pockets
+from pose_search import LigandModel, MonteCarloSearch
+from receptor_prep import DEFAULT_CACHE_DIR, PreparedReceptor
+from result_columns import energy_components
+from scoring_grid import DEFAULT_GRID_CACHE_DIR, AffinityGrid, LigandTerms
+from spatial_index import build_spatial_index
+
+# In 4oaj the 5-HT2A C-terminal peptide (chain B) marks the binding groove
+SITE_CHAIN = 'B'
+
+
+def random_rotation(rng=np.random):
+    """Draw a uniformly distributed 3x3 rotation matrix"""
+    q = rng.normal(size=4)
+    w, x, y, z = q / np.linalg.norm(q)
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+
 
 class MolecularDocking:
-    def __init__(self):
+    def __init__(self, ligand_cache=None):
         self.receptor = None  # Stores the 5-HT2A receptor structure
         self.ligand = None    # Stores the serotonin molecule
-        self.scoring_matrix = None  # For binding affinity calculations
+        self.ligand_descriptors = None  # Descriptors of the current ligand, computed once per SMILES
+        self.ligand_cache = ligand_cache if ligand_cache is not None else LigandCache()
+        self.scoring_matrix = None  # Precomputed AffinityGrid for binding affinity calculations
+        self.ligand_terms = None    # Per-atom grid coefficients of the current ligand
+        self.spatial_index = None   # Cell list over receptor atoms for cutoff neighbor queries
+        self.force_field = None     # Pairwise force field for exact rescoring, built on first use
+        self.fingerprinter = None   # Pocket residue interaction fingerprints, built with the grid
+        self.pocket = None          # Detected binding pocket, computed once per receptor
+        self.flexible_residues = () # 'CHAIN:NUMBER' residues whose side-chain rotamers are sampled
+        self.search_stats = None    # Throughput figures of the last pose search
         
-    def load_receptor(self, pdb_file):
-        """Load and prepare the 5-HT2A receptor structure"""
-        parser = PDBParser()
-        self.receptor = parser.get_structure('5HT2A', pdb_file)
+    def load_receptor(self, pdb_file, cache_dir=DEFAULT_CACHE_DIR, flexible_residues=()):
+        """Load the prepared 5-HT2A receptor arrays, preparing and caching them on first use
+
+        flexible_residues (e.g. ['A:329', 'A:331']) switches scoring to a rotamer grid
+        ensemble in which those side chains take their best rotamer for each pose.
+        """
+        with METRICS.timer('receptor_load'):
+            self.receptor = PreparedReceptor.load_or_prepare(pdb_file, cache_dir, exclude_chains=(SITE_CHAIN,))
+            self.spatial_index = build_spatial_index(self.receptor.coords)
+        self.scoring_matrix = None
+        self.force_field = None
+        self.fingerprinter = None
+        self.pocket = None
+        self.flexible_residues = tuple(flexible_residues)
         return self.receptor
+
+    def receptor_neighbors(self, points, radius):
+        """CSR neighbor lists (indptr, atom indices, distances) of receptor atoms around points"""
+        if self.spatial_index is None:
+            raise ValueError("Receptor must be loaded before querying neighbors")
+        return self.spatial_index.query_radius(points, radius)
+
+    def detect_binding_pocket(self, **options):
+        """Detect cavities once and keep the one reaching closest to the site centre"""
+        if not self.receptor:
+            raise ValueError("Receptor must be loaded before detecting pockets")
+        if self.pocket is None or options:
+            with METRICS.timer('pocket_detection'):
+                pockets = detect_pockets(self.receptor, index=self.spatial_index, **options)
+            if not pockets:
+                return None
+            site = self.receptor.site_center
+            self.pocket = min(pockets, key=lambda p: np.min(np.linalg.norm(p.points - site, axis=1)))
+        return self.pocket
+
+    def build_scoring_grid(self, center=None, size=22.5, spacing=0.375, cache_dir=DEFAULT_GRID_CACHE_DIR):
+        """Precompute (or map from cache) the receptor affinity maps over a box around the binding site"""
+        if not self.receptor:
+            raise ValueError("Receptor must be loaded before building the scoring grid")
+        if center is None:
+            pocket = self.detect_binding_pocket()
+            center = pocket.box()[0] if pocket else self.receptor.site_center
+        with METRICS.timer('grid_build'):
+            if self.flexible_residues:
+                self.scoring_matrix = RotamerGridEnsemble.load_or_build(
+                    self.receptor, self.flexible_residues, center, size, spacing, cache_dir=cache_dir)
+            else:
+                self.scoring_matrix = AffinityGrid.load_or_build(self.receptor, center, size, spacing, cache_dir)
+        return self.scoring_matrix
     
-    def prepare_ligand(self, smiles):
-        """Prepare serotonin ligand from SMILES"""
-        self.ligand = Chem.MolFromSmiles(smiles)
-        self.ligand = Chem.AddHs(self.ligand)
-        AllChem.EmbedMolecule(self.ligand, randomSeed=42)
+    def prepare_ligand(self, smiles, random_seed=42, n_conformers=1, optimize=False, prune_rms=0.5):
+        """Prepare serotonin ligand from SMILES, reusing cached conformers and descriptors
+
+        With n_conformers > 1 an RMSD-pruned ensemble is embedded (optionally force-field
+        relaxed) and every member becomes a rigid starting point for the search.
+        """
+        return self.set_ligand(*self.load_ligand(smiles, random_seed, n_conformers, optimize, prune_rms))
+
+    def load_ligand(self, smiles, random_seed=42, n_conformers=1, optimize=False, prune_rms=0.5):
+        """(ligand, descriptors, LigandTerms) for a SMILES, without making it the current ligand
+
+        Lets preparation run ahead of docking, e.g. in another thread of a pipeline.
+        """
+        # Single-conformer options stay as before so existing cache entries keep their keys
+        options = {'random_seed': random_seed}
+        if n_conformers > 1 or optimize:
+            options.update(n_conformers=n_conformers, optimize=optimize, prune_rms=prune_rms)
+        with METRICS.timer('ligand_preparation'):
+            ligand, descriptors = self.ligand_cache.get(smiles, **options)
+            return ligand, descriptors, LigandTerms(ligand)
+
+    def set_ligand(self, ligand, descriptors, terms=None):
+        """Make a prepared ligand the one scored and docked"""
+        self.ligand = ligand
+        self.ligand_descriptors = descriptors
+        self.ligand_terms = terms if terms is not None else LigandTerms(ligand)
         return self.ligand
-    
-    def calculate_binding_score(self):
-        """Calculate detailed binding energy components"""
-        # Using lists instead of numpy arrays for compatibility
-        energy_components = {
-            'van_der_waals': float(np.random.uniform(-5, -1)),
-            'electrostatic': float(np.random.uniform(-3, -0.5)),
-            'hydrogen_bonds': float(np.random.uniform(-2, -0.2)),
-            'desolvation': float(np.random.uniform(-1, 0.5)),
-            'pi_stacking': float(np.random.uniform(-2, -0.1)),
-            'hydrophobic': float(np.random.uniform(-3, -0.3)),
-            'entropy': float(np.random.uniform(-1, 1))
-        }
-        
-        if self.ligand:
-            mol_properties = {
-                'MW': float(Descriptors.ExactMolWt(self.ligand)),
-                'LogP': float(Descriptors.MolLogP(self.ligand)),
-                'TPSA': float(Descriptors.TPSA(self.ligand)),
-                'HBD': int(Descriptors.NumHDonors(self.ligand)),
-                'HBA': int(Descriptors.NumHAcceptors(self.ligand)),
-                'RotBonds': int(Descriptors.NumRotatableBonds(self.ligand))
-            }
-        else:
-            mol_properties = {}
-
-        total_score = sum(energy_components.values())
-        return total_score, energy_components, mol_properties
+
+    def ligand_coords(self):
+        """Ligand conformer coordinates centred on the origin"""
+        coords = self.ligand.GetConformer().GetPositions()
+        return coords - coords.mean(axis=0)
+
+    def calculate_binding_score(self, coords=None, exact=False):
+        """Calculate detailed binding energy components for a ligand pose
+
+        exact=True evaluates the pairwise force field instead of the grid maps, which
+        needs no grid; without coords the ligand is then placed on the binding-site centre.
+        """
+        if not self.receptor or not self.ligand:
+            raise ValueError("Both receptor and ligand must be loaded")
+        if not exact and self.scoring_matrix is None:
+            self.build_scoring_grid()
+        if coords is None:
+            center = self.scoring_matrix.center if self.scoring_matrix is not None else self.receptor.site_center
+            coords = self.ligand_coords() + center
+
+        score = self.score_poses_exact if exact else self.score_poses
+        components = energy_components(score(coords)[0])
+        mol_properties = self.ligand_properties()
+
+        total_score = sum(components.values())
+        return total_score, components, mol_properties
+
+    def ligand_properties(self):
+        """Drug-likeness descriptors of the current ligand"""
+        if not self.ligand:
+            return {}
+        return dict(self.ligand_descriptors)
+
+    def score_poses(self, coords, max_elements=1 << 22):
+        """Score a batch of ligand poses of shape (n_poses, n_atoms, 3) in one vectorized pass
+
+        Returns a float32 array of shape (n_poses, len(ENERGY_TERMS)); use
+        energy_components() on a row when the per-term dict is needed.
+        """
+        if not self.receptor or not self.ligand:
+            raise ValueError("Both receptor and ligand must be loaded")
+        if self.scoring_matrix is None:
+            self.build_scoring_grid()
+        with METRICS.timer('pose_scoring'):
+            energies = self.scoring_matrix.score_batch(coords, self.ligand_terms, max_elements)
+        METRICS.count('poses_scored', len(energies))
+        return energies
+
+    def score_poses_exact(self, coords, max_points=1 << 14):
+        """Score poses with the pairwise force field; same (n_poses, n_terms) output as score_poses
+
+        Slower than the grid but free of interpolation error and of the box edge.
+        """
+        if not self.receptor or not self.ligand:
+            raise ValueError("Both receptor and ligand must be loaded")
+        if self.force_field is None:
+            self.force_field = PairwiseForceField(self.receptor.scoring_atoms(), self.spatial_index)
+        with METRICS.timer('exact_scoring'):
+            energies = self.force_field.score_batch(coords, self.ligand_terms, max_points)
+        METRICS.count('poses_scored_exact', len(energies))
+        return energies
+
+    def interaction_fingerprints(self, coords):
+        """Packed uint64 residue x interaction-type fingerprints of a (n_poses, n_atoms, 3) batch of poses"""
+        if not self.receptor or not self.ligand:
+            raise ValueError("Both receptor and ligand must be loaded")
+        if self.scoring_matrix is None:
+            self.build_scoring_grid()
+        if self.fingerprinter is None:
+            self.fingerprinter = InteractionFingerprinter(self.receptor, self.spatial_index, self.scoring_matrix.center)
+        with METRICS.timer('fingerprinting'):
+            return self.fingerprinter.fingerprints(coords, self.ligand, self.ligand_terms.atoms)
+
+    def search_points(self):
+        """Pocket voxel centres inside the scoring grid, or the grid centre without a pocket"""
+        if self.scoring_matrix is None:
+            self.build_scoring_grid()
+        grid = self.scoring_matrix
+        pocket = self.detect_binding_pocket()
+        if pocket:
+            inside = pocket.points[np.all(np.abs(pocket.points - grid.center) < grid.size / 2, axis=1)]
+            if len(inside):
+                return inside
+        return grid.center[None, :]
+
+    def sample_pose(self):
+        """Place the ligand with a random orientation on a pocket voxel"""
+        points = self.search_points()
+        translation = points[np.random.randint(len(points))] + np.random.uniform(-0.5, 0.5, 3)
+        return translation, self.ligand_coords() @ random_rotation().T + translation
 
     def analyze_binding_site(self):
-        """Analyze binding site characteristics"""
+        """Analyze binding site characteristics of the detected pocket"""
         if not self.receptor:
             return None
-            
-        binding_site_analysis = {
-            'pocket_volume': np.random.uniform(300, 800),  # Å³
-            'surface_area': np.random.uniform(500, 1200),  # Å²
-            'hydrophobicity': np.random.uniform(0, 1),
-            'charge_distribution': np.random.uniform(-2, 2)
-        }
-        return binding_site_analysis
-
-    def run_docking_simulation(self):
+
+        pocket = self.detect_binding_pocket()
+        return pocket.summary() if pocket else None
+
+    def run_docking_simulation(self, n_poses=10, max_evaluations=20000, n_chains=32, seed=None, flexible=True,
+                               exact_rescoring=False):
+        """Search ligand translation, rotation and torsions and return the best distinct poses as DockingResults
+
+        flexible=False keeps torsions fixed, searching only over the embedded conformers.
+        exact_rescoring=True reports and ranks the final poses with the pairwise force field.
+        """
         if not self.receptor or not self.ligand:
             raise ValueError("Both receptor and ligand must be loaded")
-        
-        binding_results = []
-        for _ in range(10):
-            score, components, properties = self.calculate_binding_score()
-            pose_coords = np.random.rand(3)
-            binding_site = self.analyze_binding_site()
-            
-            binding_results.append({
-                'score': score,
-                'components': components,
-                'properties': properties,
-                'pose': pose_coords,
-                'binding_site': binding_site
-            })
-            
-        return binding_results
+
+        binding_site = self.analyze_binding_site()
+        points = self.search_points()
+        model = LigandModel(self.ligand, flexible)
+        search = MonteCarloSearch(self.scoring_matrix, self.ligand_terms, model, points, seed)
+        with METRICS.timer('pose_search'):
+            result = search.run(n_chains, max_evaluations, top_k=n_poses)
+        self.search_stats = result.stats()
+        METRICS.count('poses_evaluated', result.evaluations)
+        energies = self.score_poses_exact(result.coords) if exact_rescoring else self.score_poses(result.coords)
+
+        rotamers, residues = None, ()
+        if isinstance(self.scoring_matrix, RotamerGridEnsemble):
+            rotamers = self.scoring_matrix.best_rotamers(result.coords, self.ligand_terms)
+            residues = self.scoring_matrix.residues
+
+        results = DockingResults.from_poses(energies, result.coords, self.ligand_properties(),
+                                            self.interaction_fingerprints(result.coords), rotamers=rotamers,
+                                            binding_site=binding_site, rotamer_residues=residues)
+        return results.sorted()
 
     def visualize_ligand(self, output_path=None):
         """Generate 2D visualization of the ligand"""
         if not self.ligand:
             return None
             
+        from rdkit.Chem import Draw  # drawing pulls in PIL; only load it when asked for an image
+
         img = Draw.MolToImage(self.ligand)
         if output_path:
             img.save(output_path)
@@ -131,28 +298,18 @@ if __name__ == "__main__":
     # Run docking
     print("\nRunning docking simulation...")
     results = docking.run_docking_simulation()
-    
-    # Prepare data for DataFrame
-    poses_data = []
-    for i, result in enumerate(results, 1):
-        pose_data = {
-            'Pose': i,
-            'Binding_Score': result['score'],
-            **{f'Energy_{k}': v for k, v in result['components'].items()},
-            **{f'Property_{k}': v for k, v in result['properties'].items()}
-        }
-        poses_data.append(pose_data)
-    
-    # Create DataFrame and save to CSV
-    import pandas as pd
-    df = pd.DataFrame(poses_data)
-    
-    # Save results
-    output_file = "data/docking_poses_results.csv"
-    df.to_csv(output_file, index=False)
-    
+    stats = docking.search_stats
+    print(f"Evaluations: {stats['evaluations']} ({stats['evaluations_per_s']:.0f}/s), "
+          f"time to best: {stats['time_to_best_s']:.2f} s")
+
+    # Append poses to the columnar results store
+    from results_store import DEFAULT_RESULTS_DIR, ResultsStore
+    store = ResultsStore(os.path.join(DEFAULT_RESULTS_DIR, 'docking_poses'))
+    store.append(results.to_columns('Serotonin', serotonin_smiles))
+
     # Display results in console
+    df = results.to_pandas()
     print("\nDocking Results:")
     print("-" * 50)
     print(df.to_string())
-    print(f"\nResults saved to: {output_file}")
\ No newline at end of file
+    print(f"\nResults appended to: {store.path}")
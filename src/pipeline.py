@@ -0,0 +1,213 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+from instrumentation import METRICS
+
+_STOP = object()
+_POLL = 0.1  # seconds between checks for a closed pipeline while blocked
+
+
+class _Failure:
+    """An exception raised by a stage, carried downstream to the consumer in place of the item"""
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class Stage:
+    """One pipeline step: function applied to every item by a pool of worker threads
+
+    With processes=True each thread hands its item to a multiprocessing pool of the same
+    size (set up with initializer/initargs), so function must be picklable and any
+    per-process state lives in module globals set by the initializer.
+    """
+
+    def __init__(self, name, function, workers=1, processes=False, initializer=None, initargs=()):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.busy = 0.0      # seconds spent in function, summed over workers
+        self.starved = 0.0   # seconds workers waited for input
+        self.blocked = 0.0   # seconds workers waited for room downstream (backpressure)
+        self.items = 0
+        self.lock = threading.Lock()
+
+
+class Pipeline:
+    """Stages connected by bounded queues, run over an iterable and yielding results in input order
+
+    Items enter only while fewer than max_in_flight are between the input and the
+    consumer, so memory stays bounded however uneven the stages are. Time the consumer
+    spends between results is accounted to a final sink stage, so output work shows up
+    in the utilization report next to the stages it overlaps with.
+    """
+
+    def __init__(self, stages, queue_size=8, max_in_flight=None, source='read', sink='write'):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight or queue_size * (len(self.stages) + 1) + sum(
+            stage.workers for stage in self.stages)
+        self.source = Stage(source, None)
+        self.sink = Stage(sink, None)
+        self.elapsed = 0.0
+        self._closed = threading.Event()
+
+    def _put(self, stage, target, item):
+        start = time.perf_counter()
+        while not self._closed.is_set():
+            try:
+                target.put(item, timeout=_POLL)
+                break
+            except queue.Full:
+                pass
+        with stage.lock:
+            stage.blocked += time.perf_counter() - start
+
+    def _get(self, stage, source):
+        start = time.perf_counter()
+        while not self._closed.is_set():
+            try:
+                item = source.get(timeout=_POLL)
+                break
+            except queue.Empty:
+                pass
+        else:
+            item = _STOP
+        with stage.lock:
+            stage.starved += time.perf_counter() - start
+        return item
+
+    def _feed(self, items, target, slots):
+        try:
+            iterator = iter(items)
+            sequence = 0
+            while True:
+                start = time.perf_counter()
+                while not slots.acquire(timeout=_POLL):
+                    if self._closed.is_set():
+                        return
+                self.source.blocked += time.perf_counter() - start
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    slots.release()
+                    break
+                except Exception as exc:
+                    item = _Failure(exc)
+                finally:
+                    self.source.busy += time.perf_counter() - start
+                self.source.items += 1
+                self._put(self.source, target, (sequence, item))
+                sequence += 1
+                if isinstance(item, _Failure):
+                    break
+        finally:
+            for _ in range(self.stages[0].workers if self.stages else 1):
+                self._put(self.source, target, _STOP)
+
+    def _work(self, stage, pool, source, target, remaining, lock):
+        while True:
+            entry = self._get(stage, source)
+            if entry is _STOP:
+                break
+            sequence, item = entry
+            if not isinstance(item, _Failure):
+                start = time.perf_counter()
+                try:
+                    item = pool.apply(stage.function, (item,)) if pool else stage.function(item)
+                except Exception as exc:
+                    item = _Failure(exc)
+                elapsed = time.perf_counter() - start
+                with stage.lock:
+                    stage.busy += elapsed
+                    stage.items += 1
+                METRICS.observe(f'stage_{stage.name}', elapsed)
+            self._put(stage, target, (sequence, item))
+        # The last worker of a stage passes end-of-input on to every worker of the next one
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            following = self.stages.index(stage) + 1
+            count = self.stages[following].workers if following < len(self.stages) else 1
+            for _ in range(count):
+                self._put(stage, target, _STOP)
+
+    def run(self, items):
+        """Generator of stage results for items, in input order; a stage exception is re-raised here"""
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        slots = threading.Semaphore(self.max_in_flight)
+        pools, threads = [], []
+        self._closed.clear()
+        started = time.perf_counter()
+        try:
+            threads.append(threading.Thread(target=self._feed, args=(items, queues[0], slots), daemon=True))
+            for i, stage in enumerate(self.stages):
+                pool = None
+                if stage.processes:
+                    pool = multiprocessing.Pool(stage.workers, stage.initializer, stage.initargs)
+                    pools.append(pool)
+                elif stage.initializer is not None:
+                    stage.initializer(*stage.initargs)
+                remaining, lock = [stage.workers], threading.Lock()
+                threads += [threading.Thread(target=self._work, daemon=True, name=f'{stage.name}-{k}',
+                                             args=(stage, pool, queues[i], queues[i + 1], remaining, lock))
+                            for k in range(stage.workers)]
+            for thread in threads:
+                thread.start()
+
+            # Results arrive in completion order; hold early ones until their turn
+            pending, next_sequence = {}, 0
+            while True:
+                entry = self._get(self.sink, queues[-1])
+                if entry is _STOP:
+                    break
+                pending[entry[0]] = entry[1]
+                while next_sequence in pending:
+                    item = pending.pop(next_sequence)
+                    next_sequence += 1
+                    if isinstance(item, _Failure):
+                        raise item.exc
+                    start = time.perf_counter()
+                    yield item
+                    self.sink.busy += time.perf_counter() - start
+                    self.sink.items += 1
+                    slots.release()
+        finally:
+            self._closed.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                pool.terminate()
+                pool.join()
+            self.elapsed += time.perf_counter() - started
+            self.record_utilization()
+
+    def utilization(self):
+        """Busy fraction of each stage's workers over the run, from source to sink"""
+        elapsed = max(self.elapsed, 1e-9)
+        return {stage.name: min(stage.busy / (elapsed * stage.workers), 1.0)
+                for stage in [self.source] + self.stages + [self.sink]}
+
+    def record_utilization(self):
+        for name, value in self.utilization().items():
+            METRICS.set(f'stage_{name}_utilization', value)
+
+    def report(self):
+        """Table of per-stage workers, items, utilization and time starved or blocked downstream"""
+        lines = [f"{'stage':10s} {'workers':>7s} {'items':>7s} {'busy':>7s} {'starved':>9s} {'blocked':>9s}"]
+        utilization = self.utilization()
+        for stage in [self.source] + self.stages + [self.sink]:
+            lines.append(f"{stage.name:10s} {stage.workers:7d} {stage.items:7d} {utilization[stage.name]:7.1%} "
+                         f"{stage.starved:8.1f}s {stage.blocked:8.1f}s")
+        bottleneck = max(self.stages, key=lambda stage: utilization[stage.name], default=None)
+        if bottleneck is not None:
+            lines.append(f"Bottleneck: {bottleneck.name} ({utilization[bottleneck.name]:.0%} busy over "
+                         f"{self.elapsed:.1f} s); give it more workers")
+        return '\n'.join(lines)
@@ -0,0 +1,100 @@
+import numpy as np
+
+from spatial_index import build_spatial_index
+
+# 6 face and 8 corner directions used to cast buriedness rays
+RAY_DIRECTIONS = np.array([d for d in np.ndindex(3, 3, 3) if d != (1, 1, 1)]) - 1
+RAY_DIRECTIONS = RAY_DIRECTIONS[np.abs(RAY_DIRECTIONS).sum(1) != 2]
+FACE_DIRECTIONS = RAY_DIRECTIONS[np.abs(RAY_DIRECTIONS).sum(1) == 1]
+
+
+class Pocket:
+    """A connected set of buried solvent voxels and the receptor atoms lining it"""
+
+    def __init__(self, points, spacing, lining_atoms, receptor, surface_faces):
+        self.points = points
+        self.spacing = spacing
+        self.lining_atoms = lining_atoms
+        self.center = points.mean(axis=0)
+        self.volume = len(points) * spacing ** 3
+        self.surface_area = surface_faces * spacing ** 2
+        lining = np.asarray(lining_atoms)
+        self.hydrophobicity = float(np.mean(receptor.hydrophobic[lining])) if len(lining) else 0.0
+        self.net_charge = float(np.sum(receptor.charges[lining])) if len(lining) else 0.0
+
+    def box(self, padding=4.0):
+        """Centre and edge length of a cubic search box enclosing the pocket"""
+        extent = self.points.max(axis=0) - self.points.min(axis=0)
+        center = (self.points.max(axis=0) + self.points.min(axis=0)) / 2
+        return center, float(extent.max() + 2 * padding)
+
+    def summary(self):
+        """Binding site descriptors in the format returned by analyze_binding_site"""
+        return {
+            'pocket_volume': float(self.volume),
+            'surface_area': float(self.surface_area),
+            'hydrophobicity': self.hydrophobicity,
+            'charge_distribution': self.net_charge,
+        }
+
+
+def _shift(mask, offset):
+    """Value of mask at voxel + offset, False outside the grid"""
+    shifted = np.zeros_like(mask)
+    src = tuple(slice(max(o, 0), n + min(o, 0)) for o, n in zip(offset, mask.shape))
+    dst = tuple(slice(max(-o, 0), n + min(-o, 0)) for o, n in zip(offset, mask.shape))
+    shifted[dst] = mask[src]
+    return shifted
+
+
+def _label_components(mask):
+    """Label 6-connected components of a boolean grid, 1..n in raster order of their first voxel"""
+    from scipy import ndimage
+
+    # The default structuring element connects face neighbours only
+    labels, _ = ndimage.label(mask)
+    return labels
+
+
+def detect_pockets(receptor, spacing=1.0, clearance=3.0, ray_length=8.0, min_buriedness=9,
+                   min_volume=30.0, lining_distance=4.0, index=None):
+    """Find buried cavities on a voxel grid, largest first"""
+    coords = np.asarray(receptor.coords, dtype=np.float32)
+    if index is None:
+        index = build_spatial_index(coords)
+
+    margin = ray_length
+    origin = coords.min(axis=0) - margin
+    shape = tuple(np.ceil((coords.max(axis=0) + margin - origin) / spacing).astype(int) + 1)
+    axes = [origin[i] + np.arange(n) * spacing for i, n in enumerate(shape)]
+    centers = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    occupied = np.zeros(len(centers), dtype=bool)
+    for start in range(0, len(centers), 8192):
+        occupied[start:start + 8192] = index.count_within(centers[start:start + 8192], clearance) > 0
+    occupied = occupied.reshape(shape)
+
+    # A free voxel is buried when rays in most directions hit the protein
+    steps = int(round(ray_length / spacing))
+    buriedness = np.zeros(shape, dtype=np.int8)
+    for direction in RAY_DIRECTIONS:
+        hit = np.zeros(shape, dtype=bool)
+        for k in range(1, steps + 1):
+            hit |= _shift(occupied, direction * k)
+        buriedness += hit
+    cavity = ~occupied & (buriedness >= min_buriedness)
+
+    labels = _label_components(cavity)
+    pockets = []
+    for label in range(1, labels.max() + 1):
+        member = labels == label
+        n_voxels = int(member.sum())
+        if n_voxels * spacing ** 3 < min_volume:
+            continue
+        faces = sum(int((member & ~_shift(member, offset)).sum()) for offset in FACE_DIRECTIONS)
+        points = centers.reshape(shape + (3,))[member]
+        _, lining, _ = index.query_pairs(points, lining_distance)
+        pockets.append(Pocket(points, spacing, np.unique(lining), receptor, faces))
+
+    pockets.sort(key=lambda pocket: pocket.volume, reverse=True)
+    return pockets
@@ -0,0 +1,142 @@
+import numpy as np
+from rdkit import Chem
+
+from ligand_prep import canonical_smiles
+
+MAX_SYMMETRY_MATCHES = 64
+
+
+def symmetry_permutations(smiles, max_matches=MAX_SYMMETRY_MATCHES):
+    """Heavy-atom index permutations mapping the ligand onto itself (identity first)
+
+    Ligands are embedded from their canonical SMILES with hydrogens appended (see
+    LigandCache), so the permutations use canonical atom order and index directly into
+    the leading columns of stored pose coordinates.
+    """
+    mol = Chem.MolFromSmiles(canonical_smiles(smiles))
+    matches = mol.GetSubstructMatches(mol, uniquify=False, useChirality=True, maxMatches=max_matches)
+    identity = tuple(range(mol.GetNumAtoms()))
+    return np.array([identity] + [match for match in matches if match != identity], dtype=np.int64)
+
+
+def pairwise_rmsd(a, b, permutations=None):
+    """In-place RMSD between every pose in a (n, atoms, 3) and b (m, atoms, 3), minimised over symmetry
+
+    Uses |x - y|^2 = |x|^2 + |y|^2 - 2 x.y so each permutation costs one (n, m) matrix product.
+    """
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    n_atoms = a.shape[1]
+    if permutations is None:
+        permutations = np.arange(n_atoms)[None, :]
+    flat_a = a.reshape(len(a), 3 * n_atoms)
+    norms = (flat_a ** 2).sum(1)[:, None] + (b ** 2).sum((1, 2))[None, :]
+    best = None
+    for permutation in permutations:
+        cross = flat_a @ b[:, permutation].reshape(len(b), 3 * n_atoms).T
+        best = cross if best is None else np.maximum(best, cross)
+    return np.sqrt(np.maximum(norms - 2 * best, 0) / n_atoms)
+
+
+def neighbor_counts(coords, threshold, permutations=None, block_size=1024):
+    """Number of other poses within threshold of each pose, streamed over (block, block) RMSD tiles"""
+    n = len(coords)
+    counts = np.zeros(n, dtype=np.int64)
+    for start in range(0, n, block_size):
+        block = coords[start:start + block_size]
+        for other in range(start, n, block_size):
+            close = pairwise_rmsd(block, coords[other:other + block_size], permutations) < threshold
+            if other == start:
+                close = np.triu(close, 1)
+            counts[start:start + len(block)] += close.sum(1)
+            counts[other:other + close.shape[1]] += close.sum(0)
+    return counts
+
+
+def butina_cluster(coords, threshold=2.0, permutations=None, block_size=1024):
+    """Butina clustering: poses with the most neighbors become centroids in turn, claiming unassigned neighbors
+
+    Neighbor lists are never stored: counts are streamed first, then the RMSD rows of the
+    next candidate centroids are recomputed a few at a time, so memory stays at about
+    block_size ** 2 distances however densely the poses crowd together.
+    """
+    n = len(coords)
+    candidates = np.argsort(-neighbor_counts(coords, threshold, permutations, block_size), kind='stable')
+    labels = np.full(n, -1, dtype=np.int64)
+    representatives = []
+    rows = max(1, block_size ** 2 // max(n, 1))
+    pending = candidates
+    while True:
+        pending = pending[labels[pending] < 0]
+        if not len(pending):
+            break
+        batch, pending = pending[:rows], pending[rows:]
+        within = np.concatenate([pairwise_rmsd(coords[batch], coords[i:i + block_size], permutations) < threshold
+                                 for i in range(0, n, block_size)], axis=1)
+        for centroid, members in zip(batch, within):
+            if labels[centroid] >= 0:
+                continue
+            members &= labels < 0
+            labels[members] = labels[centroid] = len(representatives)
+            representatives.append(centroid)
+    return labels, np.array(representatives, dtype=np.int64)
+
+
+def leader_cluster(coords, threshold=2.0, permutations=None, scores=None, block_size=1024):
+    """Leader clustering in score order: a pose joins its nearest leader within threshold or leads a new cluster
+
+    Poses are handled a block at a time against the leaders found so far, a block of
+    leaders at a time, so only (block, block) RMSD matrices are ever held in memory.
+    """
+    order = np.argsort(scores, kind='stable') if scores is not None else np.arange(len(coords))
+    labels = np.full(len(coords), -1, dtype=np.int64)
+    leaders = []
+    for start in range(0, len(order), block_size):
+        block = order[start:start + block_size]
+        if leaders:
+            nearest = np.zeros(len(block), dtype=np.int64)
+            distance = np.full(len(block), np.inf, dtype=np.float32)
+            for i in range(0, len(leaders), block_size):
+                rmsd = pairwise_rmsd(coords[block], coords[leaders[i:i + block_size]], permutations)
+                closer = rmsd.min(1) < distance
+                nearest[closer] = i + rmsd.argmin(1)[closer]
+                distance[closer] = rmsd.min(1)[closer]
+            close = distance < threshold
+            labels[block[close]] = nearest[close]
+            block = block[~close]
+        # Remaining poses lead new clusters in score order, claiming later poses of the block
+        within = pairwise_rmsd(coords[block], coords[block], permutations) < threshold
+        unassigned = np.ones(len(block), dtype=bool)
+        for i in range(len(block)):
+            if not unassigned[i]:
+                continue
+            claimed = within[i] & unassigned
+            labels[block[claimed]] = len(leaders)
+            unassigned &= ~claimed
+            leaders.append(block[i])
+    return labels, np.array(leaders, dtype=np.int64)
+
+
+def cluster_poses(coords, smiles, threshold=2.0, method='leader', scores=None, block_size=1024):
+    """Cluster poses of one ligand by symmetry-aware heavy-atom RMSD
+
+    Returns per-pose labels, the representative pose index of each cluster (leader or
+    Butina centroid) and the cluster populations.
+    """
+    permutations = symmetry_permutations(smiles)
+    coords = np.asarray(coords, dtype=np.float32)
+    n_heavy = permutations.shape[1]
+    n_atoms = Chem.AddHs(Chem.MolFromSmiles(canonical_smiles(smiles))).GetNumAtoms()
+    if coords.shape[1] not in (n_heavy, n_atoms):
+        raise ValueError(f"Poses have {coords.shape[1]} atoms but {smiles} has {n_heavy} heavy atoms "
+                         f"({n_atoms} with hydrogens)")
+    heavy = coords[:, :n_heavy]
+    # Centring on a shared origin keeps the float32 norm expansion accurate for small RMSDs
+    heavy = heavy - heavy.reshape(-1, 3).mean(axis=0)
+    if method == 'leader':
+        labels, representatives = leader_cluster(heavy, threshold, permutations, scores, block_size)
+    elif method == 'butina':
+        labels, representatives = butina_cluster(heavy, threshold, permutations, block_size)
+    else:
+        raise ValueError(f"Unknown clustering method: {method}")
+    return labels, representatives, np.bincount(labels, minlength=len(representatives))
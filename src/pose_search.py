@@ -0,0 +1,386 @@
+import time
+
+import numpy as np
+from rdkit import Chem
+
+from atom_types import XS_RADIUS, type_index
+
+INTRA_WEIGHT = 1.0          # kcal/(mol·Å²), soft intramolecular clash penalty
+INTRA_SCALE = 0.8           # fraction of the summed atomic radii treated as contact
+TEMPERATURE = 1.2           # kcal/mol, Metropolis temperature used by Vina
+TRANSLATION_STEP = 1.0      # Å
+ROTATION_STEP = 0.3         # rad
+CONFORMER_SWAP_RATE = 0.25  # share of rigid-body moves replaced by an ensemble swap
+MIN_EVALUATIONS_PER_CHAIN = 10  # budget below n_chains times this runs fewer chains
+
+
+def quaternion_multiply(a, b):
+    """Hamilton product of (..., 4) quaternions stored as (w, x, y, z)"""
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], axis=-1)
+
+
+def quaternion_from_rotvec(rotvec):
+    """Unit quaternions for (..., 3) rotation vectors"""
+    angle = np.linalg.norm(rotvec, axis=-1, keepdims=True)
+    scale = np.where(angle > 1e-8, np.sin(angle / 2) / np.maximum(angle, 1e-8), 0.5)
+    return np.concatenate([np.cos(angle / 2), rotvec * scale], axis=-1)
+
+
+def quaternion_to_matrix(q):
+    """Rotation matrices (..., 3, 3) for unit quaternions (..., 4)"""
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], -1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], -1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], -1),
+    ], axis=-2)
+
+
+def random_quaternions(n, rng):
+    """Uniformly distributed unit quaternions"""
+    q = rng.normal(size=(n, 4))
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def rotate_about_axes(points, origin, axis, angle):
+    """Rotate (C, M, 3) points about per-row axes through origin (C, 3) by angle (C,)"""
+    axis = axis / np.linalg.norm(axis, axis=-1, keepdims=True)
+    rel = points - origin[:, None, :]
+    cos, sin = np.cos(angle)[:, None, None], np.sin(angle)[:, None, None]
+    k = axis[:, None, :]
+    return (origin[:, None, :] + rel * cos + np.cross(k, rel) * sin
+            + k * (rel * k).sum(-1, keepdims=True) * (1 - cos))
+
+
+class LigandModel:
+    """Rigid-body plus torsional degrees of freedom of an embedded ligand"""
+
+    def __init__(self, mol, flexible=True):
+        conformers = [conf.GetPositions() for conf in mol.GetConformers()]
+        if not conformers:
+            raise ValueError("Ligand has no 3D conformer")
+        references = np.array(conformers, dtype=np.float64)
+        self.references = references - references.mean(axis=1, keepdims=True)
+        self.n_atoms = mol.GetNumAtoms()
+        self.heavy = np.array([atom.GetAtomicNum() > 1 for atom in mol.GetAtoms()])
+
+        # Root the torsion tree at the heavy atom closest to the centroid so moving sets nest
+        distance = np.linalg.norm(self.references[0], axis=1) + np.where(self.heavy, 0, 1e3)
+        root = int(np.argmin(distance))
+        self.torsions = []
+        for bond in mol.GetBonds():
+            if not flexible or not self._is_rotatable(bond):
+                continue
+            a, b = bond.GetBeginAtomIdx(), bond.GetEndAtomIdx()
+            moving = self._side(mol, b, a)
+            if root in moving:
+                a, b = b, a
+                moving = self._side(mol, b, a)
+            self.torsions.append((a, b, np.array(sorted(moving))))
+        self.moving = np.zeros((len(self.torsions), self.n_atoms), dtype=bool)
+        for t, (_, _, moving) in enumerate(self.torsions):
+            self.moving[t, moving] = True
+
+        # Only pairs whose separation changes with some torsion can clash
+        topological = Chem.GetDistanceMatrix(mol)
+        i, j = np.triu_indices(self.n_atoms, k=1)
+        flexible = (self.moving[:, i] != self.moving[:, j]).any(axis=0) if len(self.torsions) else np.zeros(len(i), bool)
+        keep = flexible & (topological[i, j] > 3)
+        radii = XS_RADIUS[[type_index(atom.GetSymbol()) for atom in mol.GetAtoms()]]
+        self.intra_i, self.intra_j = i[keep], j[keep]
+        self.intra_contact = INTRA_SCALE * (radii[self.intra_i] + radii[self.intra_j])
+        self.intra_incidence = np.zeros((self.n_atoms, len(self.intra_i)))
+        self.intra_incidence[self.intra_i, np.arange(len(self.intra_i))] = 1.0
+        self.intra_incidence[self.intra_j, np.arange(len(self.intra_i))] = -1.0
+
+    @property
+    def n_torsions(self):
+        return len(self.torsions)
+
+    @staticmethod
+    def _is_rotatable(bond):
+        if bond.GetBondType() != Chem.BondType.SINGLE or bond.IsInRing():
+            return False
+        ends = (bond.GetBeginAtom(), bond.GetEndAtom())
+        if any(sum(n.GetAtomicNum() > 1 for n in atom.GetNeighbors()) < 2 for atom in ends):
+            return False
+        # Amide C-N bonds are planar
+        symbols = sorted(atom.GetSymbol() for atom in ends)
+        if symbols == ['C', 'N']:
+            carbon = ends[0] if ends[0].GetSymbol() == 'C' else ends[1]
+            if any(b.GetBondType() == Chem.BondType.DOUBLE and b.GetOtherAtom(carbon).GetSymbol() == 'O'
+                   for b in carbon.GetBonds()):
+                return False
+        return True
+
+    @staticmethod
+    def _side(mol, start, blocked):
+        """Atoms reachable from start without crossing the bond to blocked"""
+        seen = {start}
+        stack = [start]
+        while stack:
+            atom = mol.GetAtomWithIdx(stack.pop())
+            for neighbor in atom.GetNeighbors():
+                idx = neighbor.GetIdx()
+                if idx not in seen and not (atom.GetIdx() == start and idx == blocked):
+                    seen.add(idx)
+                    stack.append(idx)
+        return seen
+
+    def build(self, state):
+        """Atom coordinates (C, n_atoms, 3) for a batch of search states"""
+        coords = self.references[state['conformer']].copy()
+        for t, (a, b, moving) in enumerate(self.torsions):
+            coords[:, moving] = rotate_about_axes(coords[:, moving], coords[:, a], coords[:, b] - coords[:, a],
+                                                  state['torsions'][:, t])
+        rotation = quaternion_to_matrix(state['orientation'])
+        return np.einsum('cij,caj->cai', rotation, coords) + state['translation'][:, None, :]
+
+    def intra_energy_gradient(self, coords):
+        """Soft clash energy between flexibly separated atoms and its atom gradient"""
+        if not len(self.intra_i):
+            return np.zeros(len(coords)), np.zeros_like(coords)
+        delta = coords[:, self.intra_i] - coords[:, self.intra_j]
+        distance = np.linalg.norm(delta, axis=-1)
+        overlap = np.maximum(self.intra_contact - distance, 0)
+        energy = INTRA_WEIGHT * (overlap ** 2).sum(-1)
+        force = (-2 * INTRA_WEIGHT * overlap / np.maximum(distance, 1e-6))[..., None] * delta
+        return energy, self.intra_incidence @ force
+
+    def state_gradient(self, coords, atom_gradient, state):
+        """Project atom gradients onto translation, orientation (torque) and torsion coordinates"""
+        relative = coords - state['translation'][:, None, :]
+        parts = [atom_gradient.sum(axis=1), np.cross(relative, atom_gradient).sum(axis=1)]
+        for t, (a, b, moving) in enumerate(self.torsions):
+            axis = coords[:, b] - coords[:, a]
+            axis /= np.linalg.norm(axis, axis=-1, keepdims=True)
+            torque = np.cross(coords[:, moving] - coords[:, a][:, None], atom_gradient[:, moving]).sum(axis=1)
+            parts.append((torque * axis).sum(-1, keepdims=True))
+        return np.concatenate(parts, axis=1)
+
+
+def apply_step(state, step):
+    """Move states by a (C, 6 + n_torsions) step in translation, rotation vector and torsions"""
+    return {
+        'conformer': state['conformer'],
+        'translation': state['translation'] + step[:, :3],
+        'orientation': quaternion_multiply(quaternion_from_rotvec(step[:, 3:6]), state['orientation']),
+        'torsions': state['torsions'] + step[:, 6:],
+    }
+
+
+def take_states(state, rows):
+    """Subset of a batch of states"""
+    return {key: value[rows] for key, value in state.items()}
+
+
+def put_states(state, rows, other):
+    """Copy of state with the given rows replaced by other"""
+    merged = {key: value.copy() for key, value in state.items()}
+    for key, value in merged.items():
+        value[rows] = other[key]
+    return merged
+
+
+class SearchResult:
+    """Top-k distinct poses and throughput figures from one search"""
+
+    def __init__(self, coords, scores, evaluations, elapsed, time_to_best):
+        self.coords = coords
+        self.scores = scores
+        self.evaluations = evaluations
+        self.elapsed = elapsed
+        self.time_to_best = time_to_best
+
+    @property
+    def evaluations_per_second(self):
+        return self.evaluations / self.elapsed if self.elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            'best_score': float(self.scores[0]) if len(self.scores) else None,
+            'evaluations': int(self.evaluations),
+            'elapsed_s': self.elapsed,
+            'time_to_best_s': self.time_to_best,
+            'evaluations_per_s': self.evaluations_per_second,
+        }
+
+
+class MonteCarloSearch:
+    """Batched Monte Carlo search with L-BFGS local minimization on grid gradients"""
+
+    def __init__(self, grid, terms, model, start_points, seed=None):
+        self.grid = grid
+        self.terms = terms
+        self.model = model
+        self.start_points = np.asarray(start_points, dtype=np.float64).reshape(-1, 3)
+        self.rng = np.random.default_rng(seed)
+        self.evaluations = 0
+
+    def energy_gradient(self, state):
+        """Search objective (inter-molecular grid energy plus intra clash) and state gradient"""
+        coords = self.model.build(state)
+        energy, gradient = self.grid.energy_gradient(coords, self.terms)
+        intra, intra_gradient = self.model.intra_energy_gradient(coords)
+        self.evaluations += len(coords)
+        return (energy + intra).astype(np.float64), coords, self.model.state_gradient(
+            coords, gradient + intra_gradient, state)
+
+    def random_states(self, n):
+        points = self.start_points[self.rng.integers(len(self.start_points), size=n)]
+        n_conformers = len(self.model.references)
+        # A conformer ensemble already samples torsions, so chains start from its members
+        torsions = self.rng.uniform(-np.pi, np.pi, (n, self.model.n_torsions)) if n_conformers == 1 \
+            else np.zeros((n, self.model.n_torsions))
+        return {
+            'conformer': np.arange(n) % n_conformers,
+            'translation': points + self.rng.uniform(-0.5, 0.5, (n, 3)),
+            'orientation': random_quaternions(n, self.rng),
+            'torsions': torsions,
+        }
+
+    def mutate(self, state):
+        """Perturb one randomly chosen degree of freedom per chain"""
+        n = len(state['translation'])
+        step = np.zeros((n, 6 + self.model.n_torsions))
+        kind = self.rng.integers(3 if self.model.n_torsions else 2, size=n)
+        direction = self.rng.normal(size=(n, 3))
+        direction /= np.linalg.norm(direction, axis=1, keepdims=True)
+        step[kind == 0, :3] = TRANSLATION_STEP * direction[kind == 0]
+        step[kind == 1, 3:6] = ROTATION_STEP * direction[kind == 1]
+        if self.model.n_torsions:
+            rows = np.nonzero(kind == 2)[0]
+            columns = 6 + self.rng.integers(self.model.n_torsions, size=len(rows))
+            step[rows, columns] = self.rng.uniform(-np.pi, np.pi, len(rows))
+        mutated = apply_step(state, step)
+
+        # Occasionally swap in another ensemble member in place of a rigid-body move
+        n_conformers = len(self.model.references)
+        if n_conformers > 1:
+            swap = (kind < 2) & (self.rng.random(n) < CONFORMER_SWAP_RATE)
+            mutated['conformer'] = np.where(swap, self.rng.integers(n_conformers, size=n), state['conformer'])
+        return mutated
+
+    def local_minimize(self, state, max_iterations=30, history=8, tolerance=1e-3, budget=None):
+        """Batched L-BFGS with backtracking line search, one independent history per chain
+
+        budget caps the pose evaluations spent, starting value included; the line search
+        stops early (keeping the best state so far) rather than exceed it.
+        """
+        limit = None if budget is None else self.evaluations + budget
+        energy, coords, gradient = self.energy_gradient(state)
+        n, dim = gradient.shape
+        s_hist = np.zeros((n, history, dim))
+        y_hist = np.zeros((n, history, dim))
+        rho = np.zeros((n, history))
+        active = np.ones(n, dtype=bool)
+
+        for _ in range(max_iterations):
+            # Two-loop recursion; empty history slots have rho = 0 and drop out
+            q = gradient.copy()
+            alpha = np.zeros((n, history))
+            for k in range(history - 1, -1, -1):
+                alpha[:, k] = rho[:, k] * np.einsum('nd,nd->n', s_hist[:, k], q)
+                q -= alpha[:, k, None] * y_hist[:, k]
+            sy = np.einsum('nd,nd->n', s_hist[:, -1], y_hist[:, -1])
+            yy = np.einsum('nd,nd->n', y_hist[:, -1], y_hist[:, -1])
+            norm = np.linalg.norm(gradient, axis=1)
+            gamma = np.where(sy > 0, sy / np.maximum(yy, 1e-12), 0.1 / np.maximum(norm, 1e-6))
+            r = q * gamma[:, None]
+            for k in range(history):
+                beta = rho[:, k] * np.einsum('nd,nd->n', y_hist[:, k], r)
+                r += (alpha[:, k] - beta)[:, None] * s_hist[:, k]
+            direction = -r
+            slope = np.einsum('nd,nd->n', direction, gradient)
+            uphill = slope >= 0
+            direction[uphill] = -gradient[uphill] * (0.1 / np.maximum(norm[uphill, None], 1e-6))
+            slope = np.einsum('nd,nd->n', direction, gradient)
+
+            step_size = np.ones(n)
+            pending = active.copy()
+            new_state = state
+            new_energy, new_coords, new_gradient = energy.copy(), coords.copy(), gradient.copy()
+            for _ in range(10):
+                rows = np.nonzero(pending)[0]
+                if not len(rows) or (limit is not None and self.evaluations + len(rows) > limit):
+                    break
+                trial = apply_step(take_states(state, rows), direction[rows] * step_size[rows, None])
+                t_energy, t_coords, t_gradient = self.energy_gradient(trial)
+                ok = t_energy <= energy[rows] + 1e-4 * step_size[rows] * slope[rows]
+                accepted = rows[ok]
+                new_state = put_states(new_state, accepted, take_states(trial, ok))
+                new_energy[accepted] = t_energy[ok]
+                new_coords[accepted] = t_coords[ok]
+                new_gradient[accepted] = t_gradient[ok]
+                pending[accepted] = False
+                step_size[pending] *= 0.5
+
+            moved = active & ~pending
+            s = direction * step_size[:, None]
+            y = new_gradient - gradient
+            curvature = np.einsum('nd,nd->n', s, y)
+            update = moved & (curvature > 1e-10)
+            s_hist[update] = np.roll(s_hist[update], -1, axis=1)
+            y_hist[update] = np.roll(y_hist[update], -1, axis=1)
+            rho[update] = np.roll(rho[update], -1, axis=1)
+            s_hist[update, -1] = s[update]
+            y_hist[update, -1] = y[update]
+            rho[update, -1] = 1.0 / curvature[update]
+
+            improvement = energy - new_energy
+            state, energy, coords, gradient = new_state, new_energy, new_coords, new_gradient
+            active &= moved & (improvement > tolerance)
+            if not active.any() or (limit is not None and self.evaluations + active.sum() > limit):
+                break
+        return state, energy, coords
+
+    def run(self, n_chains=32, max_evaluations=100000, top_k=10, rmsd_threshold=2.0):
+        """Search until the evaluation budget is spent and return the top-k distinct poses
+
+        max_evaluations is a hard limit: small budgets run fewer chains so the first
+        minimization fits, and the last minimizations are cut short.
+        """
+        start = time.perf_counter()
+        self.evaluations = 0
+
+        n_chains = max(1, min(n_chains, max_evaluations // MIN_EVALUATIONS_PER_CHAIN))
+        state, energy, coords = self.local_minimize(self.random_states(n_chains), budget=max_evaluations)
+        pool_coords, pool_energy = [coords], [energy]
+        best_energy, time_to_best = energy.min(), time.perf_counter() - start
+        while self.evaluations + n_chains <= max_evaluations:
+            candidate, c_energy, c_coords = self.local_minimize(self.mutate(state),
+                                                               budget=max_evaluations - self.evaluations)
+            accept = (c_energy < energy) | (self.rng.random(n_chains) < np.exp(-(c_energy - energy) / TEMPERATURE))
+            state = put_states(state, accept, take_states(candidate, accept))
+            energy = np.where(accept, c_energy, energy)
+            pool_coords.append(c_coords)
+            pool_energy.append(c_energy)
+            if c_energy.min() < best_energy - 1e-6:
+                best_energy, time_to_best = c_energy.min(), time.perf_counter() - start
+
+        pool_coords = np.concatenate(pool_coords)
+        pool_energy = np.concatenate(pool_energy)
+        chosen = self._distinct(pool_coords, pool_energy, top_k, rmsd_threshold)
+        return SearchResult(pool_coords[chosen], pool_energy[chosen], self.evaluations,
+                            time.perf_counter() - start, time_to_best)
+
+    def _distinct(self, coords, energy, top_k, rmsd_threshold):
+        """Greedily keep the lowest-energy poses that differ by more than the RMSD threshold"""
+        heavy = coords[:, self.model.heavy]
+        chosen = []
+        for i in np.argsort(energy):
+            if len(chosen) == top_k:
+                break
+            if chosen:
+                rmsd = np.sqrt(((heavy[chosen] - heavy[i]) ** 2).sum(-1).mean(-1))
+                if rmsd.min() < rmsd_threshold:
+                    continue
+            chosen.append(i)
+        return np.array(chosen, dtype=int)
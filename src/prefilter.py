@@ -0,0 +1,105 @@
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import Descriptors
+
+from compound_library import chunked
+
+DESCRIPTOR_NAMES = ('MW', 'LogP', 'TPSA', 'HBD', 'HBA', 'RotBonds', 'pKa')
+
+# Aliphatic amines that are not amides, anilines, sulfonamides or enamines count as basic centres
+BASIC_AMINE = Chem.MolFromSmarts('[NX3;H2,H1,H0;!$(N-[C,S,P]=[O,S,N]);!$(N-a);!$(N-C=C);!$(N#*);!$(N=*)]')
+BASIC_PKA = 9.5  # estimate for a protonatable aliphatic amine
+
+# Each rule set: criteria of (column, op, threshold) and the number of violations tolerated
+RULE_SETS = {
+    'lipinski': ([('MW', '<=', 500), ('LogP', '<=', 5), ('HBD', '<=', 5), ('HBA', '<=', 10)], 1),
+    'veber': ([('RotBonds', '<=', 10), ('TPSA', '<=', 140)], 0),
+    'cns_mpo': ([('CNS_MPO', '>=', 4)], 0),
+}
+OPS = {'<=': np.less_equal, '<': np.less, '>=': np.greater_equal, '>': np.greater}
+
+
+def descriptor_table(smiles_list):
+    """2D descriptor columns for a batch of SMILES, NaN rows where parsing fails"""
+    table = np.full((len(smiles_list), len(DESCRIPTOR_NAMES)), np.nan)
+    for i, smiles in enumerate(smiles_list):
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            continue
+        table[i] = (Descriptors.ExactMolWt(mol), Descriptors.MolLogP(mol), Descriptors.TPSA(mol),
+                    Descriptors.NumHDonors(mol), Descriptors.NumHAcceptors(mol),
+                    Descriptors.NumRotatableBonds(mol), BASIC_PKA if mol.HasSubstructMatch(BASIC_AMINE) else 0.0)
+    columns = dict(zip(DESCRIPTOR_NAMES, table.T))
+    columns['CNS_MPO'] = cns_mpo(columns)
+    return columns
+
+
+def _desirability(values, best, worst):
+    """Linear score of 1 at or beyond best, 0 at or beyond worst"""
+    return np.clip((worst - values) / (worst - best), 0.0, 1.0)
+
+
+def cns_mpo(columns):
+    """CNS multiparameter optimisation score (0-6, Wager et al. 2010), with ClogD taken as ClogP"""
+    tpsa = columns['TPSA']
+    return (_desirability(columns['LogP'], 3, 5)
+            + _desirability(columns['LogP'], 2, 4)
+            + _desirability(columns['MW'], 360, 500)
+            + np.where(tpsa < 40, _desirability(-tpsa, -40, -20), _desirability(tpsa, 90, 120))
+            + _desirability(columns['HBD'], 0.5, 3.5)
+            + _desirability(columns['pKa'], 8, 10))
+
+
+class Prefilter:
+    """Drug-likeness rule sets applied to whole descriptor tables before any 3D work"""
+
+    def __init__(self, rule_sets=('lipinski', 'veber')):
+        unknown = set(rule_sets) - set(RULE_SETS)
+        if unknown:
+            raise ValueError(f"Unknown prefilter rule sets: {sorted(unknown)}")
+        self.rule_sets = tuple(rule_sets)
+        self.seen = 0
+        self.rejections = {'invalid': 0}
+        for name in self.rule_sets:
+            self.rejections[name] = 0
+            for column, op, threshold in RULE_SETS[name][0]:
+                self.rejections[f'{name}:{column}{op}{threshold}'] = 0
+
+    def evaluate(self, smiles_list):
+        """Rejection reason per SMILES (None for compounds that pass) and update the counts"""
+        columns = descriptor_table(smiles_list)
+        reasons = np.full(len(smiles_list), None, dtype=object)
+        invalid = np.isnan(columns['MW'])
+        reasons[invalid] = 'invalid'
+        self.rejections['invalid'] += int(invalid.sum())
+        passing = ~invalid
+
+        for name in self.rule_sets:
+            criteria, allowed = RULE_SETS[name]
+            violations = np.zeros(len(smiles_list), dtype=int)
+            for column, op, threshold in criteria:
+                failed = ~OPS[op](columns[column], threshold) & ~invalid
+                self.rejections[f'{name}:{column}{op}{threshold}'] += int(failed.sum())
+                violations += failed
+            # Each compound is charged to the first rule set it fails
+            rejected = (violations > allowed) & passing
+            reasons[rejected] = name
+            passing &= ~rejected
+            self.rejections[name] += int(rejected.sum())
+        self.seen += len(smiles_list)
+        return reasons
+
+    def annotate(self, records, batch_size=256):
+        """Stream (name, smiles, reason) triples, evaluating the rules batch_size records at a time"""
+        for batch in chunked(records, batch_size):
+            reasons = self.evaluate([smiles for _, smiles in batch])
+            for (name, smiles), reason in zip(batch, reasons):
+                yield name, smiles, reason
+
+    def report(self):
+        """Rejection counts per rule set and violation counts per criterion, as printable lines"""
+        passed = self.seen - sum(self.rejections[name] for name in ('invalid',) + self.rule_sets)
+        lines = [f"Prefilter: {passed} of {self.seen} compounds passed"]
+        for rule, count in self.rejections.items():
+            lines.append(f"  {rule}: {count} {'violations' if ':' in rule else 'rejected'}")
+        return '\n'.join(lines)
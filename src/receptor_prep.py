@@ -0,0 +1,163 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from atom_types import type_receptor_atoms
+
+# Bump whenever parsing or typing changes so stale artifacts are not reused
+PREPARATION_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join('data', 'cache', 'receptors')
+WATER_NAMES = ('HOH', 'WAT', 'DOD')
+
+ATOM_FIELDS = ('coords', 'types', 'charges', 'donor', 'acceptor', 'hydrophobic', 'aromatic',
+               'residue_index', 'atom_names')
+RESIDUE_FIELDS = ('residue_names', 'chain_ids', 'residue_numbers')
+SCORING_FIELDS = ('coords', 'types', 'charges', 'donor', 'acceptor', 'hydrophobic', 'aromatic')
+
+
+def parse_pdb_atoms(pdb_file, keep_hydrogens=False):
+    """Read protein ATOM records of the first model, skipping waters, het groups and altlocs"""
+    atoms = []
+    with open(pdb_file) as handle:
+        for line in handle:
+            if line.startswith('ENDMDL'):
+                break
+            if not line.startswith('ATOM') or line[16] not in (' ', 'A'):
+                continue
+            resname = line[17:20].strip()
+            if resname in WATER_NAMES:
+                continue
+            name = line[12:16].strip()
+            element = line[76:78].strip() or name[0]
+            if element.upper() in ('H', 'D') and not keep_hydrogens:
+                continue
+            atoms.append({
+                'name': name,
+                'resname': resname,
+                'chain': line[21],
+                'resnum': int(line[22:26]),
+                'icode': line[26],
+                'element': element,
+                'coord': (float(line[30:38]), float(line[38:46]), float(line[46:54])),
+            })
+    return atoms
+
+
+class PreparedReceptor:
+    """Struct-of-arrays receptor with typed atoms, charges and residue bookkeeping"""
+
+    def __init__(self, arrays, key=None):
+        self.arrays = arrays
+        self.key = key
+        for name, value in arrays.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def scoring_atoms(self):
+        """Typed atom arrays consumed by the scoring grid"""
+        return {name: self.arrays[name] for name in SCORING_FIELDS}
+
+    @classmethod
+    def prepare(cls, pdb_file, exclude_chains=(), keep_hydrogens=False):
+        """Parse, strip and type a receptor PDB file"""
+        atoms = parse_pdb_atoms(pdb_file, keep_hydrogens)
+        excluded = [atom['coord'] for atom in atoms if atom['chain'] in exclude_chains]
+        atoms = [atom for atom in atoms if atom['chain'] not in exclude_chains]
+        if not atoms:
+            raise ValueError(f"No receptor atoms found in {pdb_file}")
+
+        typed = type_receptor_atoms([(a['resname'], a['name'], a['element'], a['coord']) for a in atoms])
+
+        residue_keys = []
+        residue_index = np.zeros(len(atoms), dtype=np.int32)
+        for i, atom in enumerate(atoms):
+            key = (atom['chain'], atom['resnum'], atom['icode'])
+            if not residue_keys or residue_keys[-1][0] != key:
+                residue_keys.append((key, atom['resname']))
+            residue_index[i] = len(residue_keys) - 1
+
+        # Centroid of the excluded chains (e.g. a bound peptide) marks the binding site
+        site = excluded if excluded else typed['coords']
+        arrays = dict(typed)
+        arrays.update({
+            'residue_index': residue_index,
+            'atom_names': np.array([atom['name'] for atom in atoms], dtype='U4'),
+            'residue_names': np.array([name for _, name in residue_keys], dtype='U3'),
+            'chain_ids': np.array([key[0] for key, _ in residue_keys], dtype='U1'),
+            'residue_numbers': np.array([key[1] for key, _ in residue_keys], dtype=np.int32),
+            'site_center': np.mean(site, axis=0).astype(np.float32),
+        })
+        return cls(arrays)
+
+    @staticmethod
+    def cache_key(pdb_file, **options):
+        """Content hash of the PDB file and the preparation options"""
+        digest = hashlib.sha256()
+        with open(pdb_file, 'rb') as handle:
+            for block in iter(lambda: handle.read(1 << 20), b''):
+                digest.update(block)
+        options = dict(options, version=PREPARATION_VERSION)
+        digest.update(json.dumps(options, sort_keys=True, default=list).encode())
+        return digest.hexdigest()[:24]
+
+    def save(self, directory):
+        """Write every array as its own .npy file, atomically replacing the directory"""
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent)
+        for name, value in self.arrays.items():
+            np.save(os.path.join(staging, f'{name}.npy'), np.asarray(value))
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            # Another process published the same artifact first
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, key=None):
+        """Memory-map a saved artifact read-only"""
+        arrays = {}
+        for entry in os.listdir(directory):
+            if entry.endswith('.npy'):
+                arrays[entry[:-4]] = np.load(os.path.join(directory, entry), mmap_mode='r')
+        return cls(arrays, key)
+
+    @classmethod
+    def load_or_prepare(cls, pdb_file, cache_dir=DEFAULT_CACHE_DIR, exclude_chains=(),
+                        keep_hydrogens=False):
+        """Map a cached artifact for this PDB and options, preparing it on a miss"""
+        options = {'exclude_chains': sorted(exclude_chains), 'keep_hydrogens': keep_hydrogens}
+        key = cls.cache_key(pdb_file, **options)
+        directory = os.path.join(cache_dir, key)
+        if not os.path.isdir(directory):
+            cls.prepare(pdb_file, exclude_chains, keep_hydrogens).save(directory)
+        return cls.load(directory, key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare a receptor and warm the receptor and grid caches")
+    parser.add_argument('pdb_file', nargs='?', default=os.path.join('data', '5ht2a.pdb'))
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="prepared receptor cache")
+    parser.add_argument('--no-grid', action='store_true', help="skip building the affinity grid maps")
+    args = parser.parse_args(argv)
+
+    # Imported here: molecular_dock itself depends on this module
+    from molecular_dock import MolecularDocking
+
+    docking = MolecularDocking()
+    receptor = docking.load_receptor(args.pdb_file, args.cache_dir)
+    print(f"Prepared {len(receptor)} atoms from {args.pdb_file} (cache key {receptor.key})")
+    if not args.no_grid:
+        grid = docking.build_scoring_grid()
+        print(f"Affinity grid ready: {np.round(grid.size, 1)} A box centred at {np.round(grid.center, 2)}")
+
+
+if __name__ == "__main__":
+    main()
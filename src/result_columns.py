@@ -0,0 +1,14 @@
+# Column vocabularies shared by scoring and the results stores. Kept free of imports so
+# light commands (display, format) do not load RDKit or NumPy just to name columns.
+
+# Energy terms reported by MolecularDocking.calculate_binding_score, in column order
+ENERGY_TERMS = ('van_der_waals', 'electrostatic', 'hydrogen_bonds', 'desolvation',
+                'pi_stacking', 'hydrophobic', 'entropy')
+
+# Drug-likeness descriptors stored with every pose, in column order
+PROPERTY_NAMES = ('MW', 'LogP', 'TPSA', 'HBD', 'HBA', 'RotBonds')
+
+
+def energy_components(energies):
+    """Per-term dict for one row of a (n_poses, n_terms) energy array"""
+    return {term: float(value) for term, value in zip(ENERGY_TERMS, energies)}
@@ -0,0 +1,276 @@
+import os
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from checkpoint import fsync_path
+from result_columns import ENERGY_TERMS, PROPERTY_NAMES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # chunked NPZ fallback
+    pa = pq = None
+
+DEFAULT_RESULTS_DIR = os.path.join('data', 'results')
+
+# Column name -> dtype; 'str' columns hold text, 'coords' columns one (n_atoms, 3) array per row
+# and 'bits' columns one packed uint64 bit array per row
+POSE_SCHEMA = (
+    [('Compound', 'str'), ('SMILES', 'str'), ('Run', np.int32), ('Pose', np.int32),
+     ('Binding_Score', np.float32)]
+    + [(f'Energy_{term}', np.float32) for term in ENERGY_TERMS]
+    + [(f'Property_{name}', np.float32) for name in PROPERTY_NAMES]
+    + [('Coordinates', 'coords'), ('Interaction_FP', 'bits')]
+)
+ARRAY_DTYPES = {'coords': np.float32, 'bits': np.uint64}
+SCREENING_SCHEMA = [('Compound', 'str'), ('SMILES', 'str'), ('Best_Score', np.float32),
+                    ('Average_Score', np.float32), ('StdDev', np.float32), ('Status', 'str')]
+# Successive-halving screens also record each compound's last rung and the evaluations spent on it
+ADAPTIVE_SCHEMA = SCREENING_SCHEMA + [('Rung', np.int32), ('Evaluations', np.int64), ('Converged', bool)]
+
+FILTER_OPS = {
+    '==': np.equal, '!=': np.not_equal, '<': np.less, '<=': np.less_equal,
+    '>': np.greater, '>=': np.greater_equal, 'in': lambda values, options: np.isin(values, list(options)),
+}
+
+
+class ResultsStore:
+    """Append-only directory of columnar chunks (Parquet, or NPZ without pyarrow) with a fixed schema
+
+    Every append writes a new uniquely named chunk and publishes it by rename, so
+    concurrent writers never touch each other's files and readers never see partial chunks.
+    """
+
+    def __init__(self, path, schema=POSE_SCHEMA, format=None):
+        self.path = path
+        self.schema = dict(schema)
+        self.format = format or ('parquet' if pq is not None else 'npz')
+        if self.format == 'parquet' and pq is None:
+            raise ImportError("pyarrow is required for the parquet results format")
+
+    def append(self, columns):
+        """Write one chunk from a DataFrame or a dict of equal-length columns, durably before returning"""
+        if isinstance(columns, pd.DataFrame):
+            columns = {name: columns[name].tolist() for name in columns.columns}
+        missing = set(self.schema) - set(columns)
+        if missing:
+            raise ValueError(f"Missing result columns: {sorted(missing)}")
+        n_rows = len(next(iter(columns.values())))
+        if not n_rows:
+            return None
+
+        os.makedirs(self.path, exist_ok=True)
+        name = f'part-{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.{self.format}'
+        staging = os.path.join(self.path, f'.{name}')
+        if self.format == 'parquet':
+            self._write_parquet(staging, columns)
+        else:
+            self._write_npz(staging, columns)
+        # A checkpoint may name the chunk as soon as this returns, so it must survive power loss
+        fsync_path(staging)
+        os.replace(staging, os.path.join(self.path, name))
+        fsync_path(self.path)
+        return name
+
+    def _write_parquet(self, path, columns):
+        arrays = {}
+        for name, dtype in self.schema.items():
+            if dtype == 'str':
+                arrays[name] = pa.array([str(value) for value in columns[name]], pa.string())
+            elif dtype in ARRAY_DTYPES:
+                arrays[name] = pa.array([np.asarray(c, dtype=ARRAY_DTYPES[dtype]).ravel() for c in columns[name]],
+                                        pa.list_(pa.from_numpy_dtype(ARRAY_DTYPES[dtype])))
+            else:
+                arrays[name] = pa.array(np.asarray(columns[name], dtype=dtype))
+        pq.write_table(pa.table(arrays), path)
+
+    def _write_npz(self, path, columns):
+        arrays = {}
+        for name, dtype in self.schema.items():
+            if dtype == 'str':
+                arrays[name] = np.array([str(value) for value in columns[name]], dtype=str)
+            elif dtype in ARRAY_DTYPES:
+                flat = [np.asarray(c, dtype=ARRAY_DTYPES[dtype]).ravel() for c in columns[name]]
+                arrays[f'{name}_offsets'] = np.cumsum([0] + [len(c) for c in flat]).astype(np.int64)
+                arrays[name] = np.concatenate(flat) if flat else np.zeros(0, ARRAY_DTYPES[dtype])
+            else:
+                arrays[name] = np.asarray(columns[name], dtype=dtype)
+        with open(path, 'wb') as handle:
+            np.savez(handle, **arrays)
+
+    def chunks(self):
+        """Published chunk files in write order"""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, entry) for entry in os.listdir(self.path)
+                      if not entry.startswith('.') and entry.endswith(('.parquet', '.npz')))
+
+    def rollback(self, committed):
+        """Delete chunks (and staging files) not named in committed, e.g. after a crash"""
+        if not os.path.isdir(self.path):
+            return
+        committed = set(committed)
+        for entry in os.listdir(self.path):
+            if entry.endswith(('.parquet', '.npz')) and entry not in committed:
+                os.remove(os.path.join(self.path, entry))
+        missing = committed - set(os.listdir(self.path))
+        if missing:
+            raise ValueError(f"Checkpointed result chunks are missing from {self.path}: {sorted(missing)}")
+
+    def iter_batches(self, columns=None, filters=None):
+        """Yield one DataFrame per chunk holding only the requested columns and matching rows
+
+        filters is a list of (column, op, value) predicates that must all hold, with op one
+        of ==, !=, <, <=, >, >= or in.
+        """
+        columns = list(columns or self.schema)
+        filters = list(filters or [])
+        needed = list(dict.fromkeys(columns + [column for column, _, _ in filters]))
+        for chunk in self.chunks():
+            if chunk.endswith('.parquet'):
+                data = self._read_parquet(chunk, needed, filters)
+            else:
+                data = self._read_npz(chunk, needed, filters)
+            if data is not None:
+                yield pd.DataFrame({name: data[name] for name in columns})
+
+    def read(self, columns=None, filters=None):
+        """Concatenate iter_batches into a single DataFrame"""
+        batches = list(self.iter_batches(columns, filters))
+        if not batches:
+            return pd.DataFrame(columns=list(columns or self.schema))
+        return pd.concat(batches, ignore_index=True)
+
+    def _read_parquet(self, chunk, needed, filters):
+        if pq is None:
+            raise ImportError(f"pyarrow is required to read {chunk}")
+        pushdown = [(column, op, list(value) if op == 'in' else value) for column, op, value in filters]
+        present = set(pq.read_schema(chunk).names)
+        table = pq.read_table(chunk, columns=[name for name in needed if name in present],
+                              filters=pushdown or None)
+        if not table.num_rows:
+            return None
+        data = {}
+        for name in needed:
+            if name not in present:
+                data[name] = self._missing(name, table.num_rows)
+            elif self.schema[name] == 'coords':
+                data[name] = [np.asarray(row, dtype=np.float32).reshape(-1, 3)
+                              for row in table.column(name).to_pylist()]
+            elif self.schema[name] == 'bits':
+                column = table.column(name).combine_chunks()
+                words = column.flatten().to_numpy(zero_copy_only=False).astype(np.uint64)
+                offsets = column.offsets.to_numpy()
+                data[name] = [words[offsets[i]:offsets[i + 1]] for i in range(len(column))]
+            else:
+                data[name] = table.column(name).to_numpy()
+        return data
+
+    def _missing(self, name, n_rows):
+        """Placeholder values for a column written by an older schema"""
+        dtype = self.schema[name]
+        if dtype == 'str':
+            return np.full(n_rows, '', dtype=object)
+        if dtype in ARRAY_DTYPES:
+            return [np.zeros(0, ARRAY_DTYPES[dtype])] * n_rows
+        return np.full(n_rows, np.nan if np.issubdtype(dtype, np.floating) else 0, dtype=dtype)
+
+    def _npz_rows(self, archive, filters):
+        """Indices of the rows of an NPZ chunk matching every filter"""
+        mask = None
+        for column, op, value in filters:
+            hit = FILTER_OPS[op](archive[column], value)
+            mask = hit if mask is None else mask & hit
+        if mask is None:
+            key = next(name for name, dtype in self.schema.items() if dtype not in ARRAY_DTYPES)
+            mask = np.ones(len(archive[key]), dtype=bool)
+        return np.nonzero(mask)[0]
+
+    def read_array(self, column, filters=None, width=None):
+        """One coords or bits column of the matching rows as a single NumPy array
+
+        Rows must all have the same length, e.g. the poses of one ligand; coords come back
+        as (n_rows, n_atoms, 3) and bits as (n_rows, n_words). Values go straight from the
+        chunk buffers into the array, without the per-row arrays of read(). With width
+        (values per row) rows of any other length, such as the empty fingerprints of older
+        chunks, are skipped, and (array, kept) is returned, kept flagging the matching rows
+        that were read, in read() order.
+        """
+        dtype = ARRAY_DTYPES[self.schema[column]]
+        parts, kept = [], []
+        for flat, starts, lengths in self._array_chunks(column, filters):
+            if width is not None:
+                keep = lengths == width
+                kept.append(keep)
+                starts, lengths = starts[keep], lengths[keep]
+            if not len(lengths):
+                continue
+            if (lengths != lengths[0]).any() or (parts and lengths[0] != parts[0].shape[1]):
+                raise ValueError(f"Rows of {column} differ in length; filter them to one ligand or pass width")
+            # Gather every row's slice of the flat values in one fancy index
+            index = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            parts.append(np.asarray(flat[index], dtype=dtype).reshape(len(lengths), lengths[0]))
+        array = np.concatenate(parts) if parts else np.zeros((0, width or 0), dtype)
+        if self.schema[column] == 'coords':
+            array = array.reshape(len(array), -1, 3)
+        if width is None:
+            return array
+        return array, np.concatenate(kept) if kept else np.zeros(0, dtype=bool)
+
+    def array_width(self, column, filters=None):
+        """Largest number of values in one row of an array column among the matching rows (0 if none)"""
+        return max((int(lengths.max()) for _, _, lengths in self._array_chunks(column, filters) if len(lengths)),
+                   default=0)
+
+    def _array_chunks(self, column, filters):
+        """(flat values, row starts, row lengths) of an array column's matching rows, per chunk"""
+        filters = list(filters or [])
+        dtype = ARRAY_DTYPES[self.schema[column]]
+        for chunk in self.chunks():
+            if chunk.endswith('.parquet'):
+                yield self._parquet_array(chunk, column, filters)
+                continue
+            with np.load(chunk) as archive:
+                rows = self._npz_rows(archive, filters)
+                if f'{column}_offsets' in archive.files:
+                    offsets = archive[f'{column}_offsets']
+                    yield archive[column], offsets[rows], np.diff(offsets)[rows]
+                else:  # written by an older schema
+                    yield np.zeros(0, dtype), np.zeros(len(rows), np.int64), np.zeros(len(rows), np.int64)
+
+    def _parquet_array(self, chunk, column, filters):
+        """Flat values of an array column of a Parquet chunk and each matching row's start and length"""
+        if pq is None:
+            raise ImportError(f"pyarrow is required to read {chunk}")
+        pushdown = [(name, op, list(value) if op == 'in' else value) for name, op, value in filters]
+        dtype = ARRAY_DTYPES[self.schema[column]]
+        if column not in pq.read_schema(chunk).names:  # written by an older schema
+            count_column = next(name for name, kind in self.schema.items() if kind not in ARRAY_DTYPES)
+            n_rows = pq.read_table(chunk, columns=[count_column], filters=pushdown or None).num_rows
+            return np.zeros(0, dtype), np.zeros(n_rows, np.int64), np.zeros(n_rows, np.int64)
+        values = pq.read_table(chunk, columns=[column], filters=pushdown or None).column(column).combine_chunks()
+        offsets = values.offsets.to_numpy()
+        flat = values.values.to_numpy(zero_copy_only=False)
+        return flat, offsets[:-1], np.diff(offsets)
+
+    def _read_npz(self, chunk, needed, filters):
+        # NpzFile members are only read from disk when accessed, which gives column projection
+        with np.load(chunk) as archive:
+            rows = self._npz_rows(archive, filters)
+            if not len(rows):
+                return None
+            data = {}
+            for name in needed:
+                if name not in archive.files:
+                    data[name] = self._missing(name, len(rows))
+                elif self.schema[name] in ARRAY_DTYPES:
+                    flat, offsets = archive[name], archive[f'{name}_offsets']
+                    data[name] = [flat[offsets[i]:offsets[i + 1]] for i in rows]
+                    if self.schema[name] == 'coords':
+                        data[name] = [row.reshape(-1, 3) for row in data[name]]
+                else:
+                    data[name] = archive[name][rows]
+        return data
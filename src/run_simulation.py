@@ -1,78 +1,107 @@
+from checkpoint import CHECKPOINT_FILE, Checkpoint, resume_state
+from instrumentation import METRICS
 from molecular_dock import MolecularDocking
+from results_store import DEFAULT_RESULTS_DIR, ResultsStore
+from streaming_stats import summarize_store
 import pandas as pd
 import os
+import argparse
 from urllib.request import urlretrieve
 import numpy as np
 from datetime import datetime
 
-def download_pdb():
-    """Download the 5-HT2A receptor PDB file"""
+def download_pdb(offline=False):
+    """Download the 5-HT2A receptor PDB file unless it is already present"""
     pdb_path = "data/5ht2a.pdb"
     if not os.path.exists("data"):
         os.makedirs("data")
     
     pdb_url = "https://files.rcsb.org/download/4oaj.pdb"
     if not os.path.exists(pdb_path):
+        if offline:
+            raise FileNotFoundError(f"{pdb_path} is missing and downloads are disabled (--offline)")
         print("Downloading PDB file...")
         urlretrieve(pdb_url, pdb_path)
         print("Download complete!")
 
-def run_multiple_simulations(docking, n_simulations=10):
-    """Run multiple docking simulations and collect statistics"""
-    all_scores = []
-    for i in range(n_simulations):
-        print(f"\rRunning simulation {i+1}/{n_simulations}", end="")
-        score = docking.run_docking_simulation()
-        all_scores.append(score)
-    print("\n")
-    return all_scores
+def run_multiple_simulations(docking, store, checkpoint, state, compound, smiles):
+    """Run the remaining simulations, checkpointing after each one, and return running statistics of the best scores"""
+    n_simulations = state['n_simulations']
+    METRICS.set('simulations_planned', n_simulations)
+    # Runs finished before a resume are folded in first, so the statistics cover the whole job
+    summary = summarize_store(store.path, filters=[('Pose', '==', 1)])
+    for run in range(state['completed'] + 1, n_simulations + 1):
+        poses = docking.run_docking_simulation(seed=state['seed'] + run)
+        with METRICS.timer('results_write'):
+            state['chunks'].append(store.append(poses.to_columns(compound, smiles, run)))
+            state['completed'] = run
+            checkpoint.save(state)
+        summary.update(pd.DataFrame({'Run': [run], 'Binding_Score': [poses.scores[0]]}))
+        METRICS.count('simulations_done')
+        METRICS.set('best_score', summary.stats.min)
+        METRICS.set('mean_score', summary.stats.mean)
+        METRICS.set('median_score', summary.digest.quantile(0.5))
+        METRICS.flush()
+    return summary
 
-def analyze_results(scores):
+def analyze_results(summary):
     """Analyze docking results"""
+    stats = summary.summary()
     results = {
-        'Best Score': min(scores),
-        'Average Score': np.mean(scores),
-        'Standard Deviation': np.std(scores),
-        'Median Score': np.median(scores),
-        'Score Range': max(scores) - min(scores)
+        'Best Score': stats['Best Score'],
+        'Average Score': stats['Mean'],
+        'Standard Deviation': stats['Std Dev'],
+        'Median Score': stats['Median'],
+        'Score Range': stats['Range']
     }
     return results
 
-def save_results(results, scores):
-    """Save results to CSV file"""
+def open_results(n_simulations, resume_dir=None):
+    """Results store and checkpoint for a new run, or for the interrupted run in resume_dir"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"data/docking_results_{timestamp}.csv"
-    
-    # Save detailed scores
-    df = pd.DataFrame({
-        'Simulation': range(1, len(scores) + 1),
-        'Binding Score': scores
-    })
-    df.to_csv(filename, index=False)
-    print(f"Detailed results saved to {filename}")
+    store = ResultsStore(resume_dir or os.path.join(DEFAULT_RESULTS_DIR, f"docking_results_{timestamp}"))
+    checkpoint = Checkpoint(os.path.join(store.path, CHECKPOINT_FILE))
+    state = resume_state(checkpoint, store, resume=resume_dir is not None, fresh_state={
+        'n_simulations': n_simulations, 'completed': 0, 'chunks': [],
+        'seed': int(np.random.default_rng().integers(1 << 31))})
+    return store, checkpoint, state
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Repeat serotonin docking against the 5-HT2A receptor")
+    parser.add_argument('--simulations', type=int, default=20, help="number of independent simulations")
+    parser.add_argument('--resume', metavar='RESULTS_DIR', help="continue an interrupted run from its checkpoint")
+    parser.add_argument('--offline', action='store_true', help="never reach rcsb.org; use the bundled structure")
+    parser.add_argument('--flexible-residues', nargs='*', default=[], metavar='CHAIN:NUMBER',
+                        help="pocket residues whose side-chain rotamers are sampled (rotamer grid ensemble)")
+    parser.add_argument('--metrics-json', help="append metric snapshots to this JSON-lines log")
+    parser.add_argument('--metrics-prom', help="Prometheus textfile snapshot, e.g. for the node exporter")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="seconds between snapshots")
+    args = parser.parse_args(argv)
+    if args.metrics_json or args.metrics_prom:
+        METRICS.configure(args.metrics_json, args.metrics_prom, args.metrics_interval)
 
-def main():
-    download_pdb()
+    download_pdb(args.offline)
     
     docking = MolecularDocking()
     serotonin_smiles = "NCCC1=CC2=C(C=C1)C(=CN2)C"
     
-    receptor = docking.load_receptor("data/5ht2a.pdb")
+    receptor = docking.load_receptor("data/5ht2a.pdb", flexible_residues=args.flexible_residues)
     ligand = docking.prepare_ligand(serotonin_smiles)
     
     # Run multiple simulations
+    store, checkpoint, state = open_results(args.simulations, args.resume)
     print("Starting docking simulations...")
-    scores = run_multiple_simulations(docking, n_simulations=20)
+    summary = run_multiple_simulations(docking, store, checkpoint, state, "Serotonin", serotonin_smiles)
     
     # Analyze results
-    results = analyze_results(scores)
+    results = analyze_results(summary)
     
     # Display results
     print("\nDocking Results:")
     print("---------------")
     print(f"Ligand: Serotonin")
     print(f"Receptor: 5-HT2A")
-    print(f"Number of simulations: {len(scores)}")
+    print(f"Number of simulations: {summary.count}")
     print("\nStatistical Analysis:")
     print(f"Best binding score: {results['Best Score']:.2f} kcal/mol")
     print(f"Average binding score: {results['Average Score']:.2f} kcal/mol")
@@ -81,8 +110,8 @@ def main():
     print(f"Score range: {results['Score Range']:.2f} kcal/mol")
     print(f"\nBinding strength: {'Strong' if results['Best Score'] < -8 else 'Moderate' if results['Best Score'] < -6 else 'Weak'}")
     
-    # Save results
-    save_results(results, scores)
+    print(f"Detailed results saved to {store.path}")
+    METRICS.flush(force=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
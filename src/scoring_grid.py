@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from rdkit.Chem import Descriptors
+
+from atom_types import (ATOM_TYPES, VDW_RADIUS, VDW_EPSILON, XS_RADIUS, SOLVATION, VOLUME,
+                        CHARGE_SOLVATION, type_ligand_atoms)
+from result_columns import ENERGY_TERMS
+from spatial_index import build_spatial_index
+
+# One map per ligand atom type for vdW, then one map per remaining interaction
+MAP_NAMES = tuple(f'vdw_{t}' for t in ATOM_TYPES) + (
+    'electrostatic', 'hbond_acceptor', 'hbond_donor',
+    'desolvation_volume', 'desolvation_solvation', 'pi_stacking', 'hydrophobic')
+MAP_TERMS = np.array([ENERGY_TERMS.index(t) for t in (
+    ('van_der_waals',) * len(ATOM_TYPES) +
+    ('electrostatic', 'hydrogen_bonds', 'hydrogen_bonds',
+     'desolvation', 'desolvation', 'pi_stacking', 'hydrophobic'))])
+
+# Bump whenever map definitions or weights change so cached grids are rebuilt
+GRID_VERSION = 1
+DEFAULT_GRID_CACHE_DIR = os.path.join('data', 'cache', 'grids')
+
+# AutoDock4 free-energy weights, Vina hydrophobic weight
+VDW_WEIGHT = 0.1662
+HBOND_WEIGHT = 0.1209
+ELEC_WEIGHT = 0.1406
+DESOLV_WEIGHT = 0.1322
+TORSION_WEIGHT = 0.2983
+HYDROPHOBIC_WEIGHT = -0.0351
+PI_STACKING_WEIGHT = -0.04
+
+CUTOFF = 8.0                # Å, nonbonded cutoff used when building maps
+ENERGY_CAP = 5.0            # kcal/mol, per-atom cap on repulsive map values
+OUT_OF_GRID_PENALTY = 1.0   # kcal/mol per Å an atom lies outside the box
+HBOND_DISTANCE = 2.9        # Å, heavy-atom donor-acceptor optimum
+HBOND_DEPTH = 5.0           # kcal/mol, 12-10 well depth
+PI_STACKING_DISTANCE = 3.8  # Å, ring atom separation in a stacked pair
+DESOLV_SIGMA = 3.6          # Å, width of the desolvation Gaussian
+COULOMB = 332.06371         # kcal·Å/(mol·e²)
+
+
+def distance_dependent_dielectric(r):
+    """Mehler-Solmajer sigmoidal dielectric used by AutoDock4"""
+    a = -8.5525
+    b = 78.4 - a
+    return a + b / (1.0 + 7.7839 * np.exp(-0.003627 * b * r))
+
+
+class LigandTerms:
+    """Per-ligand coefficients mapping (atom, grid map) pairs to energy terms"""
+
+    def __init__(self, mol):
+        typed = type_ligand_atoms(mol)
+        types = typed['types'].astype(int)
+        charges = typed['charges']
+        n_atoms = len(types)
+        atoms = np.arange(n_atoms)
+
+        pair_atom = [atoms]
+        pair_map = [types]
+        pair_coef = [np.ones(n_atoms)]
+
+        def add(mask, map_name, coef):
+            pair_atom.append(atoms[mask])
+            pair_map.append(np.full(mask.sum(), MAP_NAMES.index(map_name)))
+            pair_coef.append(np.broadcast_to(coef, n_atoms)[mask])
+
+        add(charges != 0, 'electrostatic', charges)
+        add(typed['acceptor'], 'hbond_acceptor', 1.0)
+        add(typed['donor'], 'hbond_donor', 1.0)
+        add(np.ones(n_atoms, dtype=bool), 'desolvation_volume',
+            SOLVATION[types] + CHARGE_SOLVATION * np.abs(charges))
+        add(VOLUME[types] > 0, 'desolvation_solvation', VOLUME[types])
+        add(typed['aromatic'], 'pi_stacking', 1.0)
+        add(typed['hydrophobic'], 'hydrophobic', 1.0)
+
+        # Bonded heavy-atom averaging matrix, used for directional terms in the pairwise force field
+        self.heavy_neighbors = np.zeros((n_atoms, n_atoms), dtype=np.float32)
+        for atom in mol.GetAtoms():
+            heavy = [n.GetIdx() for n in atom.GetNeighbors() if n.GetAtomicNum() > 1]
+            self.heavy_neighbors[atom.GetIdx(), heavy] = 1.0 / max(len(heavy), 1)
+
+        self.atoms = typed
+        self.n_atoms = n_atoms
+        self.pair_atom = np.concatenate(pair_atom)
+        self.pair_map = np.concatenate(pair_map)
+        self.pair_coef = np.concatenate(pair_coef).astype(np.float32)
+        self.term_matrix = np.zeros((len(self.pair_map), len(ENERGY_TERMS)), dtype=np.float32)
+        self.term_matrix[np.arange(len(self.pair_map)), MAP_TERMS[self.pair_map]] = 1.0
+        self.pair_matrix = np.zeros((n_atoms, len(self.pair_atom)), dtype=np.float32)
+        self.pair_matrix[self.pair_atom, np.arange(len(self.pair_atom))] = 1.0
+        self.entropy = TORSION_WEIGHT * Descriptors.NumRotatableBonds(mol)
+
+
+class AffinityGrid:
+    """Precomputed receptor affinity maps scored by trilinear interpolation"""
+
+    def __init__(self, origin, spacing, maps):
+        self.origin = np.asarray(origin, dtype=np.float32)
+        self.spacing = float(spacing)
+        self.maps = np.ascontiguousarray(maps, dtype=np.float32)
+        self.path = None
+        self.shape = np.array(self.maps.shape[1:])
+        self._flat_maps = self.maps.reshape(-1)
+        nx, ny, nz = self.shape
+        self._map_stride = nx * ny * nz
+        self._corner_offsets = np.array([dx * ny * nz + dy * nz + dz
+                                         for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)])
+
+    @property
+    def center(self):
+        return self.origin + (self.shape - 1) * self.spacing / 2
+
+    @property
+    def size(self):
+        return (self.shape - 1) * self.spacing
+
+    @classmethod
+    def build(cls, receptor, center, size=22.5, spacing=0.375, chunk_size=2048):
+        """Compute all maps for typed receptor atoms over a box around center
+
+        size is the edge of a cube, or one edge length per axis.
+        """
+        center = np.asarray(center, dtype=np.float64)
+        size = np.broadcast_to(np.asarray(size, dtype=np.float64), 3)
+        n_points = np.ceil(np.round(size / spacing, 6)).astype(int) + 1
+        origin = center - (n_points - 1) * spacing / 2
+        axes = [np.arange(n) * spacing for n in n_points]
+        points = (np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+                  + origin).astype(np.float32)
+
+        # Receptor atoms further than the cutoff from the box never contribute
+        coords = receptor['coords']
+        lower, upper = origin - CUTOFF, origin + (n_points - 1) * spacing + CUTOFF
+        keep = np.all((coords >= lower) & (coords <= upper), axis=1)
+        atoms = {key: np.asarray(value)[keep] for key, value in receptor.items()}
+        index = build_spatial_index(atoms['coords'])
+
+        maps = np.zeros((len(MAP_NAMES), len(points)), dtype=np.float32)
+        for start in range(0, len(points), chunk_size):
+            block = points[start:start + chunk_size]
+            maps[:, start:start + chunk_size] = cls._compute_maps(block, atoms, index)
+
+        return cls(origin, spacing, maps.reshape(len(MAP_NAMES), *n_points))
+
+    @staticmethod
+    def _compute_maps(points, atoms, index):
+        """Evaluate every map at a block of grid points from the atom pairs within the cutoff"""
+        point, atom, r = index.query_pairs(points, CUTOFF)
+        r = np.maximum(r, 0.5)
+        types = atoms['types'][atom].astype(int)
+        charges = atoms['charges'][atom]
+        values = np.zeros((len(MAP_NAMES), len(points)), dtype=np.float32)
+
+        def accumulate(map_name, energy, mask=None):
+            if mask is not None:
+                energy = np.where(mask, energy, 0.0)
+            values[MAP_NAMES.index(map_name)] = np.bincount(point, weights=energy, minlength=len(points))
+
+        for t, name in enumerate(ATOM_TYPES):
+            rij = (VDW_RADIUS[t] + VDW_RADIUS[types]) / 2
+            eps = np.sqrt(VDW_EPSILON[t] * VDW_EPSILON[types])
+            ratio6 = (rij / r) ** 6
+            accumulate(f'vdw_{name}', VDW_WEIGHT * eps * (ratio6 ** 2 - 2 * ratio6))
+
+        elec = COULOMB * charges / (distance_dependent_dielectric(r) * r)
+        accumulate('electrostatic', ELEC_WEIGHT * elec)
+
+        c12 = 5 * HBOND_DEPTH * HBOND_DISTANCE ** 12
+        c10 = 6 * HBOND_DEPTH * HBOND_DISTANCE ** 10
+        hbond = HBOND_WEIGHT * (c12 / r ** 12 - c10 / r ** 10)
+        accumulate('hbond_acceptor', hbond, atoms['donor'][atom])
+        accumulate('hbond_donor', hbond, atoms['acceptor'][atom])
+
+        gauss = DESOLV_WEIGHT * np.exp(-r ** 2 / (2 * DESOLV_SIGMA ** 2))
+        accumulate('desolvation_volume', gauss * VOLUME[types])
+        accumulate('desolvation_solvation', gauss * (SOLVATION[types] + CHARGE_SOLVATION * np.abs(charges)))
+
+        stacking = PI_STACKING_WEIGHT * np.exp(-((r - PI_STACKING_DISTANCE) / 0.6) ** 2)
+        accumulate('pi_stacking', stacking, atoms['aromatic'][atom])
+
+        # Vina hydrophobic term on surface distance, using the ligand carbon radius
+        surface = r - XS_RADIUS[0] - XS_RADIUS[types]
+        accumulate('hydrophobic', HYDROPHOBIC_WEIGHT * np.clip(1.5 - surface, 0.0, 1.0),
+                   atoms['hydrophobic'][atom])
+
+        # Only the steep short-range terms need capping
+        for name in MAP_NAMES[:len(ATOM_TYPES)] + ('hbond_acceptor', 'hbond_donor'):
+            np.minimum(values[MAP_NAMES.index(name)], ENERGY_CAP, out=values[MAP_NAMES.index(name)])
+        elec = values[MAP_NAMES.index('electrostatic')]
+        np.clip(elec, -ENERGY_CAP, ENERGY_CAP, out=elec)
+        return values
+
+    def _interpolate(self, coords, terms, gradient=False):
+        """Trilinear map values at every (atom, map) pair, optionally with spatial derivatives"""
+        coords = np.asarray(coords, dtype=np.float32)
+        grid = (coords - self.origin) / self.spacing
+        upper = self.shape - 1
+        clipped = np.clip(grid, 0, upper)
+        outside = (grid - clipped) * self.spacing
+
+        index = np.minimum(clipped.astype(np.int64), upper - 1)
+        frac = (clipped - index)[..., terms.pair_atom, :]
+        _, ny, nz = self.shape
+        atom_base = (index[..., 0] * ny + index[..., 1]) * nz + index[..., 2]
+        base = atom_base[..., terms.pair_atom] + terms.pair_map * self._map_stride
+        corners = self._flat_maps[base[..., None] + self._corner_offsets].reshape(base.shape + (2, 2, 2))
+
+        fx, fy, fz = frac[..., 0, None, None], frac[..., 1, None], frac[..., 2]
+        along_x = corners[..., 0, :, :] * (1 - fx) + corners[..., 1, :, :] * fx
+        along_y = along_x[..., 0, :] * (1 - fy) + along_x[..., 1, :] * fy
+        values = along_y[..., 0] * (1 - fz) + along_y[..., 1] * fz
+        if not gradient:
+            return values, outside, None
+
+        diff_x = corners[..., 1, :, :] - corners[..., 0, :, :]
+        diff_x = diff_x[..., 0, :] * (1 - fy) + diff_x[..., 1, :] * fy
+        diff_y = along_x[..., 1, :] - along_x[..., 0, :]
+        derivatives = np.stack([
+            diff_x[..., 0] * (1 - fz) + diff_x[..., 1] * fz,
+            diff_y[..., 0] * (1 - fz) + diff_y[..., 1] * fz,
+            along_y[..., 1] - along_y[..., 0],
+        ], axis=-1) / self.spacing
+        # Atoms clamped to the box edge see no map gradient along the clamped axis
+        derivatives *= (outside == 0)[..., terms.pair_atom, :]
+        return values, outside, derivatives
+
+    def evaluate(self, coords, terms, additive=False):
+        """Score pose coordinates of shape (..., n_atoms, 3), returning (..., n_terms) energies
+
+        additive=True leaves out the ligand entropy and the box-edge penalty, for grids
+        whose energies are added on top of another grid's.
+        """
+        values, outside, _ = self._interpolate(coords, terms)
+        energies = (values * terms.pair_coef) @ terms.term_matrix
+        if not additive:
+            energies[..., ENERGY_TERMS.index('van_der_waals')] += OUT_OF_GRID_PENALTY * np.abs(outside).sum((-1, -2))
+            energies[..., ENERGY_TERMS.index('entropy')] = terms.entropy
+        return energies
+
+    def energy_gradient(self, coords, terms, additive=False):
+        """Total energy (...,) and its gradient with respect to atom positions (..., n_atoms, 3)"""
+        values, outside, derivatives = self._interpolate(coords, terms, gradient=True)
+        energy = values @ terms.pair_coef
+        weighted = derivatives * terms.pair_coef[:, None]
+        gradient = terms.pair_matrix @ weighted
+        if not additive:
+            energy = energy + OUT_OF_GRID_PENALTY * np.abs(outside).sum((-1, -2)) + terms.entropy
+            gradient += OUT_OF_GRID_PENALTY * np.sign(outside)
+        return energy, gradient
+
+    def score_batch(self, coords, terms, max_elements=1 << 22):
+        """Score a (n_poses, n_atoms, 3) batch in chunks, returning (n_poses, n_terms) float32"""
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, terms.n_atoms, 3)
+        energies = np.empty((len(coords), len(ENERGY_TERMS)), dtype=np.float32)
+        chunk = max(1, max_elements // (8 * len(terms.pair_atom)))
+        for start in range(0, len(coords), chunk):
+            energies[start:start + chunk] = self.evaluate(coords[start:start + chunk], terms)
+        return energies
+
+    def save(self, directory):
+        """Write the maps as a memory-mappable .npy plus geometry, atomically replacing the directory"""
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent)
+        np.save(os.path.join(staging, 'maps.npy'), self.maps)
+        np.savez(os.path.join(staging, 'geometry.npz'), origin=self.origin, spacing=self.spacing)
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.path = directory
+
+    @classmethod
+    def load(cls, directory):
+        """Memory-map a grid written by save"""
+        geometry = np.load(os.path.join(directory, 'geometry.npz'))
+        maps = np.load(os.path.join(directory, 'maps.npy'), mmap_mode='r')
+        grid = cls(geometry['origin'], float(geometry['spacing']), maps)
+        grid.path = directory
+        return grid
+
+    @classmethod
+    def load_or_build(cls, receptor, center, size=22.5, spacing=0.375, cache_dir=DEFAULT_GRID_CACHE_DIR):
+        """Map a cached grid for this prepared receptor and box, building it on a miss"""
+        if cache_dir is None or getattr(receptor, 'key', None) is None:
+            return cls.build(receptor.scoring_atoms(), center, size, spacing)
+        box = {'receptor': receptor.key, 'center': np.round(np.asarray(center, float), 3).tolist(),
+               'size': size, 'spacing': spacing, 'version': GRID_VERSION}
+        key = hashlib.sha256(json.dumps(box, sort_keys=True).encode()).hexdigest()[:24]
+        directory = os.path.join(cache_dir, key)
+        if not os.path.isdir(directory):
+            cls.build(receptor.scoring_atoms(), center, size, spacing).save(directory)
+        return cls.load(directory)
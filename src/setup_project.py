@@ -1,9 +1,7 @@
 import os
+import sys
 
-def create_project_structure():
-    # Define base directory
-    base_dir = r"c:\Users\PC\Documents\New Bioinformatics"
-    
+def create_project_structure(base_dir='.'):
     # Define directories to create
     directories = [
         'src',
@@ -21,4 +19,4 @@ def create_project_structure():
             print(f"Created directory: {dir_path}")
 
 if __name__ == "__main__":
-    create_project_structure()
\ No newline at end of file
+    create_project_structure(sys.argv[1] if len(sys.argv) > 1 else '.')
\ No newline at end of file
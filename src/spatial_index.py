@@ -0,0 +1,108 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class SpatialIndex(ABC):
+    """Common batched query API shared by the cell list and the KD-tree fallback"""
+
+    @abstractmethod
+    def query_pairs(self, points, radius):
+        """Return (point_index, atom_index, distance) arrays for all pairs within radius"""
+
+    def query_radius(self, points, radius):
+        """Return CSR-style (indptr, indices, distances) neighbor lists, one row per point"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        point, atom, distance = self.query_pairs(points, radius)
+        indptr = np.zeros(len(points) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(point, minlength=len(points)), out=indptr[1:])
+        return indptr, atom, distance
+
+    def count_within(self, points, radius):
+        """Number of atoms within radius of each point"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        point, _, _ = self.query_pairs(points, radius)
+        return np.bincount(point, minlength=len(points))
+
+
+class CellList(SpatialIndex):
+    """Uniform-grid cell list over atom coordinates"""
+
+    def __init__(self, coords, cell_size=4.0):
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+        self.n_atoms = len(coords)
+        self.cell_size = float(cell_size)
+        self.origin = coords.min(axis=0) if len(coords) else np.zeros(3, dtype=np.float32)
+        extent = coords.max(axis=0) - self.origin if len(coords) else np.zeros(3)
+        self.dims = np.floor(extent / self.cell_size).astype(np.int64) + 1
+
+        cells = self._flat_ids(self._cells(coords))
+        self.order = np.argsort(cells, kind='stable')
+        self.sorted_coords = coords[self.order]
+        self.cell_start = np.zeros(self.dims.prod() + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.dims.prod()), out=self.cell_start[1:])
+
+    def _cells(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def _flat_ids(self, cells):
+        return (cells[..., 0] * self.dims[1] + cells[..., 1]) * self.dims[2] + cells[..., 2]
+
+    def _offsets(self, radius):
+        """Neighbor cell offsets whose nearest corner can lie within radius"""
+        span = int(np.ceil(radius / self.cell_size))
+        steps = np.arange(-span, span + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+        gap = np.maximum(np.abs(offsets) - 1, 0) * self.cell_size
+        return offsets[(gap ** 2).sum(1) <= radius ** 2]
+
+    def query_pairs(self, points, radius):
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        neighbors = self._cells(points)[:, None, :] + self._offsets(radius)[None, :, :]
+        valid = np.all((neighbors >= 0) & (neighbors < self.dims), axis=-1)
+        ids = np.where(valid, self._flat_ids(np.clip(neighbors, 0, self.dims - 1)), 0).ravel()
+        counts = np.where(valid.ravel(), self.cell_start[ids + 1] - self.cell_start[ids], 0)
+
+        # Expand every (point, cell) range into candidate atom slots
+        total = counts.sum()
+        point = np.repeat(np.repeat(np.arange(len(points)), valid.shape[1]), counts)
+        run_start = np.repeat(np.cumsum(counts) - counts, counts)
+        slot = np.repeat(self.cell_start[ids], counts) + np.arange(total) - run_start
+
+        delta = points[point] - self.sorted_coords[slot]
+        distance2 = np.einsum('ij,ij->i', delta, delta)
+        keep = distance2 <= radius ** 2
+        return point[keep], self.order[slot[keep]], np.sqrt(distance2[keep])
+
+
+class KDTreeIndex(SpatialIndex):
+    """KD-tree fallback for sparse or irregularly shaped atom sets"""
+
+    def __init__(self, coords):
+        from scipy.spatial import cKDTree
+
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+        self.n_atoms = len(coords)
+        self.tree = cKDTree(coords)
+
+    def query_pairs(self, points, radius):
+        from scipy.spatial import cKDTree
+
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        pairs = cKDTree(points).sparse_distance_matrix(self.tree, radius, output_type='ndarray')
+        pairs = pairs[np.lexsort((pairs['j'], pairs['i']))]
+        return pairs['i'].astype(np.int64), pairs['j'].astype(np.int64), pairs['v'].astype(np.float32)
+
+
+def build_spatial_index(coords, cell_size=4.0, max_cells_per_atom=64):
+    """Cell list for compact atom sets, KD-tree when the bounding box is mostly empty"""
+    coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+    if len(coords):
+        extent = coords.max(axis=0) - coords.min(axis=0)
+        n_cells = np.prod(np.floor(extent / cell_size) + 1)
+        if n_cells > max_cells_per_atom * len(coords):
+            try:
+                return KDTreeIndex(coords)
+            except ImportError:
+                pass
+    return CellList(coords, cell_size)
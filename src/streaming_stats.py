@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+from results_store import ResultsStore
+
+SUCCESS_THRESHOLD = -8.0  # kcal/mol
+
+
+class RunningStats:
+    """Count, mean, variance, min and max updated batch by batch (Welford/Chan) and mergeable"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values):
+            self._combine(len(values), values.mean(), ((values - values.mean()) ** 2).sum(),
+                          values.min(), values.max())
+
+    def merge(self, other):
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    def _combine(self, count, mean, m2, low, high):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    @property
+    def std(self):
+        """Sample standard deviation, as pandas reports it"""
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+
+class QuantileDigest:
+    """Approximate quantiles from at most ~compression weighted centroids (t-digest style)
+
+    Centroids are merged with the arcsine scale function, which keeps them small near
+    the tails, so extreme quantiles such as the best scores stay accurate.
+    """
+
+    def __init__(self, compression=200, buffer_size=4096):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffered = 0
+
+    @property
+    def count(self):
+        return self.weights.sum() + self._buffered
+
+    def add(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self._buffer.append((values, weights))
+        self._buffered += weights.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        if sum(len(v) for v, _ in self._buffer) >= self.buffer_size:
+            self._compress()
+
+    def merge(self, other):
+        if other.count:
+            other._compress()
+            self.add(other.means, other.weights)
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [v for v, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [w for _, w in self._buffer])
+        self._buffer, self._buffered = [], 0
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        bucket = np.floor(self.compression * (np.arcsin(2 * q - 1) / np.pi + 0.5)).astype(np.int64)
+        _, bucket = np.unique(bucket, return_inverse=True)
+        self.weights = np.bincount(bucket, weights)
+        self.means = np.bincount(bucket, weights * means) / self.weights
+
+    def quantile(self, q):
+        """Interpolated value at quantile q (scalar or array in [0, 1])"""
+        self._compress()
+        if not len(self.weights):
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        total = self.weights.sum()
+        positions = np.concatenate([[0.0], np.cumsum(self.weights) - self.weights / 2, [total]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(q) * total, positions, values)
+
+    def histogram(self, bins=20):
+        """Approximate (counts, edges) histogram of everything added"""
+        self._compress()
+        return np.histogram(self.means, bins=bins, range=(self.min, self.max), weights=self.weights)
+
+
+class TopK:
+    """The k rows with the lowest value in key seen so far"""
+
+    def __init__(self, k=5, key='Binding_Score'):
+        self.k = k
+        self.key = key
+        self.rows = None
+
+    def update(self, frame):
+        best = frame.nsmallest(self.k, self.key)
+        if self.rows is not None:
+            best = pd.concat([self.rows, best], ignore_index=True).nsmallest(self.k, self.key)
+        self.rows = best.reset_index(drop=True)
+
+    def merge(self, other):
+        if other.rows is not None:
+            self.update(other.rows)
+
+
+class SampledTrace:
+    """Evenly thinned (x, y) series of bounded length, for plotting arbitrarily long runs"""
+
+    def __init__(self, max_points=2000):
+        self.max_points = max_points
+        self.stride = 1
+        self.seen = 0
+        self.x, self.y = [], []
+
+    def update(self, x, y):
+        keep = (self.seen + np.arange(len(x))) % self.stride == 0
+        self.x += list(np.asarray(x)[keep])
+        self.y += list(np.asarray(y)[keep])
+        self.seen += len(x)
+        while len(self.x) > self.max_points:
+            self.x, self.y = self.x[::2], self.y[::2]
+            self.stride *= 2
+
+
+class ScoreSummary:
+    """Constant-memory statistics of one score column, updated per batch and mergeable across shards"""
+
+    def __init__(self, column='Binding_Score', thresholds=(SUCCESS_THRESHOLD,), top_k=5):
+        self.column = column
+        self.stats = RunningStats()
+        self.digest = QuantileDigest()
+        self.below = {threshold: 0 for threshold in thresholds}
+        self.top = TopK(top_k, column)
+
+    @property
+    def count(self):
+        return self.stats.count
+
+    def update(self, frame):
+        """Fold in a DataFrame batch holding the score column (plus any columns wanted in top-k)"""
+        values = frame[self.column].to_numpy(dtype=np.float64)
+        finite = np.isfinite(values)
+        values = values[finite]
+        self.stats.update(values)
+        self.digest.add(values)
+        for threshold in self.below:
+            self.below[threshold] += int((values < threshold).sum())
+        if len(values):
+            self.top.update(frame[finite])
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.digest.merge(other.digest)
+        for threshold, count in other.below.items():
+            self.below[threshold] = self.below.get(threshold, 0) + count
+        self.top.merge(other.top)
+
+    def success_rate(self, threshold=SUCCESS_THRESHOLD):
+        """Percentage of scores below threshold"""
+        return 100.0 * self.below[threshold] / self.count if self.count else np.nan
+
+    def summary(self):
+        if not self.count:
+            return dict.fromkeys(['Mean', 'Median', 'Std Dev', 'Best Score', 'Worst Score', 'Range'], np.nan)
+        return {
+            'Mean': float(self.stats.mean),
+            'Median': float(self.digest.quantile(0.5)),
+            'Std Dev': float(self.stats.std),
+            'Best Score': float(self.stats.min),
+            'Worst Score': float(self.stats.max),
+            'Range': float(self.stats.max - self.stats.min),
+        }
+
+
+def summarize_store(path, column='Binding_Score', filters=None, columns=(), schema=None, **options):
+    """ScoreSummary of a results store, streamed one chunk at a time
+
+    columns lists extra columns to carry into the top-k rows.
+    """
+    store = ResultsStore(path) if schema is None else ResultsStore(path, schema)
+    summary = ScoreSummary(column, **options)
+    for batch in store.iter_batches(columns=list(dict.fromkeys([column, *columns])), filters=filters):
+        summary.update(batch)
+    return summary
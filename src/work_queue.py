@@ -0,0 +1,278 @@
+import argparse
+import os
+import socket
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from checkpoint import Checkpoint
+from compound_library import chunked, read_library
+from instrumentation import METRICS
+from prefilter import RULE_SETS
+from results_store import SCREENING_SCHEMA, ResultsStore
+
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_LEASE = 900.0  # seconds a claim survives without a heartbeat
+OWNER_SEPARATOR = '@'
+
+
+def _owner_id():
+    """Unique claimant name: host, process and a random suffix (pids repeat across nodes and restarts)"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class ShardQueue:
+    """Library shards in a shared directory, claimed by atomic renames of empty token files
+
+    A shard's token moves pending/ -> claimed/<shard>@<owner> -> done/<shard>@<owner>.
+    Only one rename of a given token can succeed, so claims need no lock server, and a
+    worker whose claim was taken back (its lease expired) fails to complete the shard
+    and its results are ignored. Results of the completing owner live in
+    results/<shard>@<owner>, so every shard is counted exactly once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = Checkpoint(os.path.join(path, MANIFEST_FILE)).load()
+
+    @classmethod
+    def create(cls, library_file, path, shard_size=1000, seed=None, **settings):
+        """Split the valid records of a library into .smi shards and queue them all
+
+        settings (docking and prefilter options) are stored in the manifest so every
+        worker screens with the same parameters.
+        """
+        if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            raise ValueError(f"{path} already holds a work queue")
+        for directory in ('shards', 'pending', 'claimed', 'done', 'results'):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+        if seed is None:
+            seed = int(np.random.default_rng().integers(1 << 31))
+
+        starts = {}
+        for number, records in enumerate(chunked(read_library(library_file), shard_size)):
+            shard = f'shard-{number:05d}'
+            # Record i keeps seed + 1000 * i, so a sharded screen reproduces a single-process one
+            starts[shard] = number * shard_size
+            with open(os.path.join(path, 'shards', f'{shard}.smi'), 'w') as handle:
+                handle.writelines(f"{smiles} {name}\n" for name, smiles in records)
+        manifest = {'library': os.path.abspath(library_file), 'shard_size': shard_size, 'seed': seed,
+                    'shards': starts, 'settings': settings, 'created': time.time()}
+        Checkpoint(os.path.join(path, MANIFEST_FILE)).save(manifest)
+        # Tokens go last: workers can only claim shards whose inputs are complete
+        for shard in starts:
+            open(os.path.join(path, 'pending', shard), 'w').close()
+        return cls(path)
+
+    def _tokens(self, state):
+        return sorted(os.listdir(os.path.join(self.path, state)))
+
+    def claim(self, owner, lease=DEFAULT_LEASE):
+        """Claim a pending shard, or one whose lease expired; None when neither is left"""
+        for shard in self._tokens('pending'):
+            claimed = os.path.join(self.path, 'claimed', f'{shard}{OWNER_SEPARATOR}{owner}')
+            try:
+                os.rename(os.path.join(self.path, 'pending', shard), claimed)
+            except FileNotFoundError:
+                continue  # another worker got there first
+            os.utime(claimed)
+            return shard
+        if self.reclaim_expired(lease):
+            return self.claim(owner, lease)
+        return None
+
+    def reclaim_expired(self, lease=DEFAULT_LEASE):
+        """Return shards whose holders stopped heartbeating to pending/; the number reclaimed"""
+        reclaimed = 0
+        now = time.time()
+        for token in self._tokens('claimed'):
+            path = os.path.join(self.path, 'claimed', token)
+            try:
+                if now - os.stat(path).st_mtime < lease:
+                    continue
+                os.rename(path, os.path.join(self.path, 'pending', token.split(OWNER_SEPARATOR)[0]))
+                reclaimed += 1
+            except FileNotFoundError:
+                continue  # completed, or reclaimed by another worker meanwhile
+        return reclaimed
+
+    def heartbeat(self, shard, owner):
+        """Renew a claim's lease; False once the claim has been taken back"""
+        try:
+            os.utime(os.path.join(self.path, 'claimed', f'{shard}{OWNER_SEPARATOR}{owner}'))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, shard, owner):
+        """Mark a claimed shard done, committing owner's results; False if the claim was lost"""
+        token = f'{shard}{OWNER_SEPARATOR}{owner}'
+        try:
+            os.rename(os.path.join(self.path, 'claimed', token), os.path.join(self.path, 'done', token))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def results_dir(self, shard, owner):
+        return os.path.join(self.path, 'results', f'{shard}{OWNER_SEPARATOR}{owner}')
+
+    def shard_file(self, shard):
+        return os.path.join(self.path, 'shards', f'{shard}.smi')
+
+    def status(self):
+        """Shard counts per state"""
+        return {state: len(self._tokens(state)) for state in ('pending', 'claimed', 'done')}
+
+    def completed_results(self):
+        """Results stores of done shards, in shard order"""
+        return [ResultsStore(os.path.join(self.path, 'results', token), SCREENING_SCHEMA)
+                for token in self._tokens('done')]
+
+
+def screen_shard(queue, shard, owner, screener, lease=DEFAULT_LEASE, batch_size=256, **options):
+    """Dock one claimed shard into its owner's results store and complete it; False if the lease was lost
+
+    The lease is renewed as every compound finishes, so it must outlast the slowest
+    single compound (see the per-compound timeout).
+    """
+    store = ResultsStore(queue.results_dir(shard, owner), SCREENING_SCHEMA)
+    records = read_library(queue.shard_file(shard))
+    rows = screener.screen_records(records, batch_size=batch_size, seed=queue.manifest['seed'],
+                                   start=queue.manifest['shards'][shard], **options)
+    last_beat = time.time()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if time.time() - last_beat > lease / 4:
+            if not queue.heartbeat(shard, owner):
+                rows.close()
+                return False
+            last_beat = time.time()
+        if len(batch) == batch_size:
+            with METRICS.timer('results_write'):
+                store.append(pd.DataFrame(batch))
+            batch = []
+    if batch:
+        with METRICS.timer('results_write'):
+            store.append(pd.DataFrame(batch))
+    return queue.complete(shard, owner)
+
+
+def run_worker(queue_dir, lease=DEFAULT_LEASE, max_shards=None, wait=False, poll=30.0, **options):
+    """Claim and screen shards until none are left; returns the number completed
+
+    With wait=True the worker keeps polling while other workers hold claims, so it picks
+    up their shards if they die; otherwise it exits once nothing is claimable.
+    """
+    from compound_screening import CompoundScreening
+    from prefilter import Prefilter
+
+    queue = ShardQueue(queue_dir)
+    settings = dict(queue.manifest['settings'])
+    rules = settings.pop('rules', None)
+    screener = CompoundScreening(settings.pop('receptor_file', 'data/5ht2a.pdb'),
+                                 prefilter=Prefilter(rules) if rules else None,
+                                 flexible_residues=settings.pop('flexible_residues', ()))
+    owner = _owner_id()
+    completed = 0
+    while max_shards is None or completed < max_shards:
+        shard = queue.claim(owner, lease)
+        if shard is None:
+            if wait and queue.status()['claimed']:
+                time.sleep(poll)
+                continue
+            break
+        print(f"{owner} claimed {shard}")
+        if screen_shard(queue, shard, owner, screener, lease, **settings, **options):
+            completed += 1
+            METRICS.count('shards_done')
+            print(f"{owner} completed {shard}")
+        else:
+            METRICS.count('shards_lost')
+            print(f"{owner} lost the lease on {shard}; its results are discarded")
+        METRICS.flush()
+    return completed
+
+
+def merge_results(queue_dir, output_dir, partial=False):
+    """Rank the results of every done shard by best score into a single store; returns the ranked DataFrame"""
+    queue = ShardQueue(queue_dir)
+    status = queue.status()
+    if not partial and (status['pending'] or status['claimed']):
+        raise ValueError(f"{status['pending'] + status['claimed']} shards are unfinished; pass partial=True "
+                         f"to merge the {status['done']} done shards anyway")
+    frames = [store.read() for store in queue.completed_results()]
+    ranked = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=dict(SCREENING_SCHEMA))
+    ranked = ranked.sort_values('Best_Score', kind='stable', na_position='last').reset_index(drop=True)
+    output = ResultsStore(output_dir, SCREENING_SCHEMA)
+    if output.chunks():
+        raise ValueError(f"{output_dir} already holds results; choose another output")
+    output.append(ranked)
+    return ranked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shard a library screen across nodes through a shared directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help="split a library into queued shards")
+    create.add_argument('library', help=".smi/.sdf library to shard")
+    create.add_argument('queue', help="shared queue directory")
+    create.add_argument('--shard-size', type=int, default=1000, help="compounds per shard")
+    create.add_argument('--seed', type=int, help="base seed (random by default)")
+    create.add_argument('--receptor', default='data/5ht2a.pdb', help="receptor PDB file")
+    create.add_argument('--attempts', type=int, default=5, help="independent searches per compound")
+    create.add_argument('--max-evaluations', type=int, default=5000, help="pose evaluations per search")
+    create.add_argument('--timeout', type=float, default=None, help="seconds allowed per compound")
+    create.add_argument('--conformers', type=int, default=1, help="size of the pre-generated conformer ensemble")
+    create.add_argument('--rigid', action='store_true', help="dock ensemble members without torsional search")
+    create.add_argument('--rules', nargs='*', default=['lipinski', 'veber'], choices=sorted(RULE_SETS),
+                        help="prefilter rule sets applied before docking (none to disable)")
+    create.add_argument('--flexible-residues', nargs='*', default=[], metavar='CHAIN:NUMBER',
+                        help="pocket residues whose side-chain rotamers are sampled")
+
+    work = commands.add_parser('work', help="claim and screen shards until the queue is drained")
+    work.add_argument('queue', help="shared queue directory")
+    work.add_argument('--workers', type=int, default=1, help="docking stage pool size")
+    work.add_argument('--prep-workers', type=int, default=1, help="ligand preparation threads")
+    work.add_argument('--lease', type=float, default=DEFAULT_LEASE,
+                      help="seconds without a heartbeat before a claim may be reclaimed")
+    work.add_argument('--max-shards', type=int, help="stop after this many shards")
+    work.add_argument('--wait', action='store_true', help="keep polling while other workers hold claims")
+    work.add_argument('--metrics-json', help="append metric snapshots to this JSON-lines log")
+
+    status = commands.add_parser('status', help="count pending, claimed and done shards")
+    status.add_argument('queue', help="shared queue directory")
+
+    merge = commands.add_parser('merge', help="rank the results of all done shards into one store")
+    merge.add_argument('queue', help="shared queue directory")
+    merge.add_argument('output', help="results store directory for the ranked output")
+    merge.add_argument('--partial', action='store_true', help="merge even if some shards are unfinished")
+    merge.add_argument('--top', type=int, default=10, help="ranked compounds to print")
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        queue = ShardQueue.create(args.library, args.queue, args.shard_size, args.seed, receptor_file=args.receptor,
+                                  attempts=args.attempts, max_evaluations=args.max_evaluations,
+                                  timeout=args.timeout, n_conformers=args.conformers, flexible=not args.rigid,
+                                  rules=args.rules, flexible_residues=args.flexible_residues)
+        print(f"Queued {len(queue.manifest['shards'])} shards in {args.queue}")
+    elif args.command == 'work':
+        if args.metrics_json:
+            METRICS.configure(args.metrics_json)
+        completed = run_worker(args.queue, args.lease, args.max_shards, args.wait, n_workers=args.workers,
+                               prep_workers=args.prep_workers)
+        print(f"Completed {completed} shards; queue: {ShardQueue(args.queue).status()}")
+        METRICS.flush(force=True)
+    elif args.command == 'status':
+        print(ShardQueue(args.queue).status())
+    else:
+        ranked = merge_results(args.queue, args.output, args.partial)
+        print(f"Merged {len(ranked)} compounds into {args.output}")
+        print(ranked.head(args.top).to_string())
+
+
+if __name__ == "__main__":
+    main()
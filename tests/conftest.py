@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
+RECEPTOR = os.path.join(os.path.dirname(SRC), 'data', '5ht2a.pdb')
+
+
+@pytest.fixture(scope='session')
+def cache_dir(tmp_path_factory):
+    """Receptor, grid and ligand caches for the test session, outside the repository"""
+    return tmp_path_factory.mktemp('cache')
+
+
+@pytest.fixture(scope='session')
+def docking(cache_dir):
+    """5-HT2A receptor with its scoring grid, shared by every test"""
+    from ligand_prep import LigandCache
+    from molecular_dock import MolecularDocking
+
+    docking = MolecularDocking(LigandCache(str(cache_dir / 'ligands.sqlite')))
+    docking.load_receptor(RECEPTOR, str(cache_dir / 'receptors'))
+    docking.build_scoring_grid(cache_dir=str(cache_dir / 'grids'))
+    return docking
+
+
+@pytest.fixture(scope='session')
+def screener(cache_dir):
+    """CompoundScreening over the session caches"""
+    from compound_screening import CompoundScreening
+    from ligand_prep import LigandCache
+
+    return CompoundScreening(RECEPTOR, cache_dir=str(cache_dir / 'receptors'),
+                             grid_cache_dir=str(cache_dir / 'grids'),
+                             ligand_cache=LigandCache(str(cache_dir / 'ligands.sqlite')))
@@ -0,0 +1,36 @@
+from adaptive_screening import SuccessiveHalving
+from results_store import ADAPTIVE_SCHEMA, ResultsStore
+
+LIBRARY = [('Serotonin', 'NCCc1c[nH]c2ccc(O)cc12'), ('DMT', 'CN(C)CCc1c[nH]c2ccccc12'),
+           ('Psilocin', 'CN(C)CCc1c[nH]c2cccc(O)c12'), ('Tryptamine', 'NCCc1c[nH]c2ccccc12')]
+
+
+def run(screener, **options):
+    halving = SuccessiveHalving(screener, min_evaluations=200, eta=2, attempts=1, tolerance=-1.0, **options)
+    # A generator: rung 0 must stream the records rather than list them
+    return halving.run(iter(LIBRARY), seed=0, dock_threads=True)
+
+
+def test_evaluations_are_the_amounts_spent(screener):
+    results = run(screener)
+    assert sorted(results['Compound']) == sorted(name for name, _ in LIBRARY)
+    assert results['Rung'].max() >= 1
+    # Each search stays within its budget, so compound totals are bounded by the rungs it reached
+    limits = [sum(200 * 2 ** r for r in range(rung + 1)) for rung in results['Rung']]
+    assert (results['Evaluations'] > 0).all()
+    assert (results['Evaluations'] <= limits).all()
+    assert results['Best_Score'].is_monotonic_increasing
+
+
+def test_budget_counts_spent_evaluations(screener):
+    results = run(screener, budget=4 * 200 + 1)
+    assert (results['Rung'] == 0).all()
+    assert results['Evaluations'].sum() <= 4 * 200
+
+
+def test_adaptive_columns_are_stored(screener, tmp_path):
+    store = ResultsStore(str(tmp_path), ADAPTIVE_SCHEMA)
+    store.append(run(screener, max_rungs=2))
+    stored = store.read()
+    assert {'Rung', 'Evaluations', 'Converged'} <= set(stored.columns)
+    assert stored['Evaluations'].gt(0).all()
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from checkpoint import CHECKPOINT_FILE, Checkpoint
+from results_store import SCREENING_SCHEMA, ResultsStore
+
+LIBRARY = [('Serotonin', 'NCCc1c[nH]c2ccc(O)cc12'), ('DMT', 'CN(C)CCc1c[nH]c2ccccc12'),
+           ('Psilocin', 'CN(C)CCc1c[nH]c2cccc(O)c12'), ('Tryptamine', 'NCCc1c[nH]c2ccccc12'),
+           ('Bufotenin', 'CN(C)CCc1c[nH]c2ccc(O)cc12')]
+OPTIONS = {'batch_size': 2, 'seed': 7, 'attempts': 1, 'max_evaluations': 300, 'dock_threads': True}
+
+
+def ranked(path):
+    rows = ResultsStore(str(path), SCREENING_SCHEMA).read()
+    return rows.sort_values('Compound').reset_index(drop=True)
+
+
+def test_resume_after_crash_matches_uninterrupted_run(screener, tmp_path):
+    library = tmp_path / 'library.smi'
+    library.write_text(''.join(f'{smiles} {name}\n' for name, smiles in LIBRARY))
+    assert screener.screen_library(str(library), str(tmp_path / 'full'), **OPTIONS) == len(LIBRARY)
+
+    # Crash after the first chunk: later chunks exist on disk but the checkpoint never saw them
+    crashed = tmp_path / 'crashed'
+    screener.screen_library(str(library), str(crashed), **OPTIONS)
+    checkpoint = Checkpoint(os.path.join(crashed, CHECKPOINT_FILE))
+    state = checkpoint.load()
+    checkpoint.save(dict(state, completed=2, chunks=state['chunks'][:1]))
+
+    with pytest.raises(ValueError):
+        screener.screen_library(str(library), str(crashed), **OPTIONS)
+    assert screener.screen_library(str(library), str(crashed), resume=True, **OPTIONS) == len(LIBRARY)
+    assert len(ResultsStore(str(crashed), SCREENING_SCHEMA).chunks()) == 3
+    resumed, full = ranked(crashed), ranked(tmp_path / 'full')
+    assert resumed['Compound'].tolist() == full['Compound'].tolist()
+    assert resumed['Best_Score'].tolist() == full['Best_Score'].tolist()
@@ -0,0 +1,15 @@
+import numpy as np
+
+from docking_results import DockingResults
+from scoring_grid import ENERGY_TERMS
+
+
+def test_exports_share_columns():
+    rng = np.random.default_rng(0)
+    results = DockingResults.from_poses(rng.normal(size=(5, len(ENERGY_TERMS))), rng.normal(size=(5, 7, 3)),
+                                        {'MW': 176.2, 'LogP': 0.5}, np.ones((5, 2), dtype=np.uint64))
+    table = results.to_arrow()
+    frame = results.to_pandas(coords=True)
+    assert set(table.column_names) - {'Interaction_FP'} == set(frame.columns)
+    assert set(table.column_names) <= set(results.to_columns('Serotonin', 'NCCc1c[nH]c2ccc(O)cc12'))
+    np.testing.assert_array_equal(table.column('Property_MW').to_numpy(), frame['Property_MW'].to_numpy())
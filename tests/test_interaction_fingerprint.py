@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from docking_results import DockingResults
+from interaction_fingerprint import popcount, rank_by_similarity, tanimoto
+from results_store import POSE_SCHEMA, ResultsStore
+from scoring_grid import ENERGY_TERMS
+
+
+def reference_tanimoto(a, b):
+    a, b = int.from_bytes(a.tobytes(), 'little'), int.from_bytes(b.tobytes(), 'little')
+    union = bin(a | b).count('1')
+    return bin(a & b).count('1') / union if union else 1.0
+
+
+def test_tanimoto_matches_bitwise_definition():
+    rng = np.random.default_rng(0)
+    fingerprints = rng.integers(0, 1 << 63, size=(300, 3), dtype=np.uint64) & rng.integers(
+        0, 1 << 63, size=(300, 3), dtype=np.uint64)
+    reference = fingerprints[7]
+    assert popcount(fingerprints[:1])[0] == sum(bin(int(word)).count('1') for word in fingerprints[0])
+    expected = [reference_tanimoto(row, reference) for row in fingerprints]
+    np.testing.assert_allclose(tanimoto(fingerprints, reference, block_size=64), expected, rtol=1e-6)
+
+    top, similarity = rank_by_similarity(fingerprints, reference, top_k=5)
+    assert top[0] == 7 and similarity[0] == 1.0
+    assert list(similarity) == sorted(similarity, reverse=True)
+
+
+def test_docked_fingerprints_rank_from_the_store(docking, tmp_path):
+    docking.set_ligand(*docking.load_ligand('NCCc1c[nH]c2ccc(O)cc12'))
+    poses = docking.run_docking_simulation(n_poses=5, max_evaluations=2000, seed=0)
+    assert poses.fingerprints.shape[1] == docking.fingerprinter.n_words
+    assert popcount(poses.fingerprints).min() > 0  # every pose touches the pocket
+    assert docking.fingerprinter.explain(poses.fingerprints[0])
+
+    # A chunk from before fingerprints were stored is skipped, not mixed in
+    old = ResultsStore(str(tmp_path), [column for column in POSE_SCHEMA if column[0] != 'Interaction_FP'])
+    old.append(DockingResults(np.zeros((2, len(ENERGY_TERMS))), poses.coords[:2]).to_columns('old', 'C'))
+    store = ResultsStore(str(tmp_path))
+    store.append(poses.to_columns('Serotonin', 'NCCc1c[nH]c2ccc(O)cc12'))
+    fingerprints, kept = store.read_array('Interaction_FP', width=poses.fingerprints.shape[1])
+    assert kept.tolist() == [False] * 2 + [True] * 5
+    np.testing.assert_array_equal(fingerprints, poses.fingerprints)
+    assert store.array_width('Interaction_FP', [('Compound', '==', 'old')]) == 0
+
+
+def test_find_similar_poses_ranks_the_reference_first(docking, tmp_path):
+    pytest.importorskip('matplotlib')
+    pytest.importorskip('seaborn')
+    from advanced_analysis import DockingAnalyzer
+
+    store = ResultsStore(str(tmp_path))
+    for run, (name, smiles) in enumerate([('Ketanserin', 'NCCc1c[nH]c2ccc(O)cc12'),
+                                          ('DMT', 'CN(C)CCc1c[nH]c2ccccc12')]):
+        docking.set_ligand(*docking.load_ligand(smiles))
+        store.append(docking.run_docking_simulation(n_poses=3, max_evaluations=1000, seed=run).to_columns(
+            name, smiles, run))
+    similar = DockingAnalyzer(str(tmp_path)).find_similar_poses('Ketanserin', top_k=3)
+    assert similar['Compound'].iloc[0] == 'Ketanserin' and similar['Tanimoto'].iloc[0] == 1.0
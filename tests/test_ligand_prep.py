@@ -0,0 +1,24 @@
+from ligand_prep import LigandCache
+
+SMILES = ['CCO', 'CCCO', 'c1ccccc1O', 'CCN', 'NCCc1c[nH]c2ccc(O)cc12', 'CN(C)CCc1c[nH]c2ccccc12']
+
+
+def stored_bytes(cache):
+    db = cache._db()
+    total = db.execute("SELECT value FROM cache_stats WHERE name = 'bytes'").fetchone()[0]
+    return total, db.execute('SELECT COALESCE(SUM(size), 0) FROM ligands').fetchone()[0]
+
+
+def test_disk_tier_evicts_by_running_total(tmp_path):
+    cache = LigandCache(str(tmp_path / 'ligands.sqlite'), max_entries=1, max_bytes=1500)
+    for smiles in SMILES:
+        cache.get(smiles)
+        total, actual = stored_bytes(cache)
+        assert total == actual <= 1500
+    # The newest ligand survives eviction and comes back from disk
+    cache.memory.clear()
+    mol, descriptors = cache.get(SMILES[-1])
+    assert cache.hits['disk'] == 1 and mol.GetNumConformers() == 1
+
+    cache.clear()
+    assert stored_bytes(cache) == (0, 0) and not cache.memory
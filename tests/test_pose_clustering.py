@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from rdkit import Chem
+
+from ligand_prep import canonical_smiles, embed_ligand
+from pose_clustering import butina_cluster, cluster_poses, leader_cluster, pairwise_rmsd, symmetry_permutations
+
+FIVE_MEO_DMT = 'CN(C)CCc1c[nH]c2ccc(OC)cc12'  # not canonical: atom order differs from the embedded ligand
+
+
+def embedded_pose(smiles):
+    """Coordinates of the ligand as LigandCache embeds it, in canonical atom order"""
+    return embed_ligand(canonical_smiles(smiles)).GetConformer().GetPositions()[None].astype(np.float32)
+
+
+def test_symmetry_rmsd_uses_canonical_atom_order():
+    pose = embedded_pose(FIVE_MEO_DMT)
+    permutations = symmetry_permutations(FIVE_MEO_DMT)
+    heavy = pose[:, :permutations.shape[1]]
+    # Swapping symmetry-equivalent atoms (the two N-methyls) must not change the pose
+    mol = Chem.MolFromSmiles(canonical_smiles(FIVE_MEO_DMT))
+    swap = [match for match in mol.GetSubstructMatches(mol, uniquify=False) if match != tuple(range(len(match)))][0]
+    swapped = heavy[:, list(swap)]
+    assert pairwise_rmsd(heavy, swapped)[0, 0] > 0.5
+    assert pairwise_rmsd(heavy, swapped, permutations)[0, 0] == pytest.approx(0.0, abs=1e-2)
+
+
+def test_cluster_poses_rejects_mismatched_atom_counts():
+    pose = embedded_pose(FIVE_MEO_DMT)
+    labels, representatives, populations = cluster_poses(np.repeat(pose, 3, axis=0), FIVE_MEO_DMT)
+    assert populations.tolist() == [3]
+    with pytest.raises(ValueError):
+        cluster_poses(pose[:, :-1], FIVE_MEO_DMT)
+
+
+def test_block_size_bounds_memory_without_changing_clusters():
+    rng = np.random.default_rng(0)
+    modes = rng.normal(scale=4, size=(8, 10, 3))
+    coords = (modes[rng.integers(0, 8, 300)] + rng.normal(scale=0.6, size=(300, 10, 3))).astype(np.float32)
+    scores = rng.normal(size=300)
+    for cluster, args in ((butina_cluster, ()), (leader_cluster, (None, scores))):
+        labels, representatives = cluster(coords, 2.0, *args)
+        tiled_labels, tiled_representatives = cluster(coords, 2.0, *args, block_size=17)
+        np.testing.assert_array_equal(labels, tiled_labels)
+        np.testing.assert_array_equal(representatives, tiled_representatives)
+        # Every pose lies within threshold of its cluster's representative
+        rmsd = pairwise_rmsd(coords, coords[representatives])[np.arange(len(coords)), labels]
+        assert np.all(rmsd < 2.0)
@@ -0,0 +1,13 @@
+import pytest
+
+SEROTONIN = 'NCCc1c[nH]c2ccc(O)cc12'
+LSD = 'CCN(CC)C(=O)C1CN(C)C2Cc3c[nH]c4cccc(C2=C1)c34'
+
+
+@pytest.mark.parametrize('smiles', [SEROTONIN, LSD])
+@pytest.mark.parametrize('max_evaluations', [100, 500, 1500])
+def test_search_respects_evaluation_budget(docking, smiles, max_evaluations):
+    docking.set_ligand(*docking.load_ligand(smiles))
+    poses = docking.run_docking_simulation(n_poses=3, max_evaluations=max_evaluations, seed=0)
+    assert len(poses)
+    assert docking.search_stats['evaluations'] <= max_evaluations
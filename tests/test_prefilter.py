@@ -0,0 +1,38 @@
+import numpy as np
+
+from prefilter import Prefilter, descriptor_table
+
+SEROTONIN = 'NCCc1c[nH]c2ccc(O)cc12'
+RECORDS = [('serotonin', SEROTONIN),
+           ('broken', 'C1CC('),
+           ('wax', 'C' * 40),                    # MW and LogP over the limits: two Lipinski violations
+           ('lipid', 'CCCCCCCCCCCCCCCCCCCC'),     # one Lipinski violation is tolerated, 17 rotatable bonds are not
+           ('dmt', 'CN(C)CCc1c[nH]c2ccccc12')]
+
+
+def test_rule_sets_reject_with_the_first_failed_rule_set():
+    prefilter = Prefilter(['lipinski', 'veber'])
+    reasons = dict((name, reason) for name, _, reason in prefilter.annotate(RECORDS, batch_size=2))
+    assert reasons == {'serotonin': None, 'broken': 'invalid', 'wax': 'lipinski', 'lipid': 'veber', 'dmt': None}
+    assert prefilter.seen == 5
+    assert prefilter.rejections['lipinski:MW<=500'] == 1
+    assert prefilter.report().startswith('Prefilter: 2 of 5 compounds passed')
+
+
+def test_cns_mpo_scores_tryptamines_as_cns_like():
+    columns = descriptor_table([SEROTONIN, 'C' * 40])
+    assert 4 <= columns['CNS_MPO'][0] <= 6
+    assert columns['pKa'][0] > 0  # basic amine recognised
+    assert np.all((columns['CNS_MPO'] >= 0) & (columns['CNS_MPO'] <= 6))
+
+
+def test_rejected_compounds_are_never_docked(screener):
+    screener.prefilter = Prefilter(['lipinski', 'veber'])
+    try:
+        rows = list(screener.screen_records(RECORDS, attempts=1, max_evaluations=200, seed=0, dock_threads=True))
+    finally:
+        screener.prefilter = None
+    status = {row['Compound']: row['Status'] for row in rows}
+    assert status == {'serotonin': 'ok', 'broken': 'rejected: invalid', 'wax': 'rejected: lipinski',
+                      'lipid': 'rejected: veber', 'dmt': 'ok'}
+    assert all(row['Evaluations'] == 0 for row in rows if row['Status'] != 'ok')
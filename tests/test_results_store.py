@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from docking_results import DockingResults
+from results_store import ResultsStore
+from scoring_grid import ENERGY_TERMS
+
+
+def poses(n, n_atoms, seed):
+    rng = np.random.default_rng(seed)
+    return DockingResults(rng.normal(size=(n, len(ENERGY_TERMS))), rng.normal(size=(n, n_atoms, 3)),
+                          rng.integers(0, 1 << 62, size=(n, 2), dtype=np.uint64))
+
+
+@pytest.mark.parametrize('format', ['parquet', 'npz'])
+def test_read_array_matches_read(tmp_path, format):
+    store = ResultsStore(str(tmp_path), format=format)
+    for run, (smiles, n_atoms) in enumerate([('CCO', 9), ('c1ccccc1', 12), ('CCO', 9)]):
+        store.append(poses(4, n_atoms, run).to_columns(smiles, smiles, run))
+
+    filters = [('SMILES', '==', 'CCO'), ('Pose', '>', 1)]
+    rows = store.read(columns=['Coordinates', 'Interaction_FP'], filters=filters)
+    coords = store.read_array('Coordinates', filters)
+    assert coords.shape == (6, 9, 3)
+    np.testing.assert_array_equal(coords, np.stack(rows['Coordinates'].to_list()))
+    np.testing.assert_array_equal(store.read_array('Interaction_FP', filters),
+                                  np.stack(rows['Interaction_FP'].to_list()))
+    with pytest.raises(ValueError):
+        store.read_array('Coordinates')
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from results_store import ResultsStore
+from streaming_stats import SampledTrace, ScoreSummary, summarize_store
+from test_results_store import poses
+
+
+def test_store_summary_matches_pandas(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    for run in range(6):
+        store.append(poses(50, 6, run).to_columns('CCO', 'CCO', run))
+    summary = summarize_store(str(tmp_path), filters=[('Pose', '<=', 40)], columns=['Run'], top_k=3)
+
+    scores = store.read(columns=['Run', 'Pose', 'Binding_Score'])
+    scores = scores[scores['Pose'] <= 40]
+    exact = scores['Binding_Score']
+    stats = summary.summary()
+    assert summary.count == len(exact) == 240
+    assert stats['Mean'] == pytest.approx(exact.mean())
+    assert stats['Std Dev'] == pytest.approx(exact.std())
+    assert stats['Best Score'] == exact.min() and stats['Worst Score'] == exact.max()
+    assert stats['Median'] == pytest.approx(exact.median(), abs=0.05 * exact.std())
+    assert summary.below[-8.0] == int((exact < -8.0).sum())
+    assert summary.top.rows['Binding_Score'].tolist() == sorted(exact)[:3]
+
+
+def test_merged_shard_summaries_equal_one_pass():
+    values = np.random.default_rng(0).normal(-7, 1.5, size=20000)
+    whole, shards = ScoreSummary(), [ScoreSummary() for _ in range(4)]
+    for batch in np.array_split(values, 16):
+        whole.update(pd.DataFrame({'Binding_Score': batch}))
+    for shard, part in zip(shards, np.array_split(values, 4)):
+        shard.update(pd.DataFrame({'Binding_Score': part}))
+    merged = shards[0]
+    for shard in shards[1:]:
+        merged.merge(shard)
+
+    assert merged.count == whole.count == len(values)
+    assert merged.stats.mean == pytest.approx(values.mean())
+    assert merged.stats.std == pytest.approx(values.std(ddof=1))
+    assert merged.below == whole.below
+    # Tail quantiles stay accurate after compression
+    for q in (0.001, 0.01, 0.5, 0.99):
+        assert merged.digest.quantile(q) == pytest.approx(np.quantile(values, q), abs=0.05)
+
+
+def test_sampled_trace_stays_bounded_and_evenly_spaced():
+    trace = SampledTrace(max_points=100)
+    for start in range(0, 10000, 37):
+        x = np.arange(start, min(start + 37, 10000))
+        trace.update(x, -x)
+    assert 50 <= len(trace.x) <= 100
+    assert len(set(np.diff(trace.x))) == 1 and trace.x[0] == 0
+    assert trace.y == [-x for x in trace.x]
@@ -0,0 +1,48 @@
+import pytest
+
+from results_store import SCREENING_SCHEMA, ResultsStore
+from work_queue import ShardQueue, merge_results, screen_shard
+
+LIBRARY = [('Serotonin', 'NCCc1c[nH]c2ccc(O)cc12'), ('DMT', 'CN(C)CCc1c[nH]c2ccccc12'),
+           ('Psilocin', 'CN(C)CCc1c[nH]c2cccc(O)c12'), ('Tryptamine', 'NCCc1c[nH]c2ccccc12'),
+           ('Bufotenin', 'CN(C)CCc1c[nH]c2ccc(O)cc12')]
+OPTIONS = {'attempts': 1, 'max_evaluations': 300, 'dock_threads': True}
+
+
+@pytest.fixture
+def library(tmp_path):
+    path = tmp_path / 'library.smi'
+    path.write_text(''.join(f'{smiles} {name}\n' for name, smiles in LIBRARY))
+    return str(path)
+
+
+def test_expired_claims_are_reclaimed_and_the_late_owner_loses(library, tmp_path):
+    queue = ShardQueue.create(library, str(tmp_path / 'queue'), shard_size=2, seed=7)
+    assert queue.status() == {'pending': 3, 'claimed': 0, 'done': 0}
+    shard = queue.claim('slow')
+    assert queue.reclaim_expired(lease=1e9) == 0
+    assert queue.reclaim_expired(lease=0) == 1
+    assert queue.claim('fast') == shard
+    assert not queue.heartbeat(shard, 'slow')
+    assert not queue.complete(shard, 'slow')
+    assert queue.complete(shard, 'fast')
+    assert queue.status() == {'pending': 2, 'claimed': 0, 'done': 1}
+
+
+def test_sharded_screen_reproduces_a_single_process_screen(screener, library, tmp_path):
+    queue = ShardQueue.create(library, str(tmp_path / 'queue'), shard_size=2, seed=7)
+    with pytest.raises(ValueError):
+        merge_results(queue.path, str(tmp_path / 'merged'))
+    while True:
+        shard = queue.claim('worker')
+        if shard is None:
+            break
+        assert screen_shard(queue, shard, 'worker', screener, batch_size=2, **OPTIONS)
+    assert queue.status() == {'pending': 0, 'claimed': 0, 'done': 3}
+
+    merged = merge_results(queue.path, str(tmp_path / 'merged'))
+    screener.screen_library(library, str(tmp_path / 'single'), batch_size=2, seed=7, **OPTIONS)
+    single = ResultsStore(str(tmp_path / 'single'), SCREENING_SCHEMA).read()
+    single = single.sort_values('Best_Score', kind='stable').reset_index(drop=True)
+    assert merged['Compound'].tolist() == single['Compound'].tolist()
+    assert merged['Best_Score'].tolist() == single['Best_Score'].tolist()